@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Teste da Análise do Questionário - Programa Equilíbrio
+Compara o motor de regras (analise_questionario.py) com a lógica original
+de gerar_analise() em todas as combinações de respostas relevantes
+"""
+
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from analise_questionario import REGRAS_PADRAO, MotorAnalise, np
+import pontuar_questionarios
+
+SCRIPT_PONTUACAO = os.path.join(os.path.dirname(__file__), '..', 'pontuar_questionarios.py')
+
+# Valores testados por pergunta: os que acionam regra, um que não aciona,
+# ausência de resposta e valores não hashable (listas e objetos no JSON)
+VALORES = {
+    '1': ['alta_carga', 'baixa_carga', None, ['alta_carga'], {'valor': 'alta_carga'}],
+    '2': ['frequencia_alta', 'frequencia_moderada', 'nunca', None, ['frequencia_alta']],
+    '3': ['critico', 'moderado', 'adequado', None, {'valor': 'critico'}],
+    '6': ['frequentes', 'ocasionais', 'raros', None, ['frequentes']],
+    '7': ['nunca', 'nao_recente', 'recente', None, {}],
+}
+
+def analise_original(respostas):
+    """Regras de gerar_analise() antes do motor de regras (sem data_diagnostico)"""
+    questoes_criticas = 0
+    acoes = set()
+    areas = set()
+    if respostas.get('1') == 'alta_carga':
+        questoes_criticas += 1
+        acoes.add("Programa: Comunicação Não Violenta e Segurança Psicológica")
+        areas.add("Saúde Mental")
+    if respostas.get('2') in ['frequencia_alta', 'frequencia_moderada']:
+        questoes_criticas += 2
+        acoes.add("Programa: Prevenção e Manejo do Estresse Ocupacional")
+        areas.add("Saúde Mental")
+    if respostas.get('3') in ['critico', 'moderado']:
+        questoes_criticas += 1
+        areas.add("Saúde Mental")
+    if respostas.get('6') in ['frequentes', 'ocasionais']:
+        questoes_criticas += 1
+        acoes.add("Programa: Avaliação Ergonômica Completa")
+        areas.add("Ergonomia")
+    if respostas.get('7') in ['nunca', 'nao_recente']:
+        questoes_criticas += 1
+        acoes.add("Programa: Implementação de Ergonomia no Trabalho")
+        areas.add("Ergonomia")
+    if not acoes:
+        acoes.add("Programa: Promoção de Bem-estar no Trabalho")
+    nivel = "Alto" if questoes_criticas >= 4 else "Moderado" if questoes_criticas >= 2 else "Baixo"
+    return questoes_criticas, nivel, areas, acoes
+
+def combinacoes():
+    perguntas = list(VALORES)
+    for valores in itertools.product(*VALORES.values()):
+        yield {pergunta: valor for pergunta, valor in zip(perguntas, valores) if valor is not None}
+
+def comparar(resultado, respostas):
+    esperado = analise_original(respostas)
+    obtido = (resultado['questoes_criticas'], resultado['nivel_risco'],
+              set(resultado['areas_foco']), set(resultado['acoes_recomendadas']))
+    return obtido == esperado
+
+def test_equivalencia():
+    """avaliar() dá o mesmo resultado da lógica original, inclusive com respostas não hashable"""
+    print("🧪 Testando equivalência com a lógica original...")
+    motor = MotorAnalise()
+    divergentes = []
+    total = 0
+    for respostas in combinacoes():
+        total += 1
+        try:
+            if not comparar(motor.avaliar(respostas), respostas):
+                divergentes.append(respostas)
+        except Exception as e:
+            divergentes.append((respostas, repr(e)))
+    ok = not divergentes
+    print(f"   {'✅' if ok else '❌'} {total} combinações, {len(divergentes)} divergente(s) {divergentes[:3]}")
+    return ok
+
+def test_lote():
+    """avaliar_lote() (NumPy) dá o mesmo resultado de avaliar() linha a linha"""
+    print("🧪 Testando avaliação em lote...")
+    if np is None:
+        print("   ⚠️ NumPy não instalado - avaliação em lote indisponível")
+        return True
+    motor = MotorAnalise()
+    lista = list(combinacoes())
+    em_lote = list(motor.resultados_lote(motor.avaliar_lote(lista)))
+    divergentes = sum(1 for resultado, respostas in zip(em_lote, lista) if resultado != motor.avaliar(respostas))
+    ok = len(em_lote) == len(lista) and divergentes == 0
+    print(f"   {'✅' if ok else '❌'} {len(lista)} respostas em lote, {divergentes} divergente(s)")
+    return ok
+
+class MotorComFalha(MotorAnalise):
+    """Motor que falha em um registro específico (resposta '1' = 'falha')"""
+    def avaliar(self, respostas):
+        if respostas.get('1') == 'falha':
+            raise RuntimeError('registro com falha')
+        return super().avaliar(respostas)
+
+    def avaliar_lote(self, lista_respostas):
+        for respostas in lista_respostas:
+            self.avaliar(respostas)
+        return super().avaliar_lote(lista_respostas)
+
+def test_erro_por_registro():
+    """Um registro que falha na pontuação vira erro da sua linha, sem derrubar o bloco"""
+    print("🧪 Testando erro por registro na pontuação em lote...")
+    pontuar_questionarios._iniciar_processo(REGRAS_PADRAO, {'formato_saida': 'jsonl', 'manter': ['id']})
+    pontuar_questionarios._motor = MotorComFalha()
+    linhas = [json.dumps({'id': indice, 'respostas': {'1': valor}}) + '\n'
+              for indice, valor in enumerate(['alta_carga', 'falha', 'baixa_carga'], 1)]
+    texto, pontuadas, erros = pontuar_questionarios.pontuar_bloco((1, linhas, None))
+    saida = [json.loads(linha) for linha in texto.splitlines()]
+    ok = pontuadas == 2 and [numero for numero, _ in erros] == [2] and [item.get('id') for item in saida] == [1, None, 3]
+    print(f"   {'✅' if ok else '❌'} Pontuadas: {pontuadas} - erros: {erros}")
+    return ok
+
+def test_cli_saida_csv():
+    """Na saída CSV, linhas inválidas vão para a saída de erros e entram no resumo"""
+    print("🧪 Testando a CLI com saída CSV...")
+    pasta = tempfile.mkdtemp()
+    entrada = os.path.join(pasta, 'respostas.jsonl')
+    with open(entrada, 'w', encoding='utf-8') as arquivo:
+        arquivo.write('{"id": 1, "respostas": {"1": "alta_carga", "2": ["frequencia_alta"]}}\n')
+        arquivo.write('isto não é JSON\n')
+        arquivo.write('{"id": 3, "respostas": {"7": "nunca"}}\n')
+    processo = subprocess.run(
+        [sys.executable, SCRIPT_PONTUACAO, entrada, '--saida', os.path.join(pasta, 'analises.csv'),
+         '--manter', 'id', '--processos', '2', '--lote', '1'],
+        capture_output=True, text=True, timeout=60
+    )
+    with open(os.path.join(pasta, 'analises.csv'), encoding='utf-8') as arquivo:
+        linhas_csv = arquivo.read().splitlines()
+    ok = processo.returncode == 0 and len(linhas_csv) == 3
+    ok = ok and 'Linha 2' in processo.stderr and '2 respostas pontuadas' in processo.stderr and '1 linhas com erro' in processo.stderr
+    print(f"   {'✅' if ok else '❌'} Código {processo.returncode}, {len(linhas_csv) - 1} linhas no CSV - stderr: {processo.stderr.strip()!r}")
+    return ok
+
+def main_teste():
+    """Função principal"""
+    print("=" * 60)
+    print("🧪 TESTE DA ANÁLISE DO QUESTIONÁRIO")
+    print("=" * 60)
+
+    resultados = [
+        ("Equivalência com a lógica original", test_equivalencia()),
+        ("Avaliação em lote", test_lote()),
+        ("Erro por registro", test_erro_por_registro()),
+        ("CLI com saída CSV", test_cli_saida_csv()),
+    ]
+
+    print("\n" + "=" * 60)
+    for nome, ok in resultados:
+        print(f"{'✅ PASSOU' if ok else '❌ FALHOU'} - {nome}")
+
+    if all(ok for _, ok in resultados):
+        print("\n🎉 TODOS OS TESTES DA ANÁLISE PASSARAM!")
+    else:
+        print("\n⚠️ ALGUNS TESTES FALHARAM!")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main_teste()
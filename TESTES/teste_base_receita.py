@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Teste da Base Local da Receita - Programa Equilíbrio
+Importa um dump mínimo no formato da Receita Federal (CSV e ZIP) com
+importar_cnpj_receita.py e verifica que consultar_cnpj_com_fallback
+responde pela base local, sem chamar as APIs externas
+"""
+
+import os
+import sys
+import tempfile
+import time
+import zipfile
+
+_pasta = tempfile.mkdtemp()
+os.environ['CNPJ_CACHE_PATH'] = os.path.join(_pasta, 'cache_teste.sqlite3')
+os.environ['CNPJ_OFFLINE_DB_PATH'] = os.path.join(_pasta, 'base_cnpj.sqlite3')
+_dump = os.path.join(_pasta, 'dump')
+os.makedirs(_dump)
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import main
+import importar_cnpj_receita
+
+CHAMADAS = []
+
+def provedor_falso(provedor, cnpj, prazo=None, nao_encontrado=None, sessao=None):
+    """Registra as chamadas que chegariam às APIs"""
+    CHAMADAS.append(main.limpar_cnpj(cnpj))
+    return None
+
+def estabelecimento(basico, ordem, dv, fantasia, situacao, logradouro):
+    """Linha de Estabelecimentos no layout do dump (30 colunas separadas por ;)"""
+    campos = [''] * 30
+    campos[0:6] = [basico, ordem, dv, '1', fantasia, situacao]
+    campos[10:12] = ['20100315', '8630504']
+    campos[13:22] = ['RUA', logradouro, '100', 'SALA 1', 'CENTRO', '01310100', 'SP', '7107', '11']
+    campos[22] = '33334444'
+    campos[27] = 'CONTATO@TESTE.COM'
+    return ';'.join(f'"{campo}"' for campo in campos)
+
+def escrever(nome, linhas):
+    caminho = os.path.join(_dump, nome)
+    with open(caminho, 'w', encoding='latin-1') as arquivo:
+        arquivo.write('\n'.join(linhas) + '\n')
+    return caminho
+
+def gerar_dump():
+    """Municípios e CNAEs descompactados; Empresas e Estabelecimentos em ZIP, como publicados"""
+    escrever('F.K03200$Z.D40510.MUNICCSV', ['"7107";"SAO PAULO"'])
+    escrever('F.K03200$Z.D40510.CNAECSV', ['"8630504";"Atividade odontológica"'])
+    empresas = escrever('K3241.K03200Y0.D40510.EMPRECSV', [
+        '"11222333";"EMPRESA TESTE LTDA";"2062";"49";"1000,00";"01";""',
+    ])
+    estabelecimentos = escrever('K3241.K03200Y0.D40510.ESTABELE', [
+        estabelecimento('11222333', '0001', '81', 'TESTE', '02', 'PAULISTA'),
+        estabelecimento('11222333', '0002', '62', 'FILIAL', '08', 'AUGUSTA'),
+    ])
+    for caminho, nome_zip in ((empresas, 'Empresas0.zip'), (estabelecimentos, 'Estabelecimentos0.zip')):
+        with zipfile.ZipFile(os.path.join(_dump, nome_zip), 'w') as arquivo_zip:
+            arquivo_zip.write(caminho, os.path.basename(caminho))
+        os.remove(caminho)
+
+def test_importacao():
+    """O importador lê CSV e ZIP da pasta e gera a base no destino"""
+    print("🧪 Testando importação do dump...")
+    gerar_dump()
+    ok = importar_cnpj_receita.importar([_dump], main.CNPJ_OFFLINE_DB_PATH)
+    ok = ok and os.path.exists(main.CNPJ_OFFLINE_DB_PATH)
+    ok = ok and not os.path.exists(main.CNPJ_OFFLINE_DB_PATH + '.importando')
+    print(f"   {'✅' if ok else '❌'} Base gerada: {main.CNPJ_OFFLINE_DB_PATH}")
+    return ok
+
+def test_consulta_local():
+    """O CNPJ presente na base é respondido localmente, no formato dos provedores"""
+    print("🧪 Testando consulta pela base local...")
+    CHAMADAS.clear()
+    dados = main.consultar_cnpj_com_fallback("11.222.333/0001-81") or {}
+    endereco = dados.get('endereco', {})
+    ok = not CHAMADAS and dados.get('razao_social') == 'EMPRESA TESTE LTDA' and dados.get('situacao') == 'ATIVA'
+    ok = ok and dados.get('atividade_principal') == 'Atividade odontológica' and dados.get('data_abertura') == '2010-03-15'
+    ok = ok and endereco.get('logradouro') == 'RUA PAULISTA' and endereco.get('municipio') == 'SAO PAULO'
+    ok = ok and dados.get('telefone') == '(11) 33334444' and dados.get('email') == 'contato@teste.com'
+    print(f"   {'✅' if ok else '❌'} Chamadas às APIs: {CHAMADAS} - dados: {dados}")
+    return ok
+
+def test_situacao_e_ausentes():
+    """A situação numérica vira texto; CNPJ fora da base segue para as APIs"""
+    print("🧪 Testando situação cadastral e CNPJ ausente...")
+    CHAMADAS.clear()
+    filial = main.consultar_base_receita_local("11222333000262") or {}
+    ausente = main.consultar_cnpj_com_fallback("07526557000100")
+    ok = filial.get('situacao') == 'BAIXADA' and ausente is None and bool(CHAMADAS)
+    print(f"   {'✅' if ok else '❌'} Filial: {filial.get('situacao')} - chamadas para o ausente: {len(CHAMADAS)}")
+    return ok
+
+def test_reimportacao():
+    """Uma nova importação substitui a base e a conexão aberta é renovada"""
+    print("🧪 Testando reimportação com a aplicação em execução...")
+    escrever('K3241.K03200Y0.D40610.EMPRECSV', ['"11222333";"EMPRESA TESTE RENOMEADA LTDA";"2062";"49";"1000,00";"01";""'])
+    time.sleep(0.01)
+    importar_cnpj_receita.importar([_dump], main.CNPJ_OFFLINE_DB_PATH)
+    dados = main.consultar_base_receita_local("11222333000181") or {}
+    ok = dados.get('razao_social') == 'EMPRESA TESTE RENOMEADA LTDA'
+    print(f"   {'✅' if ok else '❌'} Razão social após reimportação: {dados.get('razao_social')}")
+    return ok
+
+def main_teste():
+    """Função principal"""
+    print("=" * 60)
+    print("🧪 TESTE DA BASE LOCAL DA RECEITA")
+    print("=" * 60)
+
+    main.consultar_provedor_cnpj = provedor_falso
+
+    resultados = [
+        ("Importação do dump", test_importacao()),
+        ("Consulta pela base local", test_consulta_local()),
+        ("Situação e CNPJ ausente", test_situacao_e_ausentes()),
+        ("Reimportação", test_reimportacao()),
+    ]
+
+    print("\n" + "=" * 60)
+    for nome, ok in resultados:
+        print(f"{'✅ PASSOU' if ok else '❌ FALHOU'} - {nome}")
+
+    if all(ok for _, ok in resultados):
+        print("\n🎉 TODOS OS TESTES DA BASE LOCAL PASSARAM!")
+    else:
+        print("\n⚠️ ALGUNS TESTES FALHARAM!")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main_teste()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Teste do Cache de CNPJ - Programa Equilíbrio
+Verifica o cache persistente (SQLite) usado por consultar_cnpj_com_fallback,
+sem fazer chamadas às APIs externas
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+# Cache isolado em arquivo temporário
+os.environ['CNPJ_CACHE_PATH'] = os.path.join(tempfile.mkdtemp(), 'cache_teste.sqlite3')
+os.environ['CNPJ_CACHE_MAX_ENTRIES'] = '2'
+# Sem limite de taxa: os provedores falsos podem ser chamados à vontade
+os.environ['CNPJ_RATE_LIMIT_ENABLED'] = 'false'
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import main
+
+CHAMADAS = []
+
+def provedor_falso(provedor, cnpj, prazo=None, nao_encontrado=None, sessao=None):
+    """Substitui a consulta aos provedores registrando cada chamada"""
+    CHAMADAS.append(main.limpar_cnpj(cnpj))
+    return {'razao_social': 'EMPRESA TESTE LTDA', 'cnpj': main.limpar_cnpj(cnpj), 'situacao': 'ATIVA'}
+
+def test_cache_hit():
+    """A segunda consulta do mesmo CNPJ (com ou sem formatação) não chama a API"""
+    print("🧪 Testando acerto de cache...")
+    CHAMADAS.clear()
+    main.consultar_cnpj_com_fallback("11.222.333/0001-81")
+    main.consultar_cnpj_com_fallback("11222333000181")
+    ok = CHAMADAS == ["11222333000181"]
+    print(f"   {'✅' if ok else '❌'} Chamadas às APIs: {CHAMADAS}")
+    return ok
+
+def test_limite_lru():
+    """Com limite de 2 entradas, o CNPJ menos usado é descartado"""
+    print("🧪 Testando limite LRU...")
+    CHAMADAS.clear()
+    main.consultar_cnpj_com_fallback("07526557000100")
+    main.consultar_cnpj_com_fallback("33000167000101")
+    main.consultar_cnpj_com_fallback("11222333000181")
+    # O mais recente continua no cache; o primeiro foi descartado e volta às APIs
+    main.consultar_cnpj_com_fallback("11222333000181")
+    main.consultar_cnpj_com_fallback("07526557000100")
+    ok = CHAMADAS == ["07526557000100", "33000167000101", "11222333000181", "07526557000100"]
+    print(f"   {'✅' if ok else '❌'} Chamadas às APIs: {CHAMADAS}")
+    return ok
+
+def test_persistencia():
+    """Uma nova instância do cache (como após um reinício) lê o mesmo arquivo"""
+    print("🧪 Testando persistência entre instâncias...")
+    novo_cache = main.CacheCNPJ(main.CNPJ_CACHE_PATH, main.CNPJ_CACHE_TTL, main.CNPJ_CACHE_MAX_ENTRIES)
+    dados = novo_cache.obter("11222333000181")
+    ok = bool(dados) and dados.get('razao_social') == 'EMPRESA TESTE LTDA'
+    print(f"   {'✅' if ok else '❌'} Dados lidos: {dados}")
+    return ok
+
+def test_expiracao():
+    """Entradas mais antigas que o TTL não são devolvidas"""
+    print("🧪 Testando expiração por TTL...")
+    cache_expirado = main.CacheCNPJ(main.CNPJ_CACHE_PATH, -1, main.CNPJ_CACHE_MAX_ENTRIES)
+    ok = cache_expirado.obter("11222333000181") is None
+    print(f"   {'✅' if ok else '❌'} Entrada expirada ignorada")
+    return ok
+
+def test_cache_negativo():
+    """CNPJ que um provedor afirma não existir vai para o cache negativo"""
+    print("🧪 Testando cache negativo...")
+
+    def provedor_sem_cnpj(provedor, cnpj, prazo=None, nao_encontrado=None, sessao=None):
+        CHAMADAS.append(provedor.nome)
+        nao_encontrado.add(provedor.nome)
+        return None
+
+    main.consultar_provedor_cnpj = provedor_sem_cnpj
+    CHAMADAS.clear()
+    primeira = main.consultar_cnpj_com_fallback("22222222000122")
+    segunda = main.consultar_cnpj_com_fallback("22222222000122")
+    main.consultar_provedor_cnpj = provedor_falso
+    quantidade = len(CHAMADAS)
+    ok = primeira is None and segunda is None and quantidade == len(main.provedores_registrados())
+    print(f"   {'✅' if ok else '❌'} {quantidade} chamada(s) em duas consultas")
+    return ok
+
+def test_nao_encontrado_por_consulta():
+    """Um "não encontrado" atrasado de uma disputa já vencida não vaza para a consulta seguinte"""
+    print("🧪 Testando isolamento do \"não encontrado\" entre consultas...")
+    cnpj = "33333333000133"
+    lento = main._provedores_cnpj_ordenados()[0].nome
+
+    def disputa(provedor, cnpj, prazo=None, nao_encontrado=None, sessao=None):
+        if provedor.nome == lento:
+            time.sleep(0.3)
+            nao_encontrado.add(provedor.nome)
+            return None
+        return {'razao_social': 'EMPRESA TESTE LTDA', 'cnpj': cnpj, 'situacao': 'ATIVA'}
+
+    def indisponivel(provedor, cnpj, prazo=None, nao_encontrado=None, sessao=None):
+        time.sleep(0.4)
+        return None
+
+    main.consultar_provedor_cnpj = disputa
+    main.CNPJ_HEDGE_ENABLED, main.CNPJ_HEDGE_DELAY = True, 0.05
+    try:
+        vencedor = main.consultar_cnpj_com_fallback(cnpj)
+    finally:
+        main.CNPJ_HEDGE_ENABLED = False
+    # Nova consulta (provedores fora do ar) enquanto o perdedor da disputa ainda responde
+    main.cache_cnpj.remover(cnpj)
+    main.consultar_provedor_cnpj = indisponivel
+    main.consultar_cnpj_com_fallback(cnpj)
+    main.consultar_provedor_cnpj = provedor_falso
+    negativo = main.cache_cnpj_negativo.obter(cnpj)
+    ok = bool(vencedor) and negativo is None
+    print(f"   {'✅' if ok else '❌'} Cache negativo após falha de rede: {negativo}")
+    return ok
+
+def test_revalidacao_em_segundo_plano():
+    """Registros vencidos são servidos na hora e revalidados uma única vez"""
+    print("🧪 Testando stale-while-revalidate...")
+    cnpj = "44444444000144"
+
+    def provedor_lento(provedor, cnpj, prazo=None, nao_encontrado=None, sessao=None):
+        CHAMADAS.append(main.limpar_cnpj(cnpj))
+        time.sleep(0.2)
+        return {'razao_social': 'EMPRESA TESTE LTDA', 'cnpj': main.limpar_cnpj(cnpj), 'situacao': 'ATIVA'}
+
+    soft_ttl_original, main.CNPJ_CACHE_SOFT_TTL = main.CNPJ_CACHE_SOFT_TTL, 1
+    main.consultar_provedor_cnpj = provedor_lento
+    try:
+        main.consultar_cnpj_com_fallback(cnpj)
+        time.sleep(1.1)
+        CHAMADAS.clear()
+        respostas = []
+        for _ in range(20):
+            inicio = time.time()
+            respostas.append((main.consultar_cnpj_com_fallback(cnpj), time.time() - inicio))
+            time.sleep(0.03)
+        time.sleep(0.5)
+    finally:
+        main.CNPJ_CACHE_SOFT_TTL = soft_ttl_original
+        main.consultar_provedor_cnpj = provedor_falso
+    imediatas = all(dados and duracao < 0.1 for dados, duracao in respostas)
+    ok = imediatas and CHAMADAS == [cnpj]
+    print(f"   {'✅' if ok else '❌'} 20 acertos vencidos, {len(CHAMADAS)} revalidação(ões) nas APIs")
+    return ok
+
+CNPJ_TRAVA = "11222333000181"
+
+def test_travas_entre_processos():
+    """A trava entre workers usa um número fixo de arquivos, qualquer que seja o número de CNPJs"""
+    print("🧪 Testando arquivos de trava entre processos...")
+    if main.fcntl is None:
+        print("   ⚠️ fcntl indisponível - sem travas entre processos")
+        return True
+    main.CNPJ_SINGLEFLIGHT_LOCK_DIR = os.path.join(tempfile.mkdtemp(), 'travas')
+    for indice in range(2000):
+        with main._trava_entre_processos(f"{indice:014d}") as travado:
+            assert travado
+    arquivos = len(os.listdir(main.CNPJ_SINGLEFLIGHT_LOCK_DIR))
+    # A mesma chave cai sempre no mesmo arquivo: a segunda trava desiste no prazo
+    with main._trava_entre_processos(CNPJ_TRAVA) as primeira:
+        with main._trava_entre_processos(CNPJ_TRAVA, prazo=time.monotonic() + 0.1) as segunda:
+            exclusiva = primeira and not segunda
+    ok = arquivos <= main.CNPJ_SINGLEFLIGHT_LOCK_FILES and exclusiva
+    print(f"   {'✅' if ok else '❌'} 2000 CNPJs em {arquivos} arquivo(s) de trava - exclusiva: {exclusiva}")
+    return ok
+
+def main_teste():
+    """Função principal"""
+    print("=" * 60)
+    print("🧪 TESTE DO CACHE DE CNPJ")
+    print("=" * 60)
+
+    main.consultar_provedor_cnpj = provedor_falso
+
+    resultados = [
+        ("Acerto de cache", test_cache_hit()),
+        ("Limite LRU", test_limite_lru()),
+        ("Persistência", test_persistencia()),
+        ("Expiração", test_expiracao()),
+        ("Cache negativo", test_cache_negativo()),
+        ("Não encontrado por consulta", test_nao_encontrado_por_consulta()),
+        ("Revalidação em segundo plano", test_revalidacao_em_segundo_plano()),
+        ("Travas entre processos", test_travas_entre_processos()),
+    ]
+
+    print("\n" + "=" * 60)
+    for nome, ok in resultados:
+        print(f"{'✅ PASSOU' if ok else '❌ FALHOU'} - {nome}")
+
+    if all(ok for _, ok in resultados):
+        print("\n🎉 TODOS OS TESTES DO CACHE PASSARAM!")
+    else:
+        print("\n⚠️ ALGUNS TESTES FALHARAM!")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main_teste()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Teste da Consulta Assíncrona de CNPJ - Programa Equilíbrio
+Verifica consultar_cnpj_com_fallback_async e a rota /validar_cnpj_async com
+um transporte httpx falso no lugar das APIs (mesma interpretação das
+respostas, coalescência, prazo total e a rota atendida pelo Flask e pela
+entrada ASGI, com o event loop e o cliente HTTP compartilhados)
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# Caches e limite de taxa desligados: toda consulta chega ao transporte falso
+_pasta = tempfile.mkdtemp()
+os.environ['CNPJ_CACHE_ENABLED'] = 'false'
+os.environ['CNPJ_NEGATIVE_CACHE_ENABLED'] = 'false'
+os.environ['CNPJ_RATE_LIMIT_ENABLED'] = 'false'
+os.environ['CNPJ_CACHE_PATH'] = os.path.join(_pasta, 'cache.sqlite3')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import main
+
+CNPJ = "11222333000181"
+CHAMADAS = []
+LATENCIA = {'segundos': 0.2}
+
+async def responder(request):
+    """Responde no formato da BrasilAPI e da ReceitaWS (a ordem dos provedores é adaptativa),
+    com latência configurável e sem bloquear o event loop"""
+    cnpj = request.url.path.rstrip('/').rsplit('/', 1)[-1]
+    CHAMADAS.append(cnpj)
+    await asyncio.sleep(LATENCIA['segundos'])
+    nome = f'EMPRESA {cnpj[:8]} LTDA'
+    corpo = {'legal_name': nome, 'registration_status': 'ATIVA', 'address': {'city': 'SAO PAULO', 'state': 'SP'},
+             'status': 'OK', 'nome': nome, 'situacao': 'ATIVA', 'municipio': 'SAO PAULO', 'uf': 'SP'}
+    return main.httpx.Response(200, content=json.dumps(corpo).encode())
+
+CLIENTES_CRIADOS = []
+
+def criar_cliente_falso():
+    CLIENTES_CRIADOS.append(1)
+    return main.httpx.AsyncClient(transport=main.httpx.MockTransport(responder))
+
+def consultar(*cnpjs, prazo=None):
+    """Roda consultas simultâneas em um event loop novo e devolve (resultados, duração)"""
+    async def executar():
+        async with criar_cliente_falso() as cliente:
+            return await asyncio.gather(*(main.consultar_cnpj_com_fallback_async(cnpj, prazo, cliente) for cnpj in cnpjs))
+
+    inicio = time.time()
+    resultados = asyncio.run(executar())
+    return resultados, time.time() - inicio
+
+def test_consulta_async():
+    """A resposta do provedor passa pela mesma interpretação da consulta síncrona"""
+    print("🧪 Testando consulta assíncrona...")
+    CHAMADAS.clear()
+    (dados,), _ = consultar("11.222.333/0001-81")
+    ok = bool(dados) and dados.get('razao_social') == 'EMPRESA 11222333 LTDA' and dados.get('cnpj') == CNPJ
+    ok = ok and dados.get('endereco', {}).get('municipio') == 'SAO PAULO' and CHAMADAS == [CNPJ]
+    print(f"   {'✅' if ok else '❌'} Dados: {dados} - chamadas: {CHAMADAS}")
+    return ok
+
+def test_concorrencia():
+    """Consultas de CNPJs diferentes correm juntas no mesmo event loop"""
+    print("🧪 Testando consultas simultâneas de CNPJs diferentes...")
+    CHAMADAS.clear()
+    cnpjs = [f"{indice:08d}000100" for indice in range(1, 21)]
+    resultados, duracao = consultar(*cnpjs)
+    ok = all(resultados) and sorted(CHAMADAS) == cnpjs and duracao < 1.0
+    print(f"   {'✅' if ok else '❌'} {len(cnpjs)} consultas de {LATENCIA['segundos']}s em {duracao:.2f}s")
+    return ok
+
+def test_coalescencia_async():
+    """Consultas simultâneas do mesmo CNPJ fazem uma única requisição"""
+    print("🧪 Testando coalescência no event loop...")
+    CHAMADAS.clear()
+    resultados, _ = consultar(*[CNPJ] * 10)
+    ok = len(CHAMADAS) == 1 and all(dados == resultados[0] for dados in resultados) and bool(resultados[0])
+    print(f"   {'✅' if ok else '❌'} 10 consultas, {len(CHAMADAS)} requisição(ões)")
+    return ok
+
+def test_prazo_async():
+    """Com o provedor lento, a consulta desiste no prazo total"""
+    print("🧪 Testando prazo total da consulta assíncrona...")
+    LATENCIA['segundos'] = 5.0
+    try:
+        (dados,), duracao = consultar(CNPJ, prazo=time.monotonic() + 0.3)
+    finally:
+        LATENCIA['segundos'] = 0.2
+    ok = dados is None and duracao < 0.6
+    print(f"   {'✅' if ok else '❌'} Desistiu em {duracao:.2f}s")
+    for provedor in main.provedores_registrados():
+        main.saude_provedores[provedor.nome].registrar(True, 0.0)
+    return ok
+
+def test_rota_async():
+    """/validar_cnpj_async responde no mesmo contrato de /validar_cnpj, e requisições
+    simultâneas do mesmo CNPJ (cada uma no event loop da sua view) fazem uma única consulta"""
+    print("🧪 Testando a rota /validar_cnpj_async...")
+    if not main.ASYNC_VIEWS_AVAILABLE:
+        print("   ⚠️ flask[async] não instalado - rota assíncrona indisponível")
+        return True
+    main.criar_cliente_http_async = criar_cliente_falso
+    CHAMADAS.clear()
+    CLIENTES_CRIADOS.clear()
+    largada = threading.Barrier(4)
+    respostas = []
+
+    def enviar():
+        cliente = main.app.test_client()
+        largada.wait()
+        respostas.append(cliente.post('/validar_cnpj_async', json={'cnpj': '11.222.333/0001-81'}).get_json())
+
+    threads = [threading.Thread(target=enviar) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    invalido = main.app.test_client().post('/validar_cnpj_async', json={'cnpj': '11.222.333/0001-00'}).get_json()
+    ok = len(respostas) == 4 and all(r.get('dados_empresa', {}).get('razao_social') == 'EMPRESA 11222333 LTDA' for r in respostas)
+    ok = ok and invalido.get('valid') is False and CHAMADAS == [CNPJ]
+    print(f"   {'✅' if ok else '❌'} 4 requisições simultâneas, {len(CHAMADAS)} consulta(s) ao provedor - inválido: {invalido.get('valid')}")
+    return ok
+
+async def chamar_asgi(corpo):
+    """Faz uma requisição HTTP à entrada ASGI e devolve (status, JSON)"""
+    mensagens = [{'type': 'http.request', 'body': json.dumps(corpo).encode(), 'more_body': False}]
+    enviadas = []
+
+    async def receive():
+        return mensagens.pop(0)
+
+    async def send(mensagem):
+        enviadas.append(mensagem)
+
+    escopo = {'type': 'http', 'method': 'POST', 'path': '/validar_cnpj_async', 'headers': []}
+    await main.asgi_app(escopo, receive, send)
+    return enviadas[0]['status'], json.loads(b''.join(m.get('body', b'') for m in enviadas[1:]))
+
+def test_entrada_asgi():
+    """A entrada ASGI atende a rota no event loop do servidor, coalesce e reaproveita o cliente HTTP"""
+    print("🧪 Testando a entrada ASGI...")
+    if not main.ASYNC_VIEWS_AVAILABLE:
+        print("   ⚠️ asgiref não instalado - entrada ASGI indisponível")
+        return True
+    CHAMADAS.clear()
+    cnpj = "07526557000100"
+
+    async def executar():
+        return await asyncio.gather(*(chamar_asgi({'cnpj': cnpj}) for _ in range(20)))
+
+    inicio = time.time()
+    respostas = asyncio.run(executar())
+    duracao = time.time() - inicio
+    ok = all(status == 200 and corpo.get('dados_empresa', {}).get('cnpj') == cnpj for status, corpo in respostas)
+    ok = ok and CHAMADAS == [cnpj] and len(CLIENTES_CRIADOS) == 1 and duracao < 1.0
+    print(f"   {'✅' if ok else '❌'} 20 requisições em {duracao:.2f}s, {len(CHAMADAS)} consulta(s)"
+          f" - clientes HTTP criados desde a rota Flask: {len(CLIENTES_CRIADOS)}")
+    return ok
+
+def main_teste():
+    """Função principal"""
+    print("=" * 60)
+    print("🧪 TESTE DA CONSULTA ASSÍNCRONA DE CNPJ")
+    print("=" * 60)
+
+    if not main.HTTPX_AVAILABLE:
+        print("⚠️ httpx não instalado - a consulta assíncrona delega para a síncrona")
+        return
+
+    resultados = [
+        ("Consulta assíncrona", test_consulta_async()),
+        ("CNPJs diferentes em paralelo", test_concorrencia()),
+        ("Coalescência no event loop", test_coalescencia_async()),
+        ("Prazo total", test_prazo_async()),
+        ("Rota /validar_cnpj_async", test_rota_async()),
+        ("Entrada ASGI", test_entrada_asgi()),
+    ]
+
+    print("\n" + "=" * 60)
+    for nome, ok in resultados:
+        print(f"{'✅ PASSOU' if ok else '❌ FALHOU'} - {nome}")
+
+    if all(ok for _, ok in resultados):
+        print("\n🎉 TODOS OS TESTES DA CONSULTA ASSÍNCRONA PASSARAM!")
+    else:
+        print("\n⚠️ ALGUNS TESTES FALHARAM!")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main_teste()
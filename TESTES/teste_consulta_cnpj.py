@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Teste da Consulta de CNPJ - Programa Equilíbrio
+Verifica a cadeia de provedores de consultar_cnpj_com_fallback (disputa em
+paralelo com cancelamento do perdedor, circuit breaker, limite de taxa, coalescência, prazo e lote) com
+provedores falsos e um servidor HTTP local, sem fazer chamadas às APIs externas
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import requests
+
+# Caches desligados (toda consulta chega aos provedores) e estado isolado
+_pasta = tempfile.mkdtemp()
+os.environ['CNPJ_CACHE_ENABLED'] = 'false'
+os.environ['CNPJ_NEGATIVE_CACHE_ENABLED'] = 'false'
+os.environ['CNPJ_RATE_LIMIT_PATH'] = os.path.join(_pasta, 'limites.sqlite3')
+os.environ['CNPJ_CACHE_PATH'] = os.path.join(_pasta, 'cache.sqlite3')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import main
+
+CNPJ = "11222333000181"
+consultar_provedor_original = main.consultar_provedor_cnpj
+CHAMADAS = []
+
+def empresa(nome):
+    return {'razao_social': nome, 'cnpj': CNPJ, 'situacao': 'ATIVA'}
+
+class RespostaFalsa:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = ''
+
+class SessaoFalsa:
+    """Substitui a sessão HTTP de um host devolvendo sempre o mesmo status"""
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers
+        self.chamadas = 0
+
+    def get(self, url, **kwargs):
+        self.chamadas += 1
+        return RespostaFalsa(self.status_code, self.headers)
+
+class ServidorLocal(ThreadingHTTPServer):
+    """Servidor HTTP/1.1 local que conta as conexões abertas, responde 503 nas `falhas` primeiras
+    requisições e demora `atraso` segundos nos caminhos /lento/"""
+    def __init__(self, falhas=0, atraso=0.0):
+        super().__init__(('127.0.0.1', 0), ManipuladorLocal)
+        self.conexoes = 0
+        self.requisicoes = 0
+        self.falhas = falhas
+        self.atraso = atraso
+
+    def process_request(self, request, client_address):
+        self.conexoes += 1
+        super().process_request(request, client_address)
+
+    def handle_error(self, request, client_address):
+        # Conexões derrubadas pelo cliente (consulta cancelada) são esperadas
+        pass
+
+class ManipuladorLocal(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requisicoes += 1
+        status = 503 if self.server.requisicoes <= self.server.falhas else 200
+        lento = '/lento/' in self.path
+        if lento:
+            time.sleep(self.server.atraso)
+        # Corpo aceito pela BrasilAPI e pela ReceitaWS (a ordem dos provedores é adaptativa)
+        nome = 'EMPRESA LENTA LTDA' if lento else 'EMPRESA RAPIDA LTDA'
+        corpo = json.dumps({'status': 'OK', 'legal_name': nome, 'registration_status': 'ATIVA',
+                            'nome': nome, 'situacao': 'ATIVA'}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, *args):
+        pass
+
+def servidor_local(falhas=0, atraso=0.0):
+    servidor = ServidorLocal(falhas, atraso)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f'http://127.0.0.1:{servidor.server_address[1]}/cnpj'
+
+def test_disputa_paralela():
+    """Com o primeiro provedor lento, o segundo é disparado após CNPJ_HEDGE_DELAY e vence;
+    a chamada perdedora tem a conexão derrubada e não conta como falha"""
+    print("🧪 Testando disputa em paralelo (hedge)...")
+    lento, rapido = main._provedores_cnpj_ordenados()[:2]
+    urls_originais = {provedor: provedor.url_base for provedor in (lento, rapido)}
+    servidor, url = servidor_local(atraso=1.5)
+    lento.url_base, rapido.url_base = f'{url}/lento/', f'{url}/rapido/'
+    main.CNPJ_HEDGE_ENABLED, main.CNPJ_HEDGE_DELAY = True, 0.1
+    try:
+        inicio = time.time()
+        dados = main.consultar_cnpj_com_fallback(CNPJ) or {}
+        duracao = time.time() - inicio
+    finally:
+        main.CNPJ_HEDGE_ENABLED = False
+        servidor.shutdown()
+        servidor.server_close()
+        for provedor, url_base in urls_originais.items():
+            provedor.url_base = url_base
+    sem_falha = main.saude_provedores[lento.nome].falhas_consecutivas == 0
+    ok = dados.get('razao_social') == 'EMPRESA RAPIDA LTDA' and duracao < 0.8 and servidor.requisicoes == 2 and sem_falha
+    print(f"   {'✅' if ok else '❌'} Vencedor: {dados.get('razao_social')} em {duracao:.2f}s"
+          f" - {servidor.requisicoes} requisições - perdedor sem falha no breaker: {sem_falha}")
+    return ok
+
+def test_disputa_sem_vaga():
+    """Com o pool de disputa ocupado, a consulta segue só com o primeiro provedor"""
+    print("🧪 Testando disputa com o pool ocupado...")
+    provedores = main._provedores_cnpj_ordenados()[:2]
+    urls_originais = {provedor: provedor.url_base for provedor in provedores}
+    servidor, url = servidor_local(atraso=0.4)
+    for provedor in provedores:
+        provedor.url_base = f'{url}/lento/'
+    vagas = [main._vagas_hedge.acquire(blocking=False) for _ in range(main.CNPJ_HEDGE_MAX_WORKERS)]
+    main.CNPJ_HEDGE_ENABLED, main.CNPJ_HEDGE_DELAY = True, 0.1
+    try:
+        dados = main.consultar_cnpj_com_fallback(CNPJ) or {}
+    finally:
+        main.CNPJ_HEDGE_ENABLED = False
+        for ocupada in vagas:
+            if ocupada:
+                main._vagas_hedge.release()
+        servidor.shutdown()
+        servidor.server_close()
+        for provedor, url_base in urls_originais.items():
+            provedor.url_base = url_base
+    ok = all(vagas) and dados.get('razao_social') == 'EMPRESA LENTA LTDA' and servidor.requisicoes == 1
+    print(f"   {'✅' if ok else '❌'} {servidor.requisicoes} requisição(ões) - dados: {dados.get('razao_social')}")
+    return ok
+
+def test_conexoes_keep_alive():
+    """Chamadas seguidas ao mesmo host reaproveitam a conexão da sessão compartilhada"""
+    print("🧪 Testando sessão HTTP com keep-alive...")
+    provedor_de_teste('Local')
+    servidor, url = servidor_local()
+    try:
+        codigos = [main.requisitar_com_prazo('Local', url, 2).status_code for _ in range(10)]
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
+    mesma_sessao = main.obter_sessao_http(url) is main.obter_sessao_http(url + '/outra')
+    ok = codigos == [200] * 10 and servidor.conexoes == 1 and mesma_sessao
+    print(f"   {'✅' if ok else '❌'} 10 requisições em {servidor.conexoes} conexão(ões) - mesma sessão por host: {mesma_sessao}")
+    return ok
+
+def test_retry_5xx():
+    """Um 503 passageiro é repetido dentro da chamada e conta como sucesso no breaker"""
+    print("🧪 Testando retry de 5xx...")
+    saude = provedor_de_teste('Oscilante')
+    servidor, url = servidor_local(falhas=1)
+    main.HTTP_RETRY_BACKOFF = 0.01
+    try:
+        response = main.requisitar_com_prazo('Oscilante', url, 2)
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
+    ok = response.status_code == 200 and servidor.requisicoes == 2 and saude.falhas_consecutivas == 0
+    print(f"   {'✅' if ok else '❌'} Status final {response.status_code} após {servidor.requisicoes} requisições")
+    return ok
+
+def provedor_de_teste(nome, limite_falhas=3, cooldown=60):
+    """Registra saúde e limitador para um provedor fictício (sem entrar na fila)"""
+    main.saude_provedores[nome] = main.SaudeProvedor(nome, 50, 300, limite_falhas, cooldown)
+    main.limitadores_provedores[nome] = main.LimitadorTaxa(nome, 60, 5, os.path.join(_pasta, 'limites.sqlite3'))
+    return main.saude_provedores[nome]
+
+def test_breaker_uma_falha_por_consulta():
+    """Os retries de uma consulta contam como uma única falha no circuit breaker"""
+    print("🧪 Testando circuit breaker (uma falha por consulta)...")
+    saude = provedor_de_teste('Instavel', limite_falhas=3)
+    sessao = SessaoFalsa(503)
+    main._sessoes_http['instavel.local'] = sessao
+    main.HTTP_RETRY_BACKOFF = 0.01
+    response = main.requisitar_com_prazo('Instavel', 'http://instavel.local/cnpj', 1)
+    ok = response.status_code == 503 and sessao.chamadas == main.HTTP_RETRY_TOTAL + 1
+    ok = ok and saude.falhas_consecutivas == 1 and saude.permitir()
+    print(f"   {'✅' if ok else '❌'} {sessao.chamadas} tentativas, {saude.falhas_consecutivas} falha registrada")
+    return ok
+
+def test_breaker_teste_meio_aberto():
+    """A consulta de teste só é reservada quando a chamada acontece de fato"""
+    print("🧪 Testando circuit breaker meio-aberto...")
+    nome = main._provedores_cnpj_ordenados()[0].nome
+    saude = main.saude_provedores[nome]
+    saude.falhas_consecutivas, saude.aberto_ate = saude.limite_falhas, 0.0
+
+    # Sem cota, o provedor é pulado pelo limitador: a consulta de teste continua livre
+    main.limitadores_provedores[nome].esgotar()
+    espera_original, main.CNPJ_RATE_LIMIT_MAX_WAIT = main.CNPJ_RATE_LIMIT_MAX_WAIT, 0.0
+    main.consultar_provedor_cnpj = lambda provedor, cnpj, prazo=None, nao_encontrado=None, sessao=None: None
+    try:
+        main.consultar_cnpj_com_fallback(CNPJ)
+    finally:
+        main.CNPJ_RATE_LIMIT_MAX_WAIT = espera_original
+    livre = saude.permitir()
+
+    reservas = [saude.reservar(), saude.reservar()]
+    ok = livre and reservas == [True, False] and not saude.permitir()
+    print(f"   {'✅' if ok else '❌'} Livre após pular pelo limitador: {livre} - reservas: {reservas}")
+    saude.registrar(True, 0.0)
+    return ok
+
+def test_token_devolvido_sem_reserva():
+    """Quando a consulta de teste já foi reservada por outra requisição, o token do limitador volta ao balde"""
+    print("🧪 Testando devolução do token sem reserva do breaker...")
+    provedores = main._provedores_cnpj_ordenados()
+    antes = {p.nome: main.limitadores_provedores[p.nome].estado()['tokens_disponiveis'] for p in provedores}
+    for provedor in provedores:
+        # Outra requisição levou a consulta de teste entre permitir() e reservar()
+        main.saude_provedores[provedor.nome].reservar = lambda: False
+    main.consultar_provedor_cnpj = lambda provedor, cnpj, prazo=None, nao_encontrado=None, sessao=None: empresa('EMPRESA')
+    try:
+        dados = main.consultar_cnpj_com_fallback(CNPJ)
+    finally:
+        for provedor in provedores:
+            del main.saude_provedores[provedor.nome].reservar
+    depois = {p.nome: main.limitadores_provedores[p.nome].estado()['tokens_disponiveis'] for p in provedores}
+    ok = dados is None and all(depois[nome] >= antes[nome] - 0.01 for nome in antes)
+    print(f"   {'✅' if ok else '❌'} Tokens antes: {antes} - depois: {depois}")
+    return ok
+
+def test_429_sem_retry():
+    """Um 429 não é repetido e esgota a cota local do provedor"""
+    print("🧪 Testando limite de taxa após HTTP 429...")
+    provedor_de_teste('Limitado')
+    sessao = SessaoFalsa(429)
+    main._sessoes_http['limitado.local'] = sessao
+    response = main.requisitar_com_prazo('Limitado', 'http://limitado.local/cnpj', 1)
+    sem_cota = not main.limitadores_provedores['Limitado'].adquirir()
+    ok = response.status_code == 429 and sessao.chamadas == 1 and sem_cota
+    print(f"   {'✅' if ok else '❌'} {sessao.chamadas} chamada(s), cota esgotada: {sem_cota}")
+    return ok
+
+def test_limitador_taxa():
+    """O balde libera a rajada configurada e depois recusa até recarregar"""
+    print("🧪 Testando token bucket...")
+    limitador = main.LimitadorTaxa('Balde', 60, 3, os.path.join(_pasta, 'limites.sqlite3'))
+    liberadas = [limitador.adquirir() for _ in range(4)]
+    recarregou = limitador.adquirir(espera_maxima=1.5)
+    ok = liberadas == [True, True, True, False] and recarregou
+    print(f"   {'✅' if ok else '❌'} Rajada: {liberadas} - após recarga: {recarregou}")
+    return ok
+
+def test_coalescencia():
+    """Consultas simultâneas do mesmo CNPJ chegam aos provedores uma única vez"""
+    print("🧪 Testando coalescência (single-flight)...")
+
+    def provedor_falso(provedor, cnpj, prazo=None, nao_encontrado=None, sessao=None):
+        CHAMADAS.append(provedor.nome)
+        time.sleep(0.2)
+        return empresa(provedor.nome)
+
+    main.consultar_provedor_cnpj = provedor_falso
+    CHAMADAS.clear()
+    resultados = []
+    threads = [threading.Thread(target=lambda: resultados.append(main.consultar_cnpj_com_fallback(CNPJ)))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    ok = len(CHAMADAS) == 1 and len(resultados) == 5 and all(r == resultados[0] for r in resultados)
+    print(f"   {'✅' if ok else '❌'} 5 consultas, {len(CHAMADAS)} chamada(s) às APIs")
+    return ok
+
+def test_lote_ndjson():
+    """O lote devolve uma linha NDJSON por CNPJ e consulta os válidos em paralelo"""
+    print("🧪 Testando validação em lote (NDJSON)...")
+
+    def provedor_falso(provedor, cnpj, prazo=None, nao_encontrado=None, sessao=None):
+        CHAMADAS.append(main.limpar_cnpj(cnpj))
+        time.sleep(0.3)
+        return {'razao_social': 'EMPRESA TESTE LTDA', 'cnpj': main.limpar_cnpj(cnpj), 'situacao': 'ATIVA'}
+
+    main.consultar_provedor_cnpj = provedor_falso
+    CHAMADAS.clear()
+    cliente = main.app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao['admin_user'] = {'email': main.ADMIN_EMAIL}
+    validos = ["11.222.333/0001-81", "07526557000100", "33000167000101"]
+    inicio = time.time()
+    resposta = cliente.post('/admin/validar_cnpjs_lote', json={'cnpjs': validos + ["12.345.678/0001-00"]})
+    linhas = [json.loads(linha) for linha in resposta.get_data(as_text=True).splitlines()]
+    duracao = time.time() - inicio
+    por_cnpj = {linha['cnpj']: linha for linha in linhas}
+    ok = resposta.mimetype == 'application/x-ndjson' and len(linhas) == 4 and len(CHAMADAS) == 3
+    ok = ok and por_cnpj["12.345.678/0001-00"]['valid'] is False and all(por_cnpj[c]['valid'] for c in validos)
+    ok = ok and duracao < 0.8
+    print(f"   {'✅' if ok else '❌'} {len(linhas)} linhas em {duracao:.2f}s - {len(CHAMADAS)} consultas às APIs")
+    return ok
+
+def test_lote_formato_invalido():
+    """"cnpjs" que não é uma lista de textos ou números é recusado com 400"""
+    print("🧪 Testando lote com formato inválido...")
+    cliente = main.app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao['admin_user'] = {'email': main.ADMIN_EMAIL}
+    codigos = [cliente.post('/admin/validar_cnpjs_lote', json=corpo).status_code
+               for corpo in ({'cnpjs': '11222333000181'}, {'cnpjs': {'a': 1}}, {'cnpjs': [['11222333000181']]})]
+    # Números são aceitos, com os zeros à esquerda restaurados
+    main.consultar_provedor_cnpj = lambda provedor, cnpj, prazo=None, nao_encontrado=None, sessao=None: empresa('EMPRESA')
+    numerico = cliente.post('/admin/validar_cnpjs_lote', json={'cnpjs': [7526557000100]})
+    linhas = [json.loads(linha) for linha in numerico.get_data(as_text=True).splitlines()]
+    ok = codigos == [400, 400, 400] and len(linhas) == 1 and linhas[0]['cnpj'] == '07526557000100' and linhas[0]['valid']
+    print(f"   {'✅' if ok else '❌'} Códigos: {codigos} - número: {linhas}")
+    return ok
+
+class SessaoPendurada:
+    """Sessão de um provedor que nunca responde: cada GET dura o timeout recebido"""
+    def __init__(self):
+        self.timeouts = []
+
+    def get(self, url, timeout=None, **kwargs):
+        self.timeouts.append(timeout)
+        time.sleep(timeout)
+        raise requests.exceptions.ReadTimeout(f"Sem resposta em {timeout:.2f}s")
+
+def test_prazo_total():
+    """Com todos os provedores pendurados, a consulta desiste no prazo total"""
+    print("🧪 Testando prazo total da consulta...")
+    main.consultar_provedor_cnpj = consultar_provedor_original
+    sessoes = []
+    for provedor in main.provedores_registrados():
+        sessoes.append(SessaoPendurada())
+        main._sessoes_http[urlparse(provedor.url(CNPJ)).netloc] = sessoes[-1]
+    inicio = time.time()
+    dados = main.consultar_cnpj_com_fallback(CNPJ, prazo=time.monotonic() + 0.5)
+    duracao = time.time() - inicio
+    timeouts = [timeout for sessao in sessoes for timeout in sessao.timeouts]
+    ok = dados is None and duracao < 0.7 and all(timeout <= 0.5 for timeout in timeouts)
+    print(f"   {'✅' if ok else '❌'} Desistiu em {duracao:.2f}s - timeouts usados: {[round(t, 2) for t in timeouts]}")
+    for provedor in main.provedores_registrados():
+        main.saude_provedores[provedor.nome].registrar(True, 0.0)
+    return ok
+
+def main_teste():
+    """Função principal"""
+    print("=" * 60)
+    print("🧪 TESTE DA CONSULTA DE CNPJ")
+    print("=" * 60)
+
+    resultados = [
+        ("Disputa em paralelo", test_disputa_paralela()),
+        ("Disputa sem vaga no pool", test_disputa_sem_vaga()),
+        ("Keep-alive", test_conexoes_keep_alive()),
+        ("Retry de 5xx", test_retry_5xx()),
+        ("Breaker: uma falha por consulta", test_breaker_uma_falha_por_consulta()),
+        ("Breaker: teste meio-aberto", test_breaker_teste_meio_aberto()),
+        ("Token devolvido sem reserva", test_token_devolvido_sem_reserva()),
+        ("Coalescência", test_coalescencia()),
+        ("429 sem retry", test_429_sem_retry()),
+        ("Token bucket", test_limitador_taxa()),
+        ("Validação em lote (NDJSON)", test_lote_ndjson()),
+        ("Lote com formato inválido", test_lote_formato_invalido()),
+        ("Prazo total", test_prazo_total()),
+    ]
+
+    print("\n" + "=" * 60)
+    for nome, ok in resultados:
+        print(f"{'✅ PASSOU' if ok else '❌ FALHOU'} - {nome}")
+
+    if all(ok for _, ok in resultados):
+        print("\n🎉 TODOS OS TESTES DA CONSULTA DE CNPJ PASSARAM!")
+    else:
+        print("\n⚠️ ALGUNS TESTES FALHARAM!")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main_teste()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Teste do Enriquecimento de Endereço pelo CEP - Programa Equilíbrio
+Verifica que, depois de salvar o diagnóstico, o endereço informado pelo
+provedor de CNPJ é completado pela ViaCEP, com Supabase e ViaCEP falsos
+"""
+
+import os
+import sys
+import tempfile
+import threading
+
+os.environ['CNPJ_CACHE_PATH'] = os.path.join(tempfile.mkdtemp(), 'cache_teste.sqlite3')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import main
+
+ENDERECO_RECEITA = {'logradouro': 'RUA TESTE', 'numero': '100', 'bairro': '', 'municipio': 'sao paulo',
+                    'uf': 'sp', 'cep': '01310100'}
+ENDERECO_VIACEP = {'logradouro': 'Avenida Paulista', 'bairro': 'Bela Vista', 'municipio': 'São Paulo',
+                   'uf': 'SP', 'cep': '01310-100', 'codigo_ibge': '3550308'}
+
+class ConsultaFalsa:
+    def __init__(self, supabase, dados=None):
+        self.supabase = supabase
+        self.dados = dados
+
+    def update(self, dados):
+        self.dados = dados
+        return self
+
+    def eq(self, coluna, valor):
+        return self
+
+    def execute(self):
+        if self.dados and 'endereco' in self.dados:
+            self.supabase.enderecos.append(self.dados['endereco'])
+            self.supabase.atualizado.set()
+        return type('Resultado', (), {'data': self.supabase.ids})()
+
+class SupabaseFalso:
+    """RPC de salvamento que sempre grava e tabela que registra os updates de endereço"""
+    def __init__(self):
+        self.ids = {'empresa_id': 'empresa-1', 'diagnostico_id': 'diagnostico-1'}
+        self.enderecos = []
+        self.atualizado = threading.Event()
+
+    def rpc(self, nome, parametros):
+        return ConsultaFalsa(self)
+
+    def table(self, nome):
+        return ConsultaFalsa(self)
+
+def dados_empresa(**extras):
+    return {'cnpj': '11222333000181', 'razao_social': 'EMPRESA TESTE LTDA', **extras}
+
+def test_endereco_do_provedor():
+    """O endereço vem de dados_receita ou do cache de CNPJ; valores que não são dicionários são ignorados"""
+    print("🧪 Testando origem do endereço...")
+    do_formulario = main._endereco_da_empresa(dados_empresa(dados_receita={'endereco': ENDERECO_RECEITA}))
+    main.cache_cnpj.salvar('11222333000181', {'razao_social': 'EMPRESA TESTE LTDA', 'endereco': ENDERECO_RECEITA})
+    do_cache = main._endereco_da_empresa(dados_empresa(dados_receita='texto'))
+    main.cache_cnpj.remover('11222333000181')
+    invalido = main._endereco_da_empresa(dados_empresa(endereco='Rua sem CEP'))
+    ok = do_formulario == ENDERECO_RECEITA and do_cache == ENDERECO_RECEITA and invalido is None
+    print(f"   {'✅' if ok else '❌'} Formulário: {bool(do_formulario)} - cache: {bool(do_cache)} - inválido: {invalido}")
+    return ok
+
+def test_enriquecimento_apos_salvar():
+    """Um endereço em texto no envio não derruba o salvamento, e o endereço do provedor é enriquecido"""
+    print("🧪 Testando enriquecimento após salvar...")
+    supabase = SupabaseFalso()
+    main.supabase = supabase
+    main.consultar_cep = lambda cep, prazo=None: ENDERECO_VIACEP
+    ids = main.salvar_empresa_diagnostico(
+        dados_empresa(endereco='Rua qualquer, 100', dados_receita={'endereco': ENDERECO_RECEITA}),
+        {'1': 'alta_carga'}, {'nivel_risco': 'Baixo'}
+    )
+    supabase.atualizado.wait(5)
+    endereco = supabase.enderecos[0] if supabase.enderecos else {}
+    ok = ids == ('empresa-1', 'diagnostico-1') and endereco.get('codigo_ibge') == '3550308'
+    ok = ok and endereco.get('logradouro') == 'RUA TESTE' and endereco.get('bairro') == 'Bela Vista'
+    print(f"   {'✅' if ok else '❌'} IDs: {ids} - endereço gravado: {endereco}")
+    return ok
+
+def main_teste():
+    """Função principal"""
+    print("=" * 60)
+    print("🧪 TESTE DO ENRIQUECIMENTO DE ENDEREÇO")
+    print("=" * 60)
+
+    resultados = [
+        ("Origem do endereço", test_endereco_do_provedor()),
+        ("Enriquecimento após salvar", test_enriquecimento_apos_salvar()),
+    ]
+
+    print("\n" + "=" * 60)
+    for nome, ok in resultados:
+        print(f"{'✅ PASSOU' if ok else '❌ FALHOU'} - {nome}")
+
+    if all(ok for _, ok in resultados):
+        print("\n🎉 TODOS OS TESTES DO ENRIQUECIMENTO PASSARAM!")
+    else:
+        print("\n⚠️ ALGUNS TESTES FALHARAM!")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main_teste()
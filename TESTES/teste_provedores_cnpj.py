@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Teste do Registro de Provedores de CNPJ - Programa Equilíbrio
+Aponta os provedores para o servidor_mock_provedores.py (via cliente de
+teste do Flask, sem abrir portas) e verifica a configuração por variáveis de
+ambiente, a normalização de cada provedor e o registro de um provedor novo
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+# Provedores configurados por ambiente, na ordem de CNPJ_PROVIDERS, todos no mock
+_pasta = tempfile.mkdtemp()
+os.environ['CNPJ_PROVIDERS'] = 'ReceitaWS, BrasilAPI, Desconhecido'
+os.environ['BRASILAPI_API_URL'] = 'http://mock.local/api/cnpj/v1/'
+os.environ['RECEITAWS_API_URL'] = 'http://mock.local/v1/cnpj/'
+os.environ['VIACEP_API_URL'] = 'http://mock.local/ws/'
+os.environ['CNPJ_CACHE_ENABLED'] = 'false'
+os.environ['CNPJ_NEGATIVE_CACHE_ENABLED'] = 'false'
+os.environ['CNPJ_RATE_LIMIT_ENABLED'] = 'false'
+os.environ['CNPJ_CACHE_PATH'] = os.path.join(_pasta, 'cache.sqlite3')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import main
+import servidor_mock_provedores
+from provedores_cnpj import BrasilAPI, obter_provedor, registrar_provedor, remover_provedor
+
+CNPJ = "11222333000181"
+
+class RespostaMock:
+    def __init__(self, resposta):
+        self.status_code = resposta.status_code
+        self.headers = dict(resposta.headers)
+        self.text = resposta.get_data(as_text=True)
+
+    def json(self):
+        return json.loads(self.text)
+
+class SessaoMock:
+    """Sessão HTTP que encaminha os GETs para o app Flask do servidor mock"""
+    def __init__(self):
+        self.cliente = servidor_mock_provedores.app.test_client()
+        self.caminhos = []
+
+    def get(self, url, **kwargs):
+        caminho = url.split('mock.local', 1)[1]
+        self.caminhos.append(caminho)
+        return RespostaMock(self.cliente.get(caminho))
+
+def configurar_mock(**opcoes):
+    """Opções do servidor mock (as mesmas da linha de comando), sem latência nem falhas"""
+    padrao = dict(latencia=0.0, jitter=0.0, taxa_erro=0.0, taxa_429=0.0, limite_por_minuto=0.0, retry_after=1,
+                  gravacoes='', gravar=False, taxa_nao_encontrado=0.0, taxa_inativa=0.0)
+    vars(servidor_mock_provedores.opcoes).update(padrao, **opcoes)
+
+SESSAO = SessaoMock()
+
+def test_configuracao():
+    """CNPJ_PROVIDERS define os provedores e a ordem; *_API_URL troca o endereço"""
+    print("🧪 Testando configuração dos provedores...")
+    nomes = [provedor.nome for provedor in main.provedores_registrados()]
+    urls = [provedor.url(CNPJ) for provedor in main.provedores_registrados()]
+    ok = nomes == ['ReceitaWS', 'BrasilAPI'] and all(url.startswith('http://mock.local/') for url in urls)
+    ok = ok and set(nomes) <= set(main.saude_provedores) and set(nomes) <= set(main.limitadores_provedores)
+    print(f"   {'✅' if ok else '❌'} Provedores: {nomes} - URLs: {urls}")
+    return ok
+
+def test_mesma_normalizacao():
+    """BrasilAPI e ReceitaWS, com formatos diferentes, chegam ao mesmo registro"""
+    print("🧪 Testando normalização das respostas do mock...")
+    configurar_mock()
+    dados = {provedor.nome: main.consultar_provedor_cnpj(provedor, CNPJ) or {} for provedor in main.provedores_registrados()}
+    campos = lambda d: (d.get('razao_social'), d.get('situacao'), d.get('endereco', {}).get('municipio'),
+                        d.get('endereco', {}).get('uf'), d.get('email'))
+    brasilapi, receitaws = campos(dados['BrasilAPI']), campos(dados['ReceitaWS'])
+    ok = brasilapi == receitaws and brasilapi[0] == 'EMPRESA FICTICIA 11222333 LTDA'
+    print(f"   {'✅' if ok else '❌'} BrasilAPI: {brasilapi} - ReceitaWS: {receitaws}")
+    return ok
+
+def test_nao_encontrado():
+    """O "não existe" de cada provedor (404 ou status ERROR) é reconhecido"""
+    print("🧪 Testando CNPJ inexistente em cada provedor...")
+    configurar_mock(taxa_nao_encontrado=1.0)
+    nao_encontrado = set()
+    resultados = [main.consultar_provedor_cnpj(provedor, CNPJ, nao_encontrado=nao_encontrado)
+                  for provedor in main.provedores_registrados()]
+    configurar_mock()
+    ok = resultados == [None, None] and nao_encontrado == {'BrasilAPI', 'ReceitaWS'}
+    print(f"   {'✅' if ok else '❌'} Provedores que afirmaram inexistência: {sorted(nao_encontrado)}")
+    return ok
+
+def test_gravacao():
+    """Uma resposta gravada em --gravacoes substitui os dados fictícios"""
+    print("🧪 Testando respostas gravadas do mock...")
+    gravacoes = os.path.join(_pasta, 'gravacoes')
+    os.makedirs(os.path.join(gravacoes, 'brasilapi'))
+    with open(os.path.join(gravacoes, 'brasilapi', f'{CNPJ}.json'), 'w', encoding='utf-8') as arquivo:
+        json.dump({'legal_name': 'EMPRESA GRAVADA SA', 'registration_status': 'BAIXADA'}, arquivo)
+    configurar_mock(gravacoes=gravacoes)
+    dados = main.consultar_provedor_cnpj(obter_provedor('BrasilAPI'), CNPJ) or {}
+    configurar_mock()
+    ok = dados.get('razao_social') == 'EMPRESA GRAVADA SA' and dados.get('situacao') == 'BAIXADA'
+    print(f"   {'✅' if ok else '❌'} Dados da gravação: {dados.get('razao_social')} ({dados.get('situacao')})")
+    return ok
+
+class BrasilAPIEspelho(BrasilAPI):
+    """Provedor novo: mesma API da BrasilAPI em outro endereço"""
+    nome = 'BrasilAPIEspelho'
+    url_padrao = 'http://mock.local/api/cnpj/v1/'
+
+def test_provedor_novo():
+    """Um provedor registrado em tempo de execução entra na cadeia sem mudar as rotas"""
+    print("🧪 Testando registro de um provedor novo...")
+    originais = main.provedores_registrados()
+    for provedor in originais:
+        remover_provedor(provedor.nome)
+    main.registrar_provedor_cnpj(BrasilAPIEspelho())
+    try:
+        SESSAO.caminhos.clear()
+        resposta = main.app.test_client().post('/validar_cnpj', json={'cnpj': '11.222.333/0001-81'}).get_json()
+    finally:
+        remover_provedor('BrasilAPIEspelho')
+        for provedor in originais:
+            registrar_provedor(provedor)
+    dados = resposta.get('dados_empresa') or {}
+    ok = resposta.get('valid') is True and dados.get('razao_social') == 'EMPRESA FICTICIA 11222333 LTDA'
+    ok = ok and SESSAO.caminhos == [f'/api/cnpj/v1/{CNPJ}']
+    print(f"   {'✅' if ok else '❌'} Razão social: {dados.get('razao_social')} - requisições: {SESSAO.caminhos}")
+    return ok
+
+def test_viacep_mock():
+    """A consulta de CEP também pode apontar para o mock"""
+    print("🧪 Testando ViaCEP no mock...")
+    endereco = main.consultar_cep('01001-000') or {}
+    ok = endereco.get('municipio') == 'São Paulo' and endereco.get('codigo_ibge') == '3550308'
+    print(f"   {'✅' if ok else '❌'} Endereço: {endereco}")
+    return ok
+
+def main_teste():
+    """Função principal"""
+    print("=" * 60)
+    print("🧪 TESTE DOS PROVEDORES DE CNPJ")
+    print("=" * 60)
+
+    main._sessoes_http['mock.local'] = SESSAO
+
+    resultados = [
+        ("Configuração por ambiente", test_configuracao()),
+        ("Mesma normalização", test_mesma_normalizacao()),
+        ("CNPJ inexistente", test_nao_encontrado()),
+        ("Respostas gravadas", test_gravacao()),
+        ("Provedor novo", test_provedor_novo()),
+        ("ViaCEP no mock", test_viacep_mock()),
+    ]
+
+    print("\n" + "=" * 60)
+    for nome, ok in resultados:
+        print(f"{'✅ PASSOU' if ok else '❌ FALHOU'} - {nome}")
+
+    if all(ok for _, ok in resultados):
+        print("\n🎉 TODOS OS TESTES DOS PROVEDORES PASSARAM!")
+    else:
+        print("\n⚠️ ALGUNS TESTES FALHARAM!")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main_teste()
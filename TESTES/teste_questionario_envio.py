@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Teste do Envio do Questionário - Programa Equilíbrio
+Verifica o salvamento em uma única chamada RPC (e o fallback sem ela), a
+gravação em segundo plano (journal) e a idempotência do envio com um
+cliente Supabase falso, sem acessar o banco
+"""
+
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+_pasta = tempfile.mkdtemp()
+os.environ['CNPJ_CACHE_PATH'] = os.path.join(_pasta, 'cache_teste.sqlite3')
+os.environ['QUESTIONARIO_JOURNAL_PATH'] = os.path.join(_pasta, 'journal_teste.sqlite3')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import main
+
+DADOS_EMPRESA = {'cnpj': '11.222.333/0001-81', 'razao_social': 'EMPRESA TESTE LTDA', 'email': 'rh@teste.com'}
+RESPOSTAS = {'1': 'alta_carga', '2': 'frequencia_alta', '6': 'nunca'}
+
+class SupabaseFalso:
+    """RPC salvar_empresa_diagnostico que falha as `falhas` primeiras vezes e demora `latencia` segundos"""
+    def __init__(self, falhas=0, latencia=0.0):
+        self.falhas = falhas
+        self.latencia = latencia
+        self.salvos = []
+        self._lock = threading.Lock()
+
+    def rpc(self, nome, parametros):
+        supabase = self
+
+        class Chamada:
+            def execute(self):
+                time.sleep(supabase.latencia)
+                with supabase._lock:
+                    if supabase.falhas > 0:
+                        supabase.falhas -= 1
+                        raise Exception('Supabase indisponível (teste)')
+                    diagnostico_id = parametros['p_diagnostico'].get('id') or str(uuid.uuid4())
+                    supabase.salvos.append(diagnostico_id)
+                return type('Resultado', (), {'data': {'empresa_id': 'empresa-1', 'diagnostico_id': diagnostico_id}})()
+
+        return Chamada()
+
+class TabelaFalsa:
+    """Consulta encadeada de uma tabela (select/insert/update + eq + execute)"""
+    def __init__(self, supabase, nome):
+        self.supabase = supabase
+        self.nome = nome
+        self.operacao = None
+        self.dados = None
+
+    def select(self, colunas):
+        self.operacao = 'select'
+        return self
+
+    def insert(self, dados):
+        self.operacao, self.dados = 'insert', dados
+        return self
+
+    def update(self, dados):
+        self.operacao, self.dados = 'update', dados
+        return self
+
+    def eq(self, coluna, valor):
+        return self
+
+    def execute(self):
+        self.supabase.chamadas.append(f'{self.nome}.{self.operacao}')
+        if self.operacao == 'select':
+            dados = [{'id': 'empresa-1'}] if self.supabase.empresa_existe else []
+        else:
+            dados = [{'id': 'empresa-1' if self.nome == 'empresas' else self.dados.get('id') or 'diagnostico-1'}]
+            self.supabase.empresa_existe = self.supabase.empresa_existe or self.nome == 'empresas'
+        return type('Resultado', (), {'data': dados})()
+
+class SupabaseSemRPC:
+    """Banco sem a função salvar_empresa_diagnostico (PostgREST responde PGRST202)"""
+    def __init__(self):
+        self.chamadas = []
+        self.empresa_existe = False
+
+    def rpc(self, nome, parametros):
+        supabase = self
+
+        class Chamada:
+            def execute(self):
+                supabase.chamadas.append(f'rpc.{nome}')
+                raise Exception("{'code': 'PGRST202', 'message': 'Could not find the function public.salvar_empresa_diagnostico'}")
+
+        return Chamada()
+
+    def table(self, nome):
+        return TabelaFalsa(self, nome)
+
+def test_salvamento_rpc():
+    """Empresa e diagnóstico vão para o banco em uma única chamada RPC"""
+    print("🧪 Testando salvamento em uma chamada RPC...")
+    supabase = SupabaseFalso()
+    main.supabase = supabase
+    empresa_id, diagnostico_id = main._salvar_empresa_diagnostico(DADOS_EMPRESA, RESPOSTAS, {'nivel_risco': 'Alto'})
+    ok = empresa_id == 'empresa-1' and supabase.salvos == [diagnostico_id]
+    print(f"   {'✅' if ok else '❌'} IDs: {(empresa_id, diagnostico_id)} - gravações: {len(supabase.salvos)}")
+    return ok
+
+def test_salvamento_sem_rpc():
+    """Sem a função no banco, o salvamento volta às chamadas separadas e não tenta a RPC de novo"""
+    print("🧪 Testando fallback sem a função RPC...")
+    supabase = SupabaseSemRPC()
+    main.supabase = supabase
+    try:
+        primeiro = main._salvar_empresa_diagnostico(DADOS_EMPRESA, RESPOSTAS, {'nivel_risco': 'Alto'}, 'diagnostico-a')
+        segundo = main._salvar_empresa_diagnostico(DADOS_EMPRESA, RESPOSTAS, {'nivel_risco': 'Alto'}, 'diagnostico-b')
+    finally:
+        main._rpc_salvar_disponivel = True
+    esperado = ['rpc.salvar_empresa_diagnostico', 'empresas.select', 'empresas.insert', 'diagnosticos.insert',
+                'empresas.select', 'empresas.update', 'diagnosticos.insert']
+    ok = primeiro == ('empresa-1', 'diagnostico-a') and segundo == ('empresa-1', 'diagnostico-b') and supabase.chamadas == esperado
+    print(f"   {'✅' if ok else '❌'} Chamadas: {supabase.chamadas}")
+    return ok
+
+def test_journal_write_behind():
+    """O envio responde sem esperar o banco e a drenagem grava depois de falhas temporárias"""
+    print("🧪 Testando gravação em segundo plano (journal)...")
+    supabase = SupabaseFalso(falhas=2)
+    main.supabase = supabase
+    main.QUESTIONARIO_WRITE_BEHIND, main.QUESTIONARIO_JOURNAL_INTERVAL = True, 0.05
+    try:
+        inicio = time.time()
+        dados = main._processar_envio_questionario(DADOS_EMPRESA, RESPOSTAS)
+        duracao = time.time() - inicio
+        limite = time.time() + 5
+        while main.journal_questionarios.resumo() and time.time() < limite:
+            time.sleep(0.05)
+    finally:
+        main.QUESTIONARIO_WRITE_BEHIND = False
+    ok = dados['empresa_id'] is None and duracao < 0.5
+    ok = ok and supabase.salvos == [dados['diagnostico_id']] and not main.journal_questionarios.resumo()
+    print(f"   {'✅' if ok else '❌'} Resposta em {duracao * 1000:.0f}ms - gravados após 2 falhas: {len(supabase.salvos)}")
+    return ok
+
+def test_journal_duravel():
+    """Um registro do journal sobrevive a uma nova instância (como após uma queda do processo)"""
+    print("🧪 Testando durabilidade do journal...")
+    caminho = os.path.join(_pasta, 'journal_duravel.sqlite3')
+    main.JournalQuestionarios(caminho, 3).adicionar('diagnostico-pendente', {'respostas': RESPOSTAS})
+    lote = main.JournalQuestionarios(caminho, 3).reservar(10)
+    ok = [diagnostico_id for diagnostico_id, _, _ in lote] == ['diagnostico-pendente']
+    print(f"   {'✅' if ok else '❌'} Registros lidos pela nova instância: {len(lote)}")
+    return ok
+
+def test_envios_simultaneos():
+    """Envios simultâneos com a mesma chave gravam uma única vez e recebem o mesmo diagnóstico"""
+    print("🧪 Testando envios simultâneos com a mesma chave...")
+    supabase = SupabaseFalso(latencia=0.2)
+    main.supabase = supabase
+    resultados = []
+    threads = [threading.Thread(target=lambda: resultados.append(
+        main.processar_envio_idempotente('chave-simultanea-1', DADOS_EMPRESA, RESPOSTAS))) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    ids = {dados['diagnostico_id'] for dados in resultados}
+    ok = len(supabase.salvos) == 1 and len(resultados) == 3 and ids == set(supabase.salvos)
+    print(f"   {'✅' if ok else '❌'} 3 envios, {len(supabase.salvos)} gravação(ões), IDs: {ids}")
+    return ok
+
+def test_rota_idempotencia():
+    """Chave inválida responde 400; chave reutilizada com outras respostas responde 422"""
+    print("🧪 Testando a rota com Idempotency-Key...")
+    main.supabase = SupabaseFalso()
+    cliente = main.app.test_client()
+
+    def enviar(chave, respostas):
+        return cliente.post('/processar_questionario', headers={'Idempotency-Key': chave},
+                            json={'dados_empresa': DADOS_EMPRESA, 'respostas': respostas})
+
+    primeira = enviar('chave-rota-0001', RESPOSTAS)
+    repetida = enviar('chave-rota-0001', RESPOSTAS)
+    invalida = enviar('x', RESPOSTAS)
+    conflito = enviar('chave-rota-0001', {**RESPOSTAS, '1': 'baixa_carga'})
+    mesmo_id = primeira.get_json()['diagnostico_id'] == repetida.get_json()['diagnostico_id']
+    codigos = [primeira.status_code, repetida.status_code, invalida.status_code, conflito.status_code]
+    ok = codigos == [200, 200, 400, 422] and mesmo_id and len(main.supabase.salvos) == 1
+    print(f"   {'✅' if ok else '❌'} Status: {codigos} - mesmo diagnóstico no reenvio: {mesmo_id}")
+    return ok
+
+# Simula no Node o envio da página: mesma chave para o mesmo corpo, nova chave
+# quando as respostas ou os dados da empresa mudam
+ROTEIRO_CHAVE_ENVIO = """
+const window = globalThis;
+%s
+let respostas = %s, dadosEmpresa = %s;
+const corpo = () => JSON.stringify({dados_empresa: dadosEmpresa, respostas: respostas});
+const primeira = obterChaveEnvio(corpo());
+const repetida = obterChaveEnvio(corpo());
+dadosEmpresa = Object.assign({}, dadosEmpresa, {email: 'novo@teste.com'});
+const empresaEditada = obterChaveEnvio(corpo());
+respostas = Object.assign({}, respostas, {'1': 'baixa_carga'});
+const respostaEditada = obterChaveEnvio(corpo());
+console.log(JSON.stringify([primeira, repetida, empresaEditada, respostaEditada]));
+"""
+
+def test_chave_envio_pagina():
+    """A página gera uma chave nova quando qualquer campo enviado muda, e o servidor aceita o reenvio"""
+    print("🧪 Testando a chave de idempotência da página...")
+    if not shutil.which('node'):
+        print("   ⚠️ Node.js não instalado - script da página não executado")
+        return True
+    pagina = main.app.test_client().get('/questionario').get_data(as_text=True)
+    declaracoes = re.search(r'let chaveEnvio = null;\s*let corpoChaveEnvio = null;', pagina).group(0)
+    funcao = re.search(r'function obterChaveEnvio\(corpo\) \{.*?\n\}', pagina, re.S).group(0)
+    roteiro = ROTEIRO_CHAVE_ENVIO % (declaracoes + '\n' + funcao, json.dumps(RESPOSTAS), json.dumps(DADOS_EMPRESA))
+    processo = subprocess.run(['node', '-e', roteiro], capture_output=True, text=True, timeout=30)
+    primeira, repetida, empresa_editada, resposta_editada = json.loads(processo.stdout)
+
+    # O reenvio depois de editar a empresa, com a chave nova, não conflita com o primeiro envio
+    main.supabase = SupabaseFalso()
+    cliente = main.app.test_client()
+    codigos = [cliente.post('/processar_questionario', headers={'Idempotency-Key': chave}, json={
+        'dados_empresa': dados, 'respostas': RESPOSTAS}).status_code
+        for chave, dados in ((primeira, DADOS_EMPRESA), (empresa_editada, {**DADOS_EMPRESA, 'email': 'novo@teste.com'}))]
+    ok = primeira == repetida and len({primeira, empresa_editada, resposta_editada}) == 3 and codigos == [200, 200]
+    print(f"   {'✅' if ok else '❌'} Mesma chave no reenvio: {primeira == repetida}"
+          f" - chaves distintas após edições: {len({primeira, empresa_editada, resposta_editada}) == 3} - status: {codigos}")
+    return ok
+
+def main_teste():
+    """Função principal"""
+    print("=" * 60)
+    print("🧪 TESTE DO ENVIO DO QUESTIONÁRIO")
+    print("=" * 60)
+
+    resultados = [
+        ("Salvamento em uma chamada RPC", test_salvamento_rpc()),
+        ("Fallback sem a função RPC", test_salvamento_sem_rpc()),
+        ("Journal write-behind", test_journal_write_behind()),
+        ("Journal durável", test_journal_duravel()),
+        ("Envios simultâneos", test_envios_simultaneos()),
+        ("Rota com Idempotency-Key", test_rota_idempotencia()),
+        ("Chave de idempotência da página", test_chave_envio_pagina()),
+    ]
+
+    print("\n" + "=" * 60)
+    for nome, ok in resultados:
+        print(f"{'✅ PASSOU' if ok else '❌ FALHOU'} - {nome}")
+
+    if all(ok for _, ok in resultados):
+        print("\n🎉 TODOS OS TESTES DO ENVIO PASSARAM!")
+    else:
+        print("\n⚠️ ALGUNS TESTES FALHARAM!")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main_teste()
@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Teste do Resultado do Diagnóstico - Programa Equilíbrio
+Verifica o armazém de resultados (LRU em memória + SQLite compartilhado)
+usado por /resultado e /gerar_pdf, o cache da página com ETag e o cache
+dos relatórios PDF (com limite de tamanho), com um cliente Supabase falso
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+_pasta = tempfile.mkdtemp()
+os.environ['CNPJ_CACHE_PATH'] = os.path.join(_pasta, 'cache_teste.sqlite3')
+os.environ['PDF_CACHE_DIR'] = os.path.join(_pasta, 'pdfs')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import main
+
+DADOS_EMPRESA = {'cnpj': '11.222.333/0001-81', 'razao_social': 'EMPRESA RESULTADO LTDA', 'email': 'rh@teste.com'}
+RESPOSTAS = {'1': 'alta_carga', '2': 'frequencia_alta', '6': 'frequentes'}
+
+class ConsultaDiagnosticos:
+    """select/eq/update/execute na tabela diagnosticos do banco falso"""
+    def __init__(self, supabase):
+        self.supabase = supabase
+        self.colunas = None
+        self.alteracao = None
+        self.diagnostico_id = None
+
+    def select(self, colunas):
+        self.colunas = colunas
+        return self
+
+    def update(self, alteracao):
+        self.alteracao = alteracao
+        return self
+
+    def eq(self, coluna, valor):
+        self.diagnostico_id = valor
+        return self
+
+    def execute(self):
+        supabase = self.supabase
+        with supabase._lock:
+            linha = supabase.diagnosticos.get(self.diagnostico_id)
+            if self.alteracao is not None:
+                supabase.alteracoes.append((self.diagnostico_id, self.alteracao))
+                if linha is not None:
+                    linha.update(self.alteracao)
+                    # Como o trigger update_diagnosticos_updated_at
+                    linha['updated_at'] = f'2026-03-01T10:00:{len(supabase.alteracoes):02d}+00:00'
+
+            else:
+                supabase.consultas.append(self.colunas)
+        return type('Resultado', (), {'data': [dict(linha)] if linha else []})()
+
+class SupabaseFalso:
+    """RPC de salvamento e tabela diagnosticos (com a empresa embutida, como o select com join)"""
+    def __init__(self):
+        self.diagnosticos = {}
+        self.consultas = []
+        self.alteracoes = []
+        self._lock = threading.Lock()
+
+    def gravar(self, empresa, diagnostico):
+        diagnostico_id = diagnostico.get('id') or str(uuid.uuid4())
+        with self._lock:
+            self.diagnosticos[diagnostico_id] = {
+                'id': diagnostico_id, 'empresa_id': 'empresa-1', 'empresas': dict(empresa),
+                'respostas': diagnostico.get('respostas'), 'analise': diagnostico.get('analise'),
+                'status': 'concluido', 'updated_at': '2026-01-01T10:00:00+00:00',
+            }
+        return diagnostico_id
+
+    def rpc(self, nome, parametros):
+        supabase = self
+
+        class Chamada:
+            def execute(self):
+                diagnostico_id = supabase.gravar(parametros['p_empresa'], parametros['p_diagnostico'])
+                return type('Resultado', (), {'data': {'empresa_id': 'empresa-1', 'diagnostico_id': diagnostico_id}})()
+
+        return Chamada()
+
+    def table(self, nome):
+        return ConsultaDiagnosticos(self)
+
+def diagnostico_no_banco(supabase):
+    analise = main.gerar_analise(RESPOSTAS)
+    return supabase.gravar(DADOS_EMPRESA, {'respostas': RESPOSTAS, 'analise': analise})
+
+def test_armazem_lru_ttl():
+    """O armazém em memória descarta o menos usado e os itens vencidos"""
+    print("🧪 Testando LRU e TTL do armazém...")
+    armazem = main.ArmazemResultados(2, 60)
+    armazem.salvar('a', {'id': 'a'})
+    armazem.salvar('b', {'id': 'b'})
+    armazem.obter('a')
+    armazem.salvar('c', {'id': 'c'})
+    presentes = [chave for chave in 'abc' if armazem.obter(chave)]
+    vencido = main.ArmazemResultados(2, -1)
+    vencido.salvar('a', {'id': 'a'})
+    ok = presentes == ['a', 'c'] and vencido.obter('a') is None
+    print(f"   {'✅' if ok else '❌'} Presentes após 3 gravações: {presentes} - vencido: {vencido.obter('a')}")
+    return ok
+
+def test_armazem_compartilhado():
+    """Dois workers (duas instâncias com o mesmo SQLite) enxergam o mesmo resultado"""
+    print("🧪 Testando armazém compartilhado entre workers...")
+    caminho = os.path.join(_pasta, 'resultados_compartilhados.sqlite3')
+    worker_1 = main.ArmazemResultados(10, 60, main.CacheCNPJ(caminho, 60, 100, tabela='resultados_cache'))
+    worker_2 = main.ArmazemResultados(10, 60, main.CacheCNPJ(caminho, 60, 100, tabela='resultados_cache'))
+    worker_1.salvar('diagnostico-x', {'diagnostico_id': 'diagnostico-x'})
+    lido = worker_2.obter('diagnostico-x')
+    worker_2.remover('diagnostico-x')
+    ok = lido == {'diagnostico_id': 'diagnostico-x'} and worker_1.compartilhado.obter('diagnostico-x') is None
+    print(f"   {'✅' if ok else '❌'} Lido pelo outro worker: {lido}")
+    return ok
+
+def test_resultado_do_banco():
+    """Sem o resultado no armazém, busca no banco uma vez e guarda para as próximas"""
+    print("🧪 Testando busca no banco e reaproveitamento...")
+    supabase = SupabaseFalso()
+    main.supabase = supabase
+    diagnostico_id = diagnostico_no_banco(supabase)
+    primeiro = main.obter_resultado_diagnostico(diagnostico_id)
+    segundo = main.obter_resultado_diagnostico(diagnostico_id)
+    ausente = main.obter_resultado_diagnostico('diagnostico-inexistente')
+    ok = bool(primeiro) and primeiro == segundo and primeiro['dados_empresa']['razao_social'] == 'EMPRESA RESULTADO LTDA'
+    ok = ok and ausente is None and len(supabase.consultas) == 2
+    print(f"   {'✅' if ok else '❌'} Consultas ao banco: {len(supabase.consultas)} (1 leitura + 1 inexistente)")
+    return ok
+
+def test_envio_e_resultado():
+    """Depois do envio, a sessão guarda só o ID e /resultado lê do armazém sem ir ao banco"""
+    print("🧪 Testando envio seguido de /resultado...")
+    supabase = SupabaseFalso()
+    main.supabase = supabase
+    cliente = main.app.test_client()
+    envio = cliente.post('/processar_questionario', json={'dados_empresa': DADOS_EMPRESA, 'respostas': RESPOSTAS}).get_json()
+    with cliente.session_transaction() as sessao:
+        chaves_sessao = sorted(sessao.keys())
+    inicio = time.time()
+    pagina = cliente.get('/resultado')
+    duracao = time.time() - inicio
+    ok = envio.get('status') == 'success' and chaves_sessao == ['diagnostico_id']
+    ok = ok and pagina.status_code == 200 and 'EMPRESA RESULTADO LTDA' in pagina.get_data(as_text=True)
+    ok = ok and not supabase.consultas
+    print(f"   {'✅' if ok else '❌'} Sessão: {chaves_sessao} - /resultado {pagina.status_code} em {duracao * 1000:.0f}ms"
+          f" - consultas ao banco: {len(supabase.consultas)}")
+    return ok
+
+def test_usuarios_diferentes():
+    """Dois usuários que enviam em sequência veem cada um o seu resultado"""
+    print("🧪 Testando resultados de usuários diferentes...")
+    main.supabase = SupabaseFalso()
+    clientes = {}
+    for razao_social in ('EMPRESA PRIMEIRA LTDA', 'EMPRESA SEGUNDA LTDA'):
+        clientes[razao_social] = main.app.test_client()
+        clientes[razao_social].post('/processar_questionario', json={
+            'dados_empresa': {**DADOS_EMPRESA, 'razao_social': razao_social}, 'respostas': RESPOSTAS
+        })
+    paginas = {razao_social: cliente.get('/resultado').get_data(as_text=True) for razao_social, cliente in clientes.items()}
+    ok = 'EMPRESA PRIMEIRA LTDA' in paginas['EMPRESA PRIMEIRA LTDA'] and 'EMPRESA SEGUNDA LTDA' not in paginas['EMPRESA PRIMEIRA LTDA']
+    ok = ok and 'EMPRESA SEGUNDA LTDA' in paginas['EMPRESA SEGUNDA LTDA']
+    print(f"   {'✅' if ok else '❌'} Cada sessão vê o próprio diagnóstico: {ok}")
+    return ok
+
+RENDERIZACOES = []
+render_template_original = main.render_template
+
+def render_template_contado(nome, **contexto):
+    RENDERIZACOES.append(nome)
+    return render_template_original(nome, **contexto)
+
+def test_etag_304():
+    """Reabrir o link com o ETag responde 304 sem renderizar a página de novo"""
+    print("🧪 Testando ETag e 304 em /resultado...")
+    supabase = SupabaseFalso()
+    main.supabase = supabase
+    diagnostico_id = diagnostico_no_banco(supabase)
+    cliente = main.app.test_client()
+    url = f'/resultado?diagnostico_id={diagnostico_id}'
+    main.render_template, RENDERIZACOES[:] = render_template_contado, []
+    try:
+        primeira = cliente.get(url)
+        etag = primeira.headers.get('ETag', '')
+        segunda = cliente.get(url, headers={'If-None-Match': etag})
+        terceira = cliente.get(url)
+    finally:
+        main.render_template = render_template_original
+    ok = primeira.status_code == 200 and etag.startswith('"') and not etag.startswith('W/')
+    ok = ok and segunda.status_code == 304 and not segunda.get_data() and terceira.headers.get('ETag') == etag
+    ok = ok and RENDERIZACOES == ['resultado.html'] and 'no-cache' in primeira.headers.get('Cache-Control', '')
+    print(f"   {'✅' if ok else '❌'} Status: {[primeira.status_code, segunda.status_code, terceira.status_code]}"
+          f" - renderizações: {len(RENDERIZACOES)}")
+    return ok
+
+def test_invalidacao_por_conteudo():
+    """Um diagnóstico alterado no banco gera página e ETag novos"""
+    print("🧪 Testando invalidação da página pelo conteúdo...")
+    supabase = SupabaseFalso()
+    main.supabase = supabase
+    diagnostico_id = diagnostico_no_banco(supabase)
+    cliente = main.app.test_client()
+    url = f'/resultado?diagnostico_id={diagnostico_id}'
+    revalidar_original, main.RESULT_PAGE_REVALIDATE = main.RESULT_PAGE_REVALIDATE, 0
+    try:
+        etag = cliente.get(url).headers.get('ETag')
+        inalterada = cliente.get(url, headers={'If-None-Match': etag}).status_code
+        linha = supabase.diagnosticos[diagnostico_id]
+        linha['empresas'] = {**linha['empresas'], 'razao_social': 'EMPRESA RENOMEADA LTDA'}
+        linha['updated_at'] = '2026-02-01T10:00:00+00:00'
+        alterada = cliente.get(url, headers={'If-None-Match': etag})
+    finally:
+        main.RESULT_PAGE_REVALIDATE = revalidar_original
+    ok = inalterada == 304 and alterada.status_code == 200 and alterada.headers.get('ETag') != etag
+    conferencias = supabase.consultas.count(main.COLUNAS_VERSAO_DIAGNOSTICO)
+    ok = ok and 'EMPRESA RENOMEADA LTDA' in alterada.get_data(as_text=True) and conferencias
+    print(f"   {'✅' if ok else '❌'} Sem alteração: {inalterada} - após alteração: {alterada.status_code}"
+          f" - conferências de versão: {conferencias}")
+    return ok
+
+def test_pdf_url_mantem_etag():
+    """Gravar o pdf_url (que renova o updated_at) não invalida a página nem o ETag"""
+    print("🧪 Testando ETag de /resultado após gerar o PDF...")
+    supabase = SupabaseFalso()
+    main.supabase = supabase
+    diagnostico_id = diagnostico_no_banco(supabase)
+    cliente = main.app.test_client()
+    url = f'/resultado?diagnostico_id={diagnostico_id}'
+    revalidar_original, main.RESULT_PAGE_REVALIDATE = main.RESULT_PAGE_REVALIDATE, 0
+    main.render_template, RENDERIZACOES[:] = render_template_contado, []
+    try:
+        etag = cliente.get(url).headers.get('ETag')
+        pdf = cliente.get(f'/gerar_pdf?diagnostico_id={diagnostico_id}').status_code
+        depois = cliente.get(url, headers={'If-None-Match': etag}).status_code
+    finally:
+        main.RESULT_PAGE_REVALIDATE = revalidar_original
+        main.render_template = render_template_original
+    atualizado = supabase.diagnosticos[diagnostico_id]['updated_at'] != '2026-01-01T10:00:00+00:00'
+    ok = pdf == 200 and atualizado and depois == 304 and RENDERIZACOES == ['resultado.html']
+    print(f"   {'✅' if ok else '❌'} PDF: {pdf} - updated_at renovado: {atualizado} - /resultado: {depois}"
+          f" - renderizações: {len(RENDERIZACOES)}")
+    return ok
+
+def test_em_andamento_sem_cache():
+    """Diagnósticos que não estão concluídos não têm a página guardada"""
+    print("🧪 Testando diagnóstico em andamento...")
+    supabase = SupabaseFalso()
+    main.supabase = supabase
+    diagnostico_id = diagnostico_no_banco(supabase)
+    supabase.diagnosticos[diagnostico_id]['status'] = 'em_andamento'
+    with main.app.test_request_context():
+        pagina = main.obter_pagina_resultado(diagnostico_id)
+    ok = bool(pagina) and main.paginas_resultado.obter(diagnostico_id) is None
+    print(f"   {'✅' if ok else '❌'} Página renderizada: {bool(pagina)} - guardada: {main.paginas_resultado.obter(diagnostico_id) is not None}")
+    return ok
+
+PDFS_GERADOS = []
+
+def criar_pdf_falso(dados):
+    """Substitui criar_pdf_relatorio (ReportLab) por um PDF determinístico e lento"""
+    PDFS_GERADOS.append(dados.get('diagnostico_id'))
+    time.sleep(0.2)
+    return b'%PDF-1.4\n' + json.dumps(dados.get('analise', {}), sort_keys=True).encode('utf-8') + b'\n%%EOF'
+
+def test_pdf_gerado_uma_vez():
+    """Downloads repetidos do mesmo relatório geram o PDF uma vez e gravam o pdf_url"""
+    print("🧪 Testando cache do relatório PDF...")
+    supabase = SupabaseFalso()
+    main.supabase = supabase
+    diagnostico_id = diagnostico_no_banco(supabase)
+    cliente = main.app.test_client()
+    PDFS_GERADOS.clear()
+    primeiro = cliente.get(f'/gerar_pdf?diagnostico_id={diagnostico_id}')
+    segundo = cliente.get(f'/gerar_pdf?diagnostico_id={diagnostico_id}')
+    chave = primeiro.headers.get('ETag', '').strip('"')
+    urls = [alteracao.get('pdf_url') for _, alteracao in supabase.alteracoes]
+    ok = primeiro.status_code == segundo.status_code == 200 and primeiro.get_data() == segundo.get_data()
+    ok = ok and primeiro.get_data().startswith(b'%PDF') and PDFS_GERADOS == [diagnostico_id]
+    ok = ok and urls == [f'/relatorios/{chave}.pdf'] and supabase.diagnosticos[diagnostico_id].get('pdf_url') == urls[0]
+    print(f"   {'✅' if ok else '❌'} PDFs gerados: {len(PDFS_GERADOS)} em 2 downloads - pdf_url: {urls}")
+    return ok
+
+def test_pdf_simultaneo():
+    """Pedidos simultâneos do mesmo relatório esperam uma única geração"""
+    print("🧪 Testando geração simultânea do mesmo relatório...")
+    main.supabase = None
+    dados = {'diagnostico_id': 'diagnostico-simultaneo', 'dados_empresa': DADOS_EMPRESA,
+             'analise': {**main.gerar_analise(RESPOSTAS), 'nivel_risco': 'Simultâneo'}}
+    PDFS_GERADOS.clear()
+    caminhos = []
+
+    def pedir():
+        with main.app.test_request_context():
+            caminhos.append(main.obter_pdf_relatorio(dados)[1])
+
+    threads = [threading.Thread(target=pedir) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    ok = len(PDFS_GERADOS) == 1 and len(set(caminhos)) == 1 and len(caminhos) == 5
+    print(f"   {'✅' if ok else '❌'} 5 pedidos, {len(PDFS_GERADOS)} geração(ões)")
+    return ok
+
+def test_chave_por_conteudo():
+    """Outro conteúdo (análise diferente) gera outra chave e outro PDF"""
+    print("🧪 Testando chave do relatório por conteúdo...")
+    analise = main.gerar_analise(RESPOSTAS)
+    dados = {'dados_empresa': DADOS_EMPRESA, 'analise': analise}
+    mesma = main.chave_pdf_relatorio(dict(dados, diagnostico_id='outro-id')) == main.chave_pdf_relatorio(dados)
+    outra = main.chave_pdf_relatorio({**dados, 'analise': {**analise, 'nivel_risco': 'Alterado'}}) != main.chave_pdf_relatorio(dados)
+    ok = mesma and outra and main.CHAVE_PDF_RE.fullmatch(main.chave_pdf_relatorio(dados)) is not None
+    print(f"   {'✅' if ok else '❌'} Mesmo conteúdo, mesma chave: {mesma} - conteúdo alterado, outra chave: {outra}")
+    return ok
+
+def test_download_relatorio():
+    """/relatorios/<chave>.pdf responde 304 para o ETag e 206 para um Range"""
+    print("🧪 Testando download pelo pdf_url...")
+    main.supabase = None
+    dados = {'dados_empresa': DADOS_EMPRESA, 'analise': {**main.gerar_analise(RESPOSTAS), 'nivel_risco': 'Download'}}
+    with main.app.test_request_context():
+        chave, _ = main.obter_pdf_relatorio(dados)
+    cliente = main.app.test_client()
+    url = f'/relatorios/{chave}.pdf'
+    completo = cliente.get(url)
+    condicional = cliente.get(url, headers={'If-None-Match': f'"{chave}"'})
+    parcial = cliente.get(url, headers={'Range': 'bytes=0-3'})
+    inexistente = cliente.get(f'/relatorios/{"0" * 64}.pdf')
+    invalida = cliente.get('/relatorios/..%2F..%2Fetc%2Fpasswd.pdf')
+    codigos = [completo.status_code, condicional.status_code, parcial.status_code, inexistente.status_code, invalida.status_code]
+    ok = codigos == [200, 304, 206, 404, 404] and parcial.get_data() == b'%PDF'
+    ok = ok and 'max-age=31536000' in completo.headers.get('Cache-Control', '')
+    print(f"   {'✅' if ok else '❌'} Status: {codigos} - Range: {parcial.get_data()!r}")
+    return ok
+
+def test_limite_pasta_pdfs():
+    """Acima do tamanho máximo saem os PDFs usados há mais tempo; os vencidos saem sempre"""
+    print("🧪 Testando limite de tamanho e idade da pasta de PDFs...")
+    armazem = main.ArmazemPDFs(os.path.join(_pasta, 'pdfs_limitados'), max_bytes=3500, ttl=3600)
+    chaves = [f'{numero:064x}' for numero in range(4)]
+    agora = time.time()
+    for indice, chave in enumerate(chaves[:3]):
+        armazem.salvar(chave, b'x' * 1000)
+        os.utime(armazem.caminho(chave), (agora - 30 + indice, agora - 30 + indice))
+    armazem.obter(chaves[0])
+    armazem.salvar(chaves[3], b'x' * 1000)
+    presentes = [chave[-1] for chave in chaves if os.path.exists(armazem.caminho(chave))]
+    os.utime(armazem.caminho(chaves[0]), (agora - 7200, agora - 7200))
+    armazem.limpar()
+    depois_ttl = [chave[-1] for chave in chaves if os.path.exists(armazem.caminho(chave))]
+    ok = presentes == ['0', '2', '3'] and depois_ttl == ['2', '3']
+    print(f"   {'✅' if ok else '❌'} Presentes (limite de 3 PDFs, 0 usado por último): {presentes} - após vencer o 0: {depois_ttl}")
+    return ok
+
+def main_teste():
+    """Função principal"""
+    print("=" * 60)
+    print("🧪 TESTE DO RESULTADO DO DIAGNÓSTICO")
+    print("=" * 60)
+
+    main.criar_pdf_relatorio = criar_pdf_falso
+
+    resultados = [
+        ("LRU e TTL do armazém", test_armazem_lru_ttl()),
+        ("Armazém compartilhado", test_armazem_compartilhado()),
+        ("Resultado do banco", test_resultado_do_banco()),
+        ("Envio e /resultado", test_envio_e_resultado()),
+        ("Usuários diferentes", test_usuarios_diferentes()),
+        ("ETag e 304", test_etag_304()),
+        ("Invalidação pelo conteúdo", test_invalidacao_por_conteudo()),
+        ("Diagnóstico em andamento", test_em_andamento_sem_cache()),
+        ("PDF gerado uma vez", test_pdf_gerado_uma_vez()),
+        ("PDF simultâneo", test_pdf_simultaneo()),
+        ("Chave do PDF por conteúdo", test_chave_por_conteudo()),
+        ("Download pelo pdf_url", test_download_relatorio()),
+        ("pdf_url mantém o ETag", test_pdf_url_mantem_etag()),
+        ("Limite da pasta de PDFs", test_limite_pasta_pdfs()),
+    ]
+
+    print("\n" + "=" * 60)
+    for nome, ok in resultados:
+        print(f"{'✅ PASSOU' if ok else '❌ FALHOU'} - {nome}")
+
+    if all(ok for _, ok in resultados):
+        print("\n🎉 TODOS OS TESTES DO RESULTADO PASSARAM!")
+    else:
+        print("\n⚠️ ALGUNS TESTES FALHARAM!")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main_teste()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Teste da Sessão no Servidor - Programa Equilíbrio
+Com SESSION_BACKEND=sqlite, verifica que o cookie leva só o ID da sessão,
+que os dados ficam no armazenamento (compartilhado entre workers), a
+expiração deslizante, a troca do ID no login, falhas do armazenamento e os
+armazenamentos em memória e Redis (com um cliente falso)
+"""
+
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+_pasta = tempfile.mkdtemp()
+os.environ['CNPJ_CACHE_PATH'] = os.path.join(_pasta, 'cache_teste.sqlite3')
+os.environ['SESSION_BACKEND'] = 'sqlite'
+os.environ['SESSION_SQLITE_PATH'] = os.path.join(_pasta, 'sessoes.sqlite3')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import main
+from sessao_servidor import (ArmazenamentoSessaoMemoria, ArmazenamentoSessaoRedis, ArmazenamentoSessaoSQLite,
+                             InterfaceSessaoServidor)
+
+NOME_COOKIE = main.app.config['SESSION_COOKIE_NAME']
+
+def entrar_como_admin(cliente):
+    """Login do admin pelo fallback local (sem Supabase configurado)"""
+    main.supabase = None
+    return cliente.post('/admin/login', data={'username': 'admin', 'password': 'admin123'})
+
+def test_cookie_so_com_id():
+    """Depois do login, o cookie tem só um ID opaco e os dados ficam no SQLite"""
+    print("🧪 Testando cookie com apenas o ID da sessão...")
+    cliente = main.app.test_client()
+    entrar_como_admin(cliente)
+    cookie = cliente.get_cookie(NOME_COOKIE)
+    sid = cookie.value if cookie else ''
+    dados = ArmazenamentoSessaoSQLite(os.environ['SESSION_SQLITE_PATH']).obter(sid) or {}
+    autenticado = cliente.get('/admin/debug').get_json().get('has_admin_user')
+    ok = isinstance(main.app.session_interface, InterfaceSessaoServidor) and 20 < len(sid) <= 64
+    ok = ok and '.' not in sid and dados.get('admin_user', {}).get('username') == 'admin' and autenticado
+    print(f"   {'✅' if ok else '❌'} Cookie: {len(sid)} caracteres - dados no servidor: {sorted(dados)} - autenticado: {autenticado}")
+    return ok
+
+def test_id_desconhecido():
+    """Um ID inventado pelo cliente não é aceito nem reaproveitado"""
+    print("🧪 Testando ID de sessão desconhecido...")
+    cliente = main.app.test_client()
+    cliente.set_cookie(NOME_COOKIE, 'id-inventado-pelo-cliente')
+    redirecionado = cliente.get('/admin/dashboard').status_code == 302
+    entrar_como_admin(cliente)
+    sid = cliente.get_cookie(NOME_COOKIE).value
+    ok = redirecionado and sid != 'id-inventado-pelo-cliente'
+    print(f"   {'✅' if ok else '❌'} Redirecionado sem login: {redirecionado} - novo ID emitido: {sid != 'id-inventado-pelo-cliente'}")
+    return ok
+
+def test_compartilhada_entre_workers():
+    """Outro worker (outra conexão ao mesmo SQLite) lê e remove a mesma sessão"""
+    print("🧪 Testando sessão compartilhada entre workers...")
+    caminho = os.path.join(_pasta, 'sessoes_workers.sqlite3')
+    worker_1, worker_2 = ArmazenamentoSessaoSQLite(caminho), ArmazenamentoSessaoSQLite(caminho)
+    worker_1.salvar('sid-1', {'diagnostico_id': 'diagnostico-1'}, 60)
+    lido = worker_2.obter('sid-1')
+    worker_2.remover('sid-1')
+    worker_1.salvar('sid-2', {'diagnostico_id': 'diagnostico-2'}, -1)
+    ok = lido == {'diagnostico_id': 'diagnostico-1'} and worker_1.obter('sid-1') is None and worker_2.obter('sid-2') is None
+    print(f"   {'✅' if ok else '❌'} Lido pelo outro worker: {lido} - removida e expirada ignoradas: {ok}")
+    return ok
+
+def test_memoria_tipos_e_expiracao():
+    """O armazenamento em memória preserva tipos como o cookie do Flask e respeita o TTL"""
+    print("🧪 Testando armazenamento em memória...")
+    armazenamento = ArmazenamentoSessaoMemoria()
+    dados = {'quando': datetime(2026, 1, 2, 3, 4, 5, tzinfo=timezone.utc), 'par': (1, 2), 'bytes': b'abc'}
+    armazenamento.salvar('sid', dados, 60)
+    lido = armazenamento.obter('sid')
+    armazenamento.salvar('curta', {'x': 1}, 0.05)
+    time.sleep(0.1)
+    ok = lido == dados and armazenamento.obter('curta') is None
+    print(f"   {'✅' if ok else '❌'} Lido: {lido} - expirada: {armazenamento.obter('curta')}")
+    return ok
+
+def test_expiracao_deslizante():
+    """Uma sessão usada continuamente não expira; parada além do TTL, expira"""
+    print("🧪 Testando expiração deslizante da sessão...")
+    tempo_original = main.app.permanent_session_lifetime
+    main.app.permanent_session_lifetime = timedelta(seconds=1)
+    try:
+        cliente = main.app.test_client()
+        entrar_como_admin(cliente)
+        ativos = []
+        for _ in range(7):
+            time.sleep(0.3)
+            ativos.append(cliente.get('/admin/debug').get_json().get('has_admin_user'))
+        time.sleep(1.3)
+        depois_de_parada = cliente.get('/admin/debug').get_json().get('has_admin_user')
+    finally:
+        main.app.permanent_session_lifetime = tempo_original
+    ok = all(ativos) and not depois_de_parada
+    print(f"   {'✅' if ok else '❌'} Em uso por 2,1s (TTL 1s): {ativos} - após 1,3s parada: {depois_de_parada}")
+    return ok
+
+def test_rotacao_no_login():
+    """O login troca o ID da sessão, mantém os dados e remove o ID antigo do armazenamento"""
+    print("🧪 Testando troca do ID da sessão no login...")
+    cliente = main.app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao['diagnostico_id'] = 'diagnostico-1'
+    sid_antes = cliente.get_cookie(NOME_COOKIE).value
+    entrar_como_admin(cliente)
+    sid_depois = cliente.get_cookie(NOME_COOKIE).value
+    armazenamento = ArmazenamentoSessaoSQLite(os.environ['SESSION_SQLITE_PATH'])
+    dados = armazenamento.obter(sid_depois) or {}
+    ok = sid_antes != sid_depois and armazenamento.obter(sid_antes) is None
+    ok = ok and dados.get('diagnostico_id') == 'diagnostico-1' and 'admin_user' in dados
+    print(f"   {'✅' if ok else '❌'} ID trocado: {sid_antes != sid_depois} - antigo removido: "
+          f"{armazenamento.obter(sid_antes) is None} - dados mantidos: {sorted(dados)}")
+    return ok
+
+class ArmazenamentoIndisponivel:
+    """Armazenamento cujo servidor caiu: toda operação levanta erro"""
+    def obter(self, *args):
+        raise ConnectionError('armazenamento fora do ar')
+
+    salvar = renovar = remover = obter
+
+def test_armazenamento_indisponivel():
+    """Com o armazenamento fora do ar a requisição segue, sem erro 500 nem cookie órfão"""
+    print("🧪 Testando armazenamento de sessões indisponível...")
+    interface_original = main.app.session_interface
+    main.app.session_interface = InterfaceSessaoServidor(ArmazenamentoIndisponivel())
+    try:
+        cliente = main.app.test_client()
+        cliente.set_cookie(NOME_COOKIE, 'sid-qualquer')
+        login = entrar_como_admin(cliente)
+        debug = cliente.get('/admin/debug')
+        cookie = cliente.get_cookie(NOME_COOKIE)
+    finally:
+        main.app.session_interface = interface_original
+    ok = login.status_code == 302 and debug.status_code == 200 and cookie.value == 'sid-qualquer'
+    print(f"   {'✅' if ok else '❌'} Login: {login.status_code} - debug: {debug.status_code} - "
+          f"cookie mantido: {cookie.value if cookie else None}")
+    return ok
+
+class RedisFalso:
+    """get/setex/expire/delete de um cliente Redis, em um dicionário"""
+    def __init__(self):
+        self.itens = {}
+        self.ttls = {}
+
+    def get(self, chave):
+        return self.itens.get(chave)
+
+    def setex(self, chave, ttl, valor):
+        self.itens[chave] = valor.encode('utf-8')
+        self.ttls[chave] = ttl
+
+    def expire(self, chave, ttl):
+        if chave in self.itens:
+            self.ttls[chave] = ttl
+
+    def delete(self, chave):
+        self.itens.pop(chave, None)
+
+def test_redis():
+    """O armazenamento Redis grava com expiração e usa o prefixo configurado"""
+    print("🧪 Testando armazenamento Redis (cliente falso)...")
+    cliente = RedisFalso()
+    armazenamento = ArmazenamentoSessaoRedis('redis://teste', cliente=cliente)
+    armazenamento.salvar('sid', {'admin_user': {'username': 'admin'}}, 3600)
+    lido = armazenamento.obter('sid')
+    chaves = list(cliente.itens)
+    armazenamento.salvar('sid', {'admin_user': {'username': 'admin'}}, 60)
+    armazenamento.renovar('sid', 3600)
+    armazenamento.remover('sid')
+    ok = lido == {'admin_user': {'username': 'admin'}} and chaves == ['programaequilibrio:sessao:sid']
+    ok = ok and cliente.ttls[chaves[0]] == 3600 and armazenamento.obter('sid') is None
+    print(f"   {'✅' if ok else '❌'} Chaves: {chaves} - TTL: {cliente.ttls.get(chaves[0]) if chaves else None}")
+    return ok
+
+def main_teste():
+    """Função principal"""
+    print("=" * 60)
+    print("🧪 TESTE DA SESSÃO NO SERVIDOR")
+    print("=" * 60)
+
+    resultados = [
+        ("Cookie só com o ID", test_cookie_so_com_id()),
+        ("ID desconhecido", test_id_desconhecido()),
+        ("Compartilhada entre workers", test_compartilhada_entre_workers()),
+        ("Memória: tipos e expiração", test_memoria_tipos_e_expiracao()),
+        ("Expiração deslizante", test_expiracao_deslizante()),
+        ("Novo ID no login", test_rotacao_no_login()),
+        ("Armazenamento indisponível", test_armazenamento_indisponivel()),
+        ("Redis", test_redis()),
+    ]
+
+    print("\n" + "=" * 60)
+    for nome, ok in resultados:
+        print(f"{'✅ PASSOU' if ok else '❌ FALHOU'} - {nome}")
+
+    if all(ok for _, ok in resultados):
+        print("\n🎉 TODOS OS TESTES DA SESSÃO PASSARAM!")
+    else:
+        print("\n⚠️ ALGUNS TESTES FALHARAM!")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main_teste()
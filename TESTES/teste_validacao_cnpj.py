@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Teste da Validação de CNPJs em Lote - Programa Equilíbrio
+Compara validar_cnpjs_em_lote() (NumPy) com validar_cnpj() de main.py em
+CNPJs válidos, alterados, formatados, curtos e numéricos, e roda a CLI
+"""
+
+import os
+import random
+import subprocess
+import sys
+import tempfile
+
+os.environ['CNPJ_CACHE_PATH'] = os.path.join(tempfile.mkdtemp(), 'cache_teste.sqlite3')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import main
+from validacao_cnpj import validar_cnpjs_em_lote
+
+SCRIPT_VALIDACAO = os.path.join(os.path.dirname(__file__), '..', 'validacao_cnpj.py')
+
+def gerar_entradas(quantidade, semente=42):
+    """CNPJs válidos e variações que devem ser recusadas (ou aceitas) pelas duas validações"""
+    aleatorio = random.Random(semente)
+    gerador = main.cnpj_validator
+    entradas = []
+    for _ in range(quantidade):
+        cnpj = gerador.generate(mask=aleatorio.random() < 0.5)
+        variacao = aleatorio.randrange(8)
+        if variacao == 1:
+            # Um dígito trocado
+            posicao = aleatorio.choice([i for i, c in enumerate(cnpj) if c.isdigit()])
+            cnpj = cnpj[:posicao] + str((int(cnpj[posicao]) + 1) % 10) + cnpj[posicao + 1:]
+        elif variacao == 2:
+            cnpj = cnpj[:-1]
+        elif variacao == 3:
+            cnpj = str(aleatorio.randrange(10)) * 14
+        elif variacao == 4:
+            cnpj = f" {cnpj} "
+        elif variacao == 5:
+            cnpj = cnpj + '0'
+        elif variacao == 6:
+            cnpj = ''
+        entradas.append(cnpj)
+    return entradas
+
+def test_equivalencia():
+    """O lote dá o mesmo resultado de validar_cnpj() para cada entrada"""
+    print("🧪 Testando equivalência com validar_cnpj()...")
+    entradas = gerar_entradas(5000)
+    validos, chaves = validar_cnpjs_em_lote(entradas)
+    esperados = [main.validar_cnpj(cnpj) for cnpj in entradas]
+    divergentes = [cnpj for cnpj, obtido, esperado in zip(entradas, validos.tolist(), esperados) if obtido != esperado]
+    chaves_ok = all(chave == main.limpar_cnpj(cnpj) for cnpj, chave, valido in zip(entradas, chaves, validos) if valido)
+    ok = not divergentes and chaves_ok and 0 < sum(esperados) < len(entradas)
+    print(f"   {'✅' if ok else '❌'} {len(entradas)} entradas, {sum(esperados)} válidas, {len(divergentes)} divergente(s) {divergentes[:3]}")
+    return ok
+
+def test_entradas_numericas():
+    """Números sem os zeros à esquerda (como vêm de planilhas) e valores vazios"""
+    print("🧪 Testando entradas numéricas e vazias...")
+    validos, chaves = validar_cnpjs_em_lote([7526557000100, "07.526.557/0001-00", None, float('nan'), 11222333000182])
+    ok = validos.tolist() == [True, True, False, False, False] and chaves[0] == "07526557000100"
+    vazio, _ = validar_cnpjs_em_lote([])
+    ok = ok and len(vazio) == 0
+    print(f"   {'✅' if ok else '❌'} Resultado: {validos.tolist()} - chave: {chaves[0]}")
+    return ok
+
+def test_cli():
+    """A CLI lê a coluna do CSV e grava os inválidos"""
+    print("🧪 Testando a CLI de validação...")
+    pasta = tempfile.mkdtemp()
+    entrada = os.path.join(pasta, 'empresas.csv')
+    invalidos = os.path.join(pasta, 'invalidos.txt')
+    with open(entrada, 'w', encoding='utf-8') as arquivo:
+        arquivo.write('nome;cnpj\nA;11.222.333/0001-81\nB;11.222.333/0001-82\nC;07526557000100\nD;11222333000181\n')
+    processo = subprocess.run([sys.executable, SCRIPT_VALIDACAO, entrada, '--coluna', 'cnpj', '--invalidos', invalidos],
+                              capture_output=True, text=True, timeout=60)
+    with open(invalidos, encoding='utf-8') as arquivo:
+        linhas_invalidas = arquivo.read().splitlines()
+    ok = processo.returncode == 0 and '3 válidos de 4' in processo.stdout and '2 CNPJs válidos distintos' in processo.stdout
+    ok = ok and linhas_invalidas == ['11.222.333/0001-82']
+    print(f"   {'✅' if ok else '❌'} Código {processo.returncode} - inválidos: {linhas_invalidas} - saída: {processo.stdout.strip()!r}")
+    return ok
+
+def main_teste():
+    """Função principal"""
+    print("=" * 60)
+    print("🧪 TESTE DA VALIDAÇÃO DE CNPJS EM LOTE")
+    print("=" * 60)
+
+    if not main.VALIDATION_AVAILABLE:
+        print("⚠️ validate-docbr não instalado - sem referência para comparar")
+        return
+
+    resultados = [
+        ("Equivalência com validar_cnpj()", test_equivalencia()),
+        ("Entradas numéricas e vazias", test_entradas_numericas()),
+        ("CLI de validação", test_cli()),
+    ]
+
+    print("\n" + "=" * 60)
+    for nome, ok in resultados:
+        print(f"{'✅ PASSOU' if ok else '❌ FALHOU'} - {nome}")
+
+    if all(ok for _, ok in resultados):
+        print("\n🎉 TODOS OS TESTES DA VALIDAÇÃO EM LOTE PASSARAM!")
+    else:
+        print("\n⚠️ ALGUNS TESTES FALHARAM!")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main_teste()
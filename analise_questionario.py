@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+
+"""
+Regras de análise do questionário - Programa Equilíbrio
+
+As regras (peso crítico, ação recomendada e área de foco de cada resposta,
+faixas do nível de risco) são dados: REGRAS_PADRAO abaixo ou um arquivo JSON
+com a mesma estrutura (QUESTIONARIO_SCORING_RULES em main.py). MotorAnalise
+compila as regras uma vez em tabelas indexadas por (pergunta, resposta), e
+avaliar() faz só uma leitura de tabela por pergunta. A ordem de áreas e ações
+no resultado segue a ordem de declaração das regras.
+
+Para muitas respostas de uma vez (revisão de carteira, simulações), use
+avaliar_lote(): as respostas viram uma matriz de códigos (uma coluna por
+pergunta) e a pontuação é feita com operações vetoriais do NumPy, com o
+mesmo resultado de avaliar() linha a linha.
+
+Uma nova versão do questionário precisa apenas de um novo arquivo de regras.
+Este módulo não importa main.py.
+"""
+
+import json
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # avaliar_lote() indisponível; avaliar() funciona sem NumPy
+
+REGRAS_PADRAO = {
+    'versao': 1,
+    'regras': [
+        {'pergunta': '1', 'respostas': ['alta_carga'], 'peso': 1,
+         'acao': 'Programa: Comunicação Não Violenta e Segurança Psicológica', 'area': 'Saúde Mental'},
+        {'pergunta': '2', 'respostas': ['frequencia_alta', 'frequencia_moderada'], 'peso': 2,
+         'acao': 'Programa: Prevenção e Manejo do Estresse Ocupacional', 'area': 'Saúde Mental'},
+        {'pergunta': '3', 'respostas': ['critico', 'moderado'], 'peso': 1,
+         'area': 'Saúde Mental'},
+        {'pergunta': '6', 'respostas': ['frequentes', 'ocasionais'], 'peso': 1,
+         'acao': 'Programa: Avaliação Ergonômica Completa', 'area': 'Ergonomia'},
+        {'pergunta': '7', 'respostas': ['nunca', 'nao_recente'], 'peso': 1,
+         'acao': 'Programa: Implementação de Ergonomia no Trabalho', 'area': 'Ergonomia'},
+    ],
+    # Recomendada quando nenhuma resposta gera ação específica
+    'acao_padrao': 'Programa: Promoção de Bem-estar no Trabalho',
+    # (mínimo de questões críticas, nível), da faixa mais alta para a mais baixa
+    'niveis_risco': [[4, 'Alto'], [2, 'Moderado'], [0, 'Baixo']],
+}
+
+
+def _codigo_resposta(codigos, resposta):
+    """Código da resposta na coluna; 0 se não houver regra (inclusive para
+    respostas não hashable, como listas e objetos vindos do JSON)"""
+    try:
+        return codigos.get(resposta, 0)
+    except TypeError:
+        return 0
+
+
+def carregar_regras(caminho=None):
+    """Regras do arquivo JSON informado, ou REGRAS_PADRAO"""
+    if not caminho:
+        return REGRAS_PADRAO
+    with open(caminho, encoding='utf-8') as arquivo:
+        return json.load(arquivo)
+
+
+class MotorAnalise:
+    """Regras compiladas em tabelas de consulta
+
+    Cada pergunta vira uma coluna; cada resposta conhecida da coluna, um
+    código (0 = sem resposta ou resposta sem regra). Para cada (coluna,
+    código) as tabelas guardam o peso e as máscaras de bits das ações e
+    áreas de foco acionadas.
+    """
+
+    def __init__(self, regras=None, perguntas=None):
+        regras = regras or REGRAS_PADRAO
+        self.versao = regras.get('versao')
+        self.acao_padrao = regras.get('acao_padrao')
+        self.niveis_risco = sorted(((int(minimo), nivel) for minimo, nivel in regras['niveis_risco']), reverse=True)
+
+        # Colunas: perguntas do questionário (se informadas) e depois as das regras
+        self.perguntas = [str(pergunta['id']) for pergunta in perguntas or []]
+        self.acoes = []
+        self.areas = []
+        self.codigos = {pergunta: {} for pergunta in self.perguntas}
+        for pergunta in perguntas or []:
+            for opcao in pergunta.get('opcoes', []):
+                self._codigo(str(pergunta['id']), opcao['valor'])
+
+        compiladas = []
+        for regra in regras['regras']:
+            coluna = str(regra['pergunta'])
+            bit_acao = self._bit(self.acoes, regra.get('acao'))
+            bit_area = self._bit(self.areas, regra.get('area'))
+            for resposta in regra['respostas']:
+                compiladas.append((coluna, self._codigo(coluna, resposta), int(regra.get('peso', 0)), bit_acao, bit_area))
+
+        self.pesos = [[0] * (len(self.codigos[coluna]) + 1) for coluna in self.perguntas]
+        self.mascaras_acoes = [[0] * (len(self.codigos[coluna]) + 1) for coluna in self.perguntas]
+        self.mascaras_areas = [[0] * (len(self.codigos[coluna]) + 1) for coluna in self.perguntas]
+        indice_coluna = {coluna: indice for indice, coluna in enumerate(self.perguntas)}
+        for coluna, codigo, peso, bit_acao, bit_area in compiladas:
+            indice = indice_coluna[coluna]
+            self.pesos[indice][codigo] += peso
+            self.mascaras_acoes[indice][codigo] |= bit_acao
+            self.mascaras_areas[indice][codigo] |= bit_area
+
+        self._colunas = list(zip(self.perguntas, (self.codigos[coluna] for coluna in self.perguntas),
+                                 self.pesos, self.mascaras_acoes, self.mascaras_areas))
+        self._tabelas = None  # versão NumPy das tabelas, montada no primeiro avaliar_lote()
+
+    def _codigo(self, coluna, resposta):
+        if coluna not in self.codigos:
+            self.perguntas.append(coluna)
+            self.codigos[coluna] = {}
+        return self.codigos[coluna].setdefault(resposta, len(self.codigos[coluna]) + 1)
+
+    @staticmethod
+    def _bit(lista, valor):
+        if not valor:
+            return 0
+        if valor not in lista:
+            lista.append(valor)
+        return 1 << lista.index(valor)
+
+    def nivel_risco(self, questoes_criticas):
+        for minimo, nivel in self.niveis_risco:
+            if questoes_criticas >= minimo:
+                return nivel
+        return self.niveis_risco[-1][1]
+
+    def decodificar(self, questoes_criticas, mascara_acoes, mascara_areas):
+        """Monta o resultado a partir da soma dos pesos e das máscaras acionadas"""
+        acoes = [acao for indice, acao in enumerate(self.acoes) if mascara_acoes >> indice & 1]
+        if not acoes and self.acao_padrao:
+            acoes = [self.acao_padrao]
+        return {
+            'questoes_criticas': questoes_criticas,
+            'nivel_risco': self.nivel_risco(questoes_criticas),
+            'areas_foco': [area for indice, area in enumerate(self.areas) if mascara_areas >> indice & 1],
+            'acoes_recomendadas': acoes,
+        }
+
+    def avaliar(self, respostas):
+        """Avalia um dicionário {id da pergunta: valor da resposta}"""
+        questoes_criticas = 0
+        mascara_acoes = 0
+        mascara_areas = 0
+        for coluna, codigos, pesos, mascaras_acoes, mascaras_areas in self._colunas:
+            try:
+                codigo = codigos.get(respostas.get(coluna), 0)
+            except TypeError:
+                codigo = 0  # resposta não hashable (lista, objeto): não tem regra
+            questoes_criticas += pesos[codigo]
+            mascara_acoes |= mascaras_acoes[codigo]
+            mascara_areas |= mascaras_areas[codigo]
+        return self.decodificar(questoes_criticas, mascara_acoes, mascara_areas)
+
+    # ------------------------------------------------------------------
+    # Avaliação em lote (NumPy)
+    # ------------------------------------------------------------------
+
+    @property
+    def acoes_lote(self):
+        """Colunas da matriz de ações de avaliar_lote() (inclui a ação padrão)"""
+        if self.acao_padrao and self.acao_padrao not in self.acoes:
+            return self.acoes + [self.acao_padrao]
+        return list(self.acoes)
+
+    def _tabelas_numpy(self):
+        if np is None:
+            raise RuntimeError('avaliar_lote() requer o NumPy (pip install numpy)')
+        if self._tabelas is None:
+            largura = max((len(pesos) for pesos in self.pesos), default=1)
+            pesos = np.zeros((len(self.perguntas), largura), dtype=np.int64)
+            acoes = np.zeros((len(self.perguntas), largura, len(self.acoes)), dtype=bool)
+            areas = np.zeros((len(self.perguntas), largura, len(self.areas)), dtype=bool)
+            for coluna in range(len(self.perguntas)):
+                for codigo in range(len(self.pesos[coluna])):
+                    pesos[coluna, codigo] = self.pesos[coluna][codigo]
+                    acoes[coluna, codigo] = [self.mascaras_acoes[coluna][codigo] >> bit & 1 for bit in range(len(self.acoes))]
+                    areas[coluna, codigo] = [self.mascaras_areas[coluna][codigo] >> bit & 1 for bit in range(len(self.areas))]
+            self._tabelas = (pesos, acoes, areas)
+        return self._tabelas
+
+    def codificar(self, lista_respostas):
+        """Matriz de códigos (linhas = respostas, colunas = self.perguntas; 0 = sem regra)"""
+        if np is None:
+            raise RuntimeError('avaliar_lote() requer o NumPy (pip install numpy)')
+        colunas = [(coluna, codigos) for coluna, codigos, _, _, _ in self._colunas]
+        linhas = [[_codigo_resposta(codigos, respostas.get(coluna)) for coluna, codigos in colunas] for respostas in lista_respostas]
+        return np.array(linhas, dtype=np.int16).reshape(len(linhas), len(colunas))
+
+    def avaliar_matriz(self, codigos):
+        """Pontua uma matriz de codificar()
+
+        Retorna um dicionário de arrays com uma linha por resposta:
+        questoes_criticas (int), nivel_risco (str), areas_foco (bool, colunas
+        em self.areas) e acoes_recomendadas (bool, colunas em self.acoes_lote).
+        """
+        pesos, tabela_acoes, tabela_areas = self._tabelas_numpy()
+        colunas = np.arange(len(self.perguntas))
+
+        questoes_criticas = pesos[colunas, codigos].sum(axis=1)
+        areas = tabela_areas[colunas, codigos].any(axis=1)
+        acoes = tabela_acoes[colunas, codigos].any(axis=1)
+
+        if len(self.acoes_lote) > len(self.acoes):
+            acoes = np.concatenate([acoes, ~acoes.any(axis=1, keepdims=True)], axis=1)
+        elif self.acao_padrao:
+            # Ação padrão já declarada em alguma regra
+            acoes[:, self.acoes.index(self.acao_padrao)] |= ~acoes.any(axis=1)
+
+        # Do menor para o maior mínimo: cada faixa atingida sobrescreve a anterior
+        nomes = np.array([nivel for _, nivel in self.niveis_risco])
+        indice_nivel = np.full(len(questoes_criticas), len(self.niveis_risco) - 1)
+        for indice in range(len(self.niveis_risco) - 1, -1, -1):
+            indice_nivel[questoes_criticas >= self.niveis_risco[indice][0]] = indice
+
+        return {
+            'questoes_criticas': questoes_criticas,
+            'nivel_risco': nomes[indice_nivel],
+            'areas_foco': areas,
+            'acoes_recomendadas': acoes,
+        }
+
+    def avaliar_lote(self, lista_respostas):
+        """Avalia uma sequência de dicionários de respostas de uma vez (ver avaliar_matriz)"""
+        return self.avaliar_matriz(self.codificar(lista_respostas))
+
+    def resultados_lote(self, lote):
+        """Converte o retorno de avaliar_lote() para o formato de avaliar(), linha a linha"""
+        acoes_lote = self.acoes_lote
+        for questoes_criticas, nivel, areas, acoes in zip(lote['questoes_criticas'], lote['nivel_risco'],
+                                                          lote['areas_foco'], lote['acoes_recomendadas']):
+            yield {
+                'questoes_criticas': int(questoes_criticas),
+                'nivel_risco': str(nivel),
+                'areas_foco': [self.areas[indice] for indice in np.flatnonzero(areas)],
+                'acoes_recomendadas': [acoes_lote[indice] for indice in np.flatnonzero(acoes)],
+            }
@@ -9,6 +9,8 @@ from validate_docbr import CNPJ
 import hashlib
 import secrets
 
+from provedores_cnpj import BrasilAPI, ReceitaWS
+
 app = Flask(__name__)
 
 # Configurações da aplicação usando variáveis de ambiente
@@ -35,6 +37,10 @@ def validar_cnpj(cnpj):
     
     return cnpj_validator.validate(cnpj_limpo)
 
+# Provedores de CNPJ (mapeamento das respostas compartilhado com main.py)
+provedor_receita_ws = ReceitaWS(url_base=RECEITAWS_API_URL, timeout=RECEITAWS_TIMEOUT)
+provedor_brasilapi = BrasilAPI()
+
 def consultar_cnpj_receita_ws(cnpj):
     """Consulta dados da empresa na ReceitaWS"""
     try:
@@ -42,54 +48,15 @@ def consultar_cnpj_receita_ws(cnpj):
         cnpj_limpo = re.sub(r'[^\d]', '', cnpj)
         print(f"🔍 [ReceitaWS] Consultando CNPJ: {cnpj_limpo}")
         
-        # Faz a requisição para a API usando timeout configurado
-        response = requests.get(f"{RECEITAWS_API_URL}{cnpj_limpo}", timeout=RECEITAWS_TIMEOUT)
-        print(f"📡 [ReceitaWS] Status HTTP: {response.status_code}")
-        
-        if response.status_code == 200:
-            data = response.json()
-            print(f"📋 [ReceitaWS] Dados brutos recebidos:")
-            print(f"   Status API: {data.get('status', 'N/A')}")
-            print(f"   Nome: {data.get('nome', 'N/A')}")
-            print(f"   Fantasia: {data.get('fantasia', 'N/A')}")
-            print(f"   Situação: {data.get('situacao', 'N/A')}")
-            print(f"   Município: {data.get('municipio', 'N/A')}")
-            print(f"   UF: {data.get('uf', 'N/A')}")
-            
-            # Verifica se houve erro na consulta
-            if data.get('status') == 'ERROR':
-                print(f"❌ [ReceitaWS] API retornou erro: {data.get('message', 'Erro não especificado')}")
-                return None
-            
-            resultado = {
-                'razao_social': data.get('nome', ''),
-                'nome_fantasia': data.get('fantasia', ''),
-                'cnpj': cnpj_limpo,
-                'situacao': data.get('situacao', ''),
-                'atividade_principal': data.get('atividade_principal', [{}])[0].get('text', '') if data.get('atividade_principal') else '',
-                'endereco': {
-                    'logradouro': data.get('logradouro', ''),
-                    'numero': data.get('numero', ''),
-                    'complemento': data.get('complemento', ''),
-                    'bairro': data.get('bairro', ''),
-                    'municipio': data.get('municipio', ''),
-                    'uf': data.get('uf', ''),
-                    'cep': data.get('cep', '')
-                },
-                'telefone': data.get('telefone', ''),
-                'email': data.get('email', ''),
-                'data_abertura': data.get('abertura', '')
-            }
-            
-            print(f"✅ [ReceitaWS] Dados processados:")
-            print(f"   Razão Social: '{resultado.get('razao_social')}'")
-            print(f"   Situação: '{resultado.get('situacao')}'")
-            print(f"   Tem razão social: {bool(resultado.get('razao_social'))}")
-            
-            return resultado
-        else:
-            print(f"❌ [ReceitaWS] Erro HTTP {response.status_code}: {response.text[:200]}")
+        resultado = provedor_receita_ws.consultar(cnpj_limpo)
+        if not resultado:
+            print(f"❌ [ReceitaWS] Nenhum dado retornado")
             return None
+        
+        print(f"✅ [ReceitaWS] Dados processados:")
+        print(f"   Razão Social: '{resultado.razao_social}'")
+        print(f"   Situação: '{resultado.situacao}'")
+        return resultado.para_dict()
             
     except requests.exceptions.RequestException as e:
         print(f"❌ [ReceitaWS] Erro de requisição: {e}")
@@ -104,42 +71,8 @@ def consultar_brasilapi(cnpj):
         # Remove caracteres especiais do CNPJ
         cnpj_limpo = ''.join(filter(str.isdigit, cnpj))
         
-        url = f"https://brasilapi.com.br/api/cnpj/v1/{cnpj_limpo}"
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
-        
-        response = requests.get(url, headers=headers, timeout=15)
-        
-        if response.status_code == 200:
-            data = response.json()
-            
-            # Verifica se tem dados essenciais
-            if not data.get('legal_name'):
-                return None
-            
-            # Converte para formato compatível com ReceitaWS
-            return {
-                'razao_social': data.get('legal_name', ''),
-                'nome_fantasia': data.get('trade_name', ''),
-                'cnpj': cnpj_limpo,
-                'situacao': data.get('registration_status', ''),
-                'atividade_principal': '',  # BrasilAPI tem estrutura diferente
-                'endereco': {
-                    'logradouro': data.get('address', {}).get('street', ''),
-                    'numero': data.get('address', {}).get('number', ''),
-                    'complemento': data.get('address', {}).get('details', ''),
-                    'bairro': data.get('address', {}).get('district', ''),
-                    'municipio': data.get('address', {}).get('city', ''),
-                    'uf': data.get('address', {}).get('state', ''),
-                    'cep': data.get('address', {}).get('zip_code', '')
-                },
-                'telefone': data.get('phone', ''),
-                'email': data.get('email', ''),
-                'data_abertura': data.get('founded', '')
-            }
-            
-        return None
+        resultado = provedor_brasilapi.consultar(cnpj_limpo)
+        return resultado.para_dict() if resultado else None
             
     except Exception as e:
         print(f"Erro na BrasilAPI: {e}")
@@ -186,3 +186,84 @@ BEGIN
              e.rh_responsavel, e.cargo_rh;
 END;
 $$ LANGUAGE plpgsql;
+
+-- 11. Função para salvar empresa e diagnóstico em uma única chamada (RPC)
+-- Faz o upsert da empresa pelo CNPJ (sem corrida entre envios simultâneos)
+-- e insere o diagnóstico na mesma transação. Retorna os dois IDs.
+-- Se p_diagnostico trouxer "id", reenviar o mesmo diagnóstico não o duplica.
+CREATE OR REPLACE FUNCTION salvar_empresa_diagnostico(p_empresa JSONB, p_diagnostico JSONB)
+RETURNS JSONB AS $$
+DECLARE
+    v_empresa_id UUID;
+    v_diagnostico_id UUID;
+BEGIN
+    INSERT INTO empresas (
+        razao_social, nome_fantasia, cnpj, email, telefone, whatsapp, endereco,
+        num_colaboradores, setor_atividade, rh_responsavel, cargo_rh
+    )
+    VALUES (
+        p_empresa->>'razao_social',
+        p_empresa->>'nome_fantasia',
+        p_empresa->>'cnpj',
+        p_empresa->>'email',
+        p_empresa->>'telefone',
+        p_empresa->>'whatsapp',
+        COALESCE(p_empresa->'endereco', '{}'::jsonb),
+        (p_empresa->>'num_colaboradores')::INTEGER,
+        p_empresa->>'setor_atividade',
+        p_empresa->>'rh_responsavel',
+        p_empresa->>'cargo_rh'
+    )
+    -- Empresa já cadastrada: atualiza apenas os dados do responsável e do porte
+    ON CONFLICT (cnpj) DO UPDATE SET
+        rh_responsavel = EXCLUDED.rh_responsavel,
+        cargo_rh = EXCLUDED.cargo_rh,
+        email = EXCLUDED.email,
+        whatsapp = EXCLUDED.whatsapp,
+        num_colaboradores = EXCLUDED.num_colaboradores,
+        setor_atividade = EXCLUDED.setor_atividade
+    RETURNING id INTO v_empresa_id;
+
+    INSERT INTO diagnosticos (
+        id, empresa_id, respostas, analise, nivel_risco, questoes_criticas,
+        areas_foco, acoes_recomendadas, status
+    )
+    VALUES (
+        COALESCE((p_diagnostico->>'id')::UUID, gen_random_uuid()),
+        v_empresa_id,
+        p_diagnostico->'respostas',
+        p_diagnostico->'analise',
+        p_diagnostico->>'nivel_risco',
+        COALESCE((p_diagnostico->>'questoes_criticas')::INTEGER, 0),
+        ARRAY(SELECT jsonb_array_elements_text(COALESCE(p_diagnostico->'areas_foco', '[]'::jsonb))),
+        ARRAY(SELECT jsonb_array_elements_text(COALESCE(p_diagnostico->'acoes_recomendadas', '[]'::jsonb))),
+        COALESCE(p_diagnostico->>'status', 'concluido')
+    )
+    ON CONFLICT (id) DO NOTHING
+    RETURNING id INTO v_diagnostico_id;
+
+    IF v_diagnostico_id IS NULL THEN
+        -- Diagnóstico já gravado por um envio anterior
+        v_diagnostico_id := (p_diagnostico->>'id')::UUID;
+    END IF;
+
+    RETURN jsonb_build_object('empresa_id', v_empresa_id, 'diagnostico_id', v_diagnostico_id);
+END;
+$$ LANGUAGE plpgsql;
+
+-- 12. Gravação em lote (fila de questionários pendentes da aplicação)
+-- p_itens: [{"empresa": {...}, "diagnostico": {...}}, ...]
+CREATE OR REPLACE FUNCTION salvar_empresas_diagnosticos_lote(p_itens JSONB)
+RETURNS JSONB AS $$
+DECLARE
+    v_item JSONB;
+    v_resultados JSONB := '[]'::jsonb;
+BEGIN
+    FOR v_item IN SELECT * FROM jsonb_array_elements(p_itens) LOOP
+        v_resultados := v_resultados || jsonb_build_array(
+            salvar_empresa_diagnostico(v_item->'empresa', v_item->'diagnostico')
+        );
+    END LOOP;
+    RETURN v_resultados;
+END;
+$$ LANGUAGE plpgsql;
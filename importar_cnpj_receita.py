@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Importa os dados abertos de CNPJ da Receita Federal para uma base SQLite local
+Execute: python importar_cnpj_receita.py <arquivos ou pastas> --destino base_cnpj.sqlite3
+
+Aceita os arquivos como publicados (Empresas*.zip, Estabelecimentos*.zip,
+Municipios.zip, Cnaes.zip) ou já descompactados (*.EMPRECSV, *.ESTABELE,
+*.MUNICCSV, *.CNAECSV). As linhas são lidas em streaming e gravadas em lotes,
+portanto o uso de memória não depende do tamanho do dump.
+
+A base gerada é consultada por consultar_base_receita_local() em main.py
+(variável de ambiente CNPJ_OFFLINE_DB_PATH).
+"""
+
+import argparse
+import csv
+import io
+import os
+import sqlite3
+import sys
+import time
+import zipfile
+
+TAMANHO_LOTE = 10000
+
+# Tipos de arquivo do dump, identificados pelo nome (interno ou externo)
+TIPOS_ARQUIVO = [
+    ('ESTABELE', 'estabelecimentos'),
+    ('EMPRE', 'empresas'),
+    ('MUNIC', 'municipios'),
+    ('CNAE', 'cnaes'),
+]
+
+# Ordem de importação: tabelas de domínio primeiro
+ORDEM_TIPOS = ['municipios', 'cnaes', 'empresas', 'estabelecimentos']
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS rf_empresas (
+    cnpj_basico TEXT PRIMARY KEY,
+    razao_social TEXT
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS rf_estabelecimentos (
+    cnpj TEXT PRIMARY KEY,
+    cnpj_basico TEXT NOT NULL,
+    nome_fantasia TEXT,
+    situacao TEXT,
+    data_inicio TEXT,
+    cnae_principal TEXT,
+    tipo_logradouro TEXT,
+    logradouro TEXT,
+    numero TEXT,
+    complemento TEXT,
+    bairro TEXT,
+    cep TEXT,
+    uf TEXT,
+    municipio TEXT,
+    telefone TEXT,
+    email TEXT
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS rf_municipios (
+    codigo TEXT PRIMARY KEY,
+    nome TEXT
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS rf_cnaes (
+    codigo TEXT PRIMARY KEY,
+    descricao TEXT
+) WITHOUT ROWID;
+"""
+
+def identificar_tipo(nome):
+    """Retorna o tipo do arquivo do dump a partir do nome, ou None"""
+    nome = os.path.basename(nome).upper()
+    for marcador, tipo in TIPOS_ARQUIVO:
+        if marcador in nome:
+            return tipo
+    return None
+
+def listar_arquivos(caminhos):
+    """Expande pastas e agrupa os arquivos por tipo, na ordem de importação"""
+    por_tipo = {tipo: [] for tipo in ORDEM_TIPOS}
+    for caminho in caminhos:
+        if os.path.isdir(caminho):
+            arquivos = [os.path.join(caminho, nome) for nome in sorted(os.listdir(caminho))]
+        else:
+            arquivos = [caminho]
+        for arquivo in arquivos:
+            tipo = identificar_tipo(arquivo)
+            if tipo:
+                por_tipo[tipo].append(arquivo)
+            else:
+                print(f"⚠️ Arquivo ignorado (tipo desconhecido): {arquivo}")
+    return [(tipo, arquivo) for tipo in ORDEM_TIPOS for arquivo in por_tipo[tipo]]
+
+def ler_linhas(caminho):
+    """Gera as linhas (listas de campos) de um CSV do dump, compactado ou não"""
+    if zipfile.is_zipfile(caminho):
+        with zipfile.ZipFile(caminho) as arquivo_zip:
+            for membro in arquivo_zip.namelist():
+                with arquivo_zip.open(membro) as bruto:
+                    texto = io.TextIOWrapper(bruto, encoding='latin-1', newline='')
+                    yield from csv.reader(texto, delimiter=';', quotechar='"')
+    else:
+        with open(caminho, encoding='latin-1', newline='') as texto:
+            yield from csv.reader(texto, delimiter=';', quotechar='"')
+
+def formatar_data(valor):
+    """Converte AAAAMMDD para AAAA-MM-DD (mesmo formato da BrasilAPI)"""
+    valor = (valor or '').strip()
+    if len(valor) == 8 and valor.isdigit() and valor != '00000000':
+        return f"{valor[:4]}-{valor[4:6]}-{valor[6:]}"
+    return ''
+
+def converter_empresa(campos):
+    return (campos[0], campos[1].strip())
+
+def converter_estabelecimento(campos):
+    ddd, telefone = campos[21].strip(), campos[22].strip()
+    return (
+        campos[0] + campos[1] + campos[2],
+        campos[0],
+        campos[4].strip(),
+        campos[5].strip(),
+        formatar_data(campos[10]),
+        campos[11].strip(),
+        campos[13].strip(),
+        campos[14].strip(),
+        campos[15].strip(),
+        campos[16].strip(),
+        campos[17].strip(),
+        campos[18].strip(),
+        campos[19].strip(),
+        campos[20].strip(),
+        f"({ddd}) {telefone}" if ddd and telefone else telefone,
+        campos[27].strip().lower(),
+    )
+
+def converter_codigo_descricao(campos):
+    return (campos[0].strip(), campos[1].strip())
+
+IMPORTADORES = {
+    'empresas': (
+        'INSERT OR REPLACE INTO rf_empresas VALUES (?, ?)',
+        converter_empresa, 2
+    ),
+    'estabelecimentos': (
+        'INSERT OR REPLACE INTO rf_estabelecimentos VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        converter_estabelecimento, 28
+    ),
+    'municipios': (
+        'INSERT OR REPLACE INTO rf_municipios VALUES (?, ?)',
+        converter_codigo_descricao, 2
+    ),
+    'cnaes': (
+        'INSERT OR REPLACE INTO rf_cnaes VALUES (?, ?)',
+        converter_codigo_descricao, 2
+    ),
+}
+
+def importar_arquivo(conn, tipo, caminho):
+    """Importa um arquivo em lotes de TAMANHO_LOTE linhas"""
+    sql, converter, minimo_campos = IMPORTADORES[tipo]
+    print(f"📥 Importando {tipo}: {caminho}")
+    inicio = time.time()
+    lote = []
+    total = 0
+    ignoradas = 0
+
+    for campos in ler_linhas(caminho):
+        if len(campos) < minimo_campos:
+            ignoradas += 1
+            continue
+        lote.append(converter(campos))
+        if len(lote) >= TAMANHO_LOTE:
+            conn.executemany(sql, lote)
+            conn.commit()
+            total += len(lote)
+            lote = []
+            if total % (TAMANHO_LOTE * 100) == 0:
+                print(f"   {total:,} linhas ({total / (time.time() - inicio):,.0f}/s)")
+
+    if lote:
+        conn.executemany(sql, lote)
+        conn.commit()
+        total += len(lote)
+
+    print(f"✅ {total:,} linhas importadas em {time.time() - inicio:.1f}s" + (f" ({ignoradas} ignoradas)" if ignoradas else ''))
+    return total
+
+def importar(caminhos, destino):
+    """Gera a base em um arquivo temporário e substitui o destino ao final,
+    para que a aplicação nunca leia uma base pela metade"""
+    arquivos = listar_arquivos(caminhos)
+    if not arquivos:
+        print("❌ Nenhum arquivo do dump encontrado")
+        return False
+
+    temporario = destino + '.importando'
+    if os.path.exists(temporario):
+        os.remove(temporario)
+
+    conn = sqlite3.connect(temporario)
+    # Importação em lote: sem journal e com cache de páginas limitado (64 MB)
+    conn.execute('PRAGMA journal_mode=OFF')
+    conn.execute('PRAGMA synchronous=OFF')
+    conn.execute('PRAGMA cache_size=-65536')
+    conn.executescript(ESQUEMA)
+
+    try:
+        for tipo, arquivo in arquivos:
+            importar_arquivo(conn, tipo, arquivo)
+        print("🧹 Otimizando base...")
+        conn.execute('ANALYZE')
+        conn.commit()
+    finally:
+        conn.close()
+
+    os.replace(temporario, destino)
+    print(f"🎉 Base local de CNPJ pronta: {destino}")
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description='Importa o dump de CNPJ da Receita Federal para SQLite')
+    parser.add_argument('arquivos', nargs='+', help='Arquivos .zip/CSV do dump ou pastas que os contenham')
+    parser.add_argument('--destino', default=os.environ.get('CNPJ_OFFLINE_DB_PATH', 'base_cnpj_receita.sqlite3'),
+                        help='Arquivo SQLite de saída (padrão: CNPJ_OFFLINE_DB_PATH ou base_cnpj_receita.sqlite3)')
+    args = parser.parse_args()
+
+    if not importar(args.arquivos, args.destino):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,58 @@
 
 import sys
 import os
-from flask import Flask, render_template, request, jsonify, send_file, url_for, redirect, session, flash
+from flask import Flask, render_template, request, jsonify, send_file, url_for, redirect, session, flash, Response, stream_with_context
 import json
 import re
 from datetime import datetime
 import io
 import base64
 import requests
-from urllib.parse import unquote
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+import random
+import socket
+import sqlite3
+import asyncio
+import weakref
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from urllib.parse import unquote, urlparse
+
+from provedores_cnpj import PROVEDORES_DISPONIVEIS, DadosEmpresa, Endereco, registrar_provedor, provedores_registrados
+from analise_questionario import MotorAnalise, carregar_regras
+from sessao_servidor import criar_interface_sessao, rotacionar_id_sessao
+
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    # Sem httpx a rota assíncrona delega a consulta síncrona para uma thread
+    HTTPX_AVAILABLE = False
+
+try:
+    import asgiref  # noqa: F401 - exigido pelo Flask para views async (flask[async])
+    ASYNC_VIEWS_AVAILABLE = True
+except ImportError:
+    ASYNC_VIEWS_AVAILABLE = False
+
+try:
+    # Validação de CNPJs em lote com NumPy (opcional)
+    from validacao_cnpj import validar_cnpjs_em_lote
+    BULK_VALIDATION_AVAILABLE = True
+except ImportError:
+    BULK_VALIDATION_AVAILABLE = False
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: sem travas de arquivo, a coalescência fica restrita ao processo
+    fcntl = None
 
 # Importações condicionais para evitar erros na Vercel
 try:
@@ -89,6 +133,19 @@ app.config['SESSION_COOKIE_SECURE'] = config('SESSION_COOKIE_SECURE', default=is
 app.config['SESSION_COOKIE_HTTPONLY'] = config('SESSION_COOKIE_HTTPONLY', default=True, cast=bool)
 app.config['SESSION_COOKIE_SAMESITE'] = config('SESSION_COOKIE_SAMESITE', default='Lax')
 
+# Sessão no servidor: o cookie leva só um ID opaco e os dados ficam em
+# memoria, sqlite (workers do mesmo servidor) ou redis. 'cookie' mantém a
+# sessão assinada padrão do Flask (necessária na Vercel sem Redis).
+SESSION_BACKEND = config('SESSION_BACKEND', default='cookie')
+SESSION_SQLITE_PATH = config('SESSION_SQLITE_PATH', default=os.path.join(tempfile.gettempdir(), 'programaequilibrio_sessoes.sqlite3'))
+SESSION_REDIS_URL = config('SESSION_REDIS_URL', default='redis://localhost:6379/0')
+if SESSION_BACKEND != 'cookie':
+    try:
+        app.session_interface = criar_interface_sessao(SESSION_BACKEND, SESSION_SQLITE_PATH, SESSION_REDIS_URL)
+        print(f"🍪 [SESSAO] Sessões no servidor ({SESSION_BACKEND})")
+    except Exception as e:
+        print(f"⚠️ [SESSAO] Não foi possível usar SESSION_BACKEND={SESSION_BACKEND} ({e}) - usando cookie assinado")
+
 # Configuração simples que funciona na Vercel
 app.static_folder = 'static'
 app.template_folder = 'templates'
@@ -118,12 +175,121 @@ except Exception as e:
 # Validador de CNPJ
 cnpj_validator = CNPJ()
 
-# APIs externas
-RECEITAWS_API_URL = config('RECEITAWS_API_URL', default='https://www.receitaws.com.br/v1/cnpj/')
-RECEITAWS_TIMEOUT = config('RECEITAWS_TIMEOUT', default=15, cast=int)
+# APIs externas. Provedores de CNPJ ativos (ver provedores_cnpj.py), na ordem
+# de preferência inicial; cada um lê <NOME>_API_URL, <NOME>_TIMEOUT,
+# <NOME>_RATE_LIMIT_PER_MINUTE e <NOME>_RATE_LIMIT_BURST
+CNPJ_PROVIDERS = [nome.strip() for nome in config('CNPJ_PROVIDERS', default='BrasilAPI,ReceitaWS').split(',') if nome.strip()]
 VIACEP_API_URL = config('VIACEP_API_URL', default='https://viacep.com.br/ws/')
 VIACEP_TIMEOUT = config('VIACEP_TIMEOUT', default=10, cast=int)
 
+# Enriquecimento do endereço das empresas pelo CEP (ViaCEP), feito em segundo
+# plano depois de salvar o diagnóstico. Cada CEP fica em cache (padrão: 30 dias).
+CEP_ENRICHMENT_ENABLED = config('CEP_ENRICHMENT_ENABLED', default=True, cast=bool)
+CEP_CACHE_TTL = config('CEP_CACHE_TTL', default=2592000, cast=int)
+CEP_CACHE_MAX_ENTRIES = config('CEP_CACHE_MAX_ENTRIES', default=20000, cast=int)
+
+# Prazo total (segundos) de uma consulta de CNPJ, somando todos os provedores
+# e retries. Deve ficar abaixo do proxy_read_timeout do nginx (30s).
+CNPJ_LOOKUP_DEADLINE = config('CNPJ_LOOKUP_DEADLINE', default=20, cast=float)
+
+# Pool de conexões HTTP (keep-alive) e política de retry para as APIs externas
+HTTP_POOL_CONNECTIONS = config('HTTP_POOL_CONNECTIONS', default=4, cast=int)
+HTTP_POOL_MAXSIZE = config('HTTP_POOL_MAXSIZE', default=16, cast=int)
+HTTP_RETRY_TOTAL = config('HTTP_RETRY_TOTAL', default=2, cast=int)
+HTTP_RETRY_BACKOFF = config('HTTP_RETRY_BACKOFF', default=0.5, cast=float)
+
+# Ordenação adaptativa dos provedores de CNPJ e circuit breaker por provedor
+CNPJ_BREAKER_FAILURES = config('CNPJ_BREAKER_FAILURES', default=3, cast=int)
+CNPJ_BREAKER_COOLDOWN = config('CNPJ_BREAKER_COOLDOWN', default=60, cast=int)
+CNPJ_PROVIDER_WINDOW = config('CNPJ_PROVIDER_WINDOW', default=50, cast=int)
+CNPJ_PROVIDER_WINDOW_SECONDS = config('CNPJ_PROVIDER_WINDOW_SECONDS', default=300, cast=int)
+
+# Limite de requisições por provedor (token bucket compartilhado entre threads
+# e workers via SQLite). Taxa 0 desativa o limite do provedor.
+CNPJ_RATE_LIMIT_ENABLED = config('CNPJ_RATE_LIMIT_ENABLED', default=True, cast=bool)
+CNPJ_RATE_LIMIT_PATH = config('CNPJ_RATE_LIMIT_PATH', default=os.path.join(tempfile.gettempdir(), 'programaequilibrio_rate_limit.sqlite3'))
+CNPJ_RATE_LIMIT_MAX_WAIT = config('CNPJ_RATE_LIMIT_MAX_WAIT', default=2.0, cast=float)
+
+# Base local gerada a partir dos dados abertos da Receita Federal
+# (ver importar_cnpj_receita.py). Vazio = desativada.
+CNPJ_OFFLINE_DB_PATH = config('CNPJ_OFFLINE_DB_PATH', default='')
+
+# Cache persistente das consultas de CNPJ (SQLite, sobrevive a reinícios)
+CNPJ_CACHE_ENABLED = config('CNPJ_CACHE_ENABLED', default=True, cast=bool)
+CNPJ_CACHE_PATH = config('CNPJ_CACHE_PATH', default=os.path.join(tempfile.gettempdir(), 'programaequilibrio_cnpj_cache.sqlite3'))
+CNPJ_CACHE_TTL = config('CNPJ_CACHE_TTL', default=86400, cast=int)
+# Stale-while-revalidate: entre o TTL "soft" e o CNPJ_CACHE_TTL (hard) o
+# registro é servido na hora e atualizado em segundo plano. 0 = desativado.
+CNPJ_CACHE_SOFT_TTL = config('CNPJ_CACHE_SOFT_TTL', default=21600, cast=int)
+CNPJ_CACHE_MAX_ENTRIES = config('CNPJ_CACHE_MAX_ENTRIES', default=5000, cast=int)
+
+# Cache negativo (CNPJ não encontrado ou empresa inativa), separado e mais curto
+CNPJ_NEGATIVE_CACHE_ENABLED = config('CNPJ_NEGATIVE_CACHE_ENABLED', default=True, cast=bool)
+CNPJ_NEGATIVE_CACHE_TTL = config('CNPJ_NEGATIVE_CACHE_TTL', default=900, cast=int)
+CNPJ_NEGATIVE_CACHE_MAX_ENTRIES = config('CNPJ_NEGATIVE_CACHE_MAX_ENTRIES', default=5000, cast=int)
+
+# Coalescência de consultas simultâneas do mesmo CNPJ ("single-flight").
+# Dentro do processo é sempre ativa; entre workers usa travas de arquivo e
+# o cache persistente para compartilhar o resultado.
+CNPJ_SINGLEFLIGHT_CROSS_PROCESS = config('CNPJ_SINGLEFLIGHT_CROSS_PROCESS', default=False, cast=bool)
+CNPJ_SINGLEFLIGHT_LOCK_DIR = config('CNPJ_SINGLEFLIGHT_LOCK_DIR', default=os.path.join(tempfile.gettempdir(), 'programaequilibrio_cnpj_locks'))
+# Número fixo de arquivos de trava: cada CNPJ cai em um deles pelo hash (CNPJs
+# do mesmo arquivo só esperam um pelo outro por alguns instantes)
+CNPJ_SINGLEFLIGHT_LOCK_FILES = config('CNPJ_SINGLEFLIGHT_LOCK_FILES', default=256, cast=int)
+
+# Gravação "write-behind" dos questionários: a resposta volta assim que o envio
+# é registrado no journal local (SQLite), e uma thread grava no Supabase em lotes.
+# Use um caminho em disco persistente; em ambiente serverless mantenha desativado.
+QUESTIONARIO_WRITE_BEHIND = config('QUESTIONARIO_WRITE_BEHIND', default=False, cast=bool)
+QUESTIONARIO_JOURNAL_PATH = config('QUESTIONARIO_JOURNAL_PATH', default=os.path.join(tempfile.gettempdir(), 'programaequilibrio_questionarios.sqlite3'))
+QUESTIONARIO_JOURNAL_BATCH = config('QUESTIONARIO_JOURNAL_BATCH', default=20, cast=int)
+QUESTIONARIO_JOURNAL_INTERVAL = config('QUESTIONARIO_JOURNAL_INTERVAL', default=2.0, cast=float)
+QUESTIONARIO_JOURNAL_MAX_ATTEMPTS = config('QUESTIONARIO_JOURNAL_MAX_ATTEMPTS', default=20, cast=int)
+
+# Idempotência do envio do questionário: reenvios com o mesmo cabeçalho
+# Idempotency-Key dentro do TTL devolvem o diagnóstico já gravado
+QUESTIONARIO_IDEMPOTENCY_TTL = config('QUESTIONARIO_IDEMPOTENCY_TTL', default=86400, cast=int)
+QUESTIONARIO_IDEMPOTENCY_MAX_ENTRIES = config('QUESTIONARIO_IDEMPOTENCY_MAX_ENTRIES', default=10000, cast=int)
+
+# Resultados dos diagnósticos para /resultado e /gerar_pdf, por diagnostico_id:
+# LRU em memória e, com RESULT_STORE_SHARED, tabela no SQLite do cache de CNPJ
+# (compartilhada entre os workers do mesmo servidor)
+RESULT_STORE_MAX_ENTRIES = config('RESULT_STORE_MAX_ENTRIES', default=1000, cast=int)
+RESULT_STORE_TTL = config('RESULT_STORE_TTL', default=86400, cast=int)
+RESULT_STORE_SHARED = config('RESULT_STORE_SHARED', default=True, cast=bool)
+# Páginas de resultado renderizadas ficam em cache (com ETag); a cada
+# RESULT_PAGE_REVALIDATE segundos confere no banco o hash do conteúdo exibido
+# (empresa, respostas, análise e status), que não muda com o pdf_url
+RESULT_PAGE_REVALIDATE = config('RESULT_PAGE_REVALIDATE', default=300, cast=int)
+
+# Cache dos relatórios PDF, endereçado pelo hash dos dados do relatório.
+# PDF_STORAGE_BUCKET: bucket do Supabase Storage que recebe uma cópia de cada
+# PDF (a URL pública vai para diagnosticos.pdf_url); vazio = só disco local.
+PDF_CACHE_ENABLED = config('PDF_CACHE_ENABLED', default=True, cast=bool)
+PDF_CACHE_DIR = config('PDF_CACHE_DIR', default=os.path.join(tempfile.gettempdir(), 'programaequilibrio_pdfs'))
+# Limites da pasta: acima de PDF_CACHE_MAX_MB saem os PDFs usados há mais tempo;
+# PDFs sem uso há PDF_CACHE_TTL segundos também saem (são gerados de novo)
+PDF_CACHE_MAX_MB = config('PDF_CACHE_MAX_MB', default=500, cast=int)
+PDF_CACHE_TTL = config('PDF_CACHE_TTL', default=2592000, cast=int)
+PDF_STORAGE_BUCKET = config('PDF_STORAGE_BUCKET', default='')
+
+# Regras da análise do questionário (JSON no formato de analise_questionario.REGRAS_PADRAO)
+# Vazio = regras padrão embutidas
+QUESTIONARIO_SCORING_RULES = config('QUESTIONARIO_SCORING_RULES', default='')
+
+# Validação de CNPJs em lote (/admin/validar_cnpjs_lote)
+CNPJ_BATCH_CONCURRENCY = config('CNPJ_BATCH_CONCURRENCY', default=8, cast=int)
+CNPJ_BATCH_MAX_ITEMS = config('CNPJ_BATCH_MAX_ITEMS', default=1000, cast=int)
+
+# Consulta "hedged": o provedor seguinte é disparado se o anterior não responder
+# dentro de CNPJ_HEDGE_DELAY segundos (0 = todos ao mesmo tempo). O primeiro
+# provedor roda na própria requisição; CNPJ_HEDGE_MAX_WORKERS limita as
+# consultas extras simultâneas do processo - com todas ocupadas, a consulta
+# segue sem disputa, um provedor após o outro
+CNPJ_HEDGE_ENABLED = config('CNPJ_HEDGE_ENABLED', default=False, cast=bool)
+CNPJ_HEDGE_DELAY = config('CNPJ_HEDGE_DELAY', default=2.0, cast=float)
+CNPJ_HEDGE_MAX_WORKERS = config('CNPJ_HEDGE_MAX_WORKERS', default=8, cast=int)
+
 # Configurações de administração
 ADMIN_EMAIL = config('ADMIN_EMAIL', default='admin@conecta.com')
 ADMIN_PASSWORD = config('ADMIN_PASSWORD', default='admin123')
@@ -149,167 +315,1451 @@ def validar_cnpj(cnpj):
     
     return cnpj_validator.validate(cnpj_limpo)
 
-def consultar_cnpj_receita_ws(cnpj):
-    """Consulta dados da empresa na ReceitaWS"""
+def limpar_cnpj(cnpj):
+    """Remove a formatação do CNPJ, mantendo apenas os 14 dígitos"""
+    return re.sub(r'[^\d]', '', cnpj or '')
+
+class CacheCNPJ:
+    """Cache persistente de dados de empresas por CNPJ, com TTL e limite LRU.
+
+    Os registros ficam em um arquivo SQLite, compartilhado entre os workers e
+    preservado entre reinícios do processo. Qualquer erro do SQLite desativa o
+    cache apenas para aquela operação - a consulta segue para as APIs.
+    """
+
+    def __init__(self, caminho, ttl, max_entradas, tabela='empresas_cache'):
+        self.caminho = caminho
+        self.tabela = tabela
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _conexao(self):
+        if self._conn is None:
+            pasta = os.path.dirname(self.caminho)
+            if pasta:
+                os.makedirs(pasta, exist_ok=True)
+            conn = sqlite3.connect(self.caminho, timeout=5, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.tabela} (
+                    cnpj TEXT PRIMARY KEY,
+                    dados TEXT NOT NULL,
+                    criado_em REAL NOT NULL,
+                    acessado_em REAL NOT NULL
+                )
+            """)
+            conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{self.tabela}_acessado ON {self.tabela}(acessado_em)')
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def obter(self, cnpj):
+        """Retorna os dados em cache do CNPJ ou None se ausente/expirado"""
+        dados, _ = self.obter_com_idade(cnpj)
+        return dados
+
+    def obter_com_idade(self, cnpj):
+        """Retorna (dados, idade em segundos) ou (None, None) se ausente/expirado"""
+        agora = time.time()
+        try:
+            with self._lock:
+                conn = self._conexao()
+                row = conn.execute(
+                    f'SELECT dados, criado_em FROM {self.tabela} WHERE cnpj = ?', (cnpj,)
+                ).fetchone()
+                if not row:
+                    return None, None
+                dados, criado_em = row
+                if agora - criado_em > self.ttl:
+                    conn.execute(f'DELETE FROM {self.tabela} WHERE cnpj = ?', (cnpj,))
+                    conn.commit()
+                    return None, None
+                conn.execute(f'UPDATE {self.tabela} SET acessado_em = ? WHERE cnpj = ?', (agora, cnpj))
+                conn.commit()
+            return json.loads(dados), agora - criado_em
+        except (sqlite3.Error, ValueError) as e:
+            print(f"⚠️ [CACHE] Erro ao ler cache do CNPJ {cnpj}: {e}")
+            return None, None
+
+    def salvar(self, cnpj, dados):
+        """Grava os dados do CNPJ e descarta as entradas menos usadas além do limite"""
+        agora = time.time()
+        try:
+            with self._lock:
+                conn = self._conexao()
+                conn.execute(
+                    f'INSERT OR REPLACE INTO {self.tabela} (cnpj, dados, criado_em, acessado_em) VALUES (?, ?, ?, ?)',
+                    (cnpj, json.dumps(dados, ensure_ascii=False), agora, agora)
+                )
+                conn.execute(f"""
+                    DELETE FROM {self.tabela} WHERE cnpj IN (
+                        SELECT cnpj FROM {self.tabela} ORDER BY acessado_em DESC LIMIT -1 OFFSET ?
+                    )
+                """, (self.max_entradas,))
+                conn.commit()
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            print(f"⚠️ [CACHE] Erro ao gravar cache do CNPJ {cnpj}: {e}")
+
+    def remover(self, cnpj):
+        """Remove o CNPJ do cache"""
+        try:
+            with self._lock:
+                conn = self._conexao()
+                conn.execute(f'DELETE FROM {self.tabela} WHERE cnpj = ?', (cnpj,))
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"⚠️ [CACHE] Erro ao remover CNPJ {cnpj} do cache: {e}")
+
+cache_cnpj = CacheCNPJ(CNPJ_CACHE_PATH, CNPJ_CACHE_TTL, CNPJ_CACHE_MAX_ENTRIES)
+
+# Cache negativo: CNPJs não encontrados ou de empresas inativas, com TTL curto
+cache_cnpj_negativo = CacheCNPJ(CNPJ_CACHE_PATH, CNPJ_NEGATIVE_CACHE_TTL, CNPJ_NEGATIVE_CACHE_MAX_ENTRIES, tabela='empresas_cache_negativo')
+
+SITUACOES_CADASTRAIS_RF = {
+    1: 'NULA',
+    2: 'ATIVA',
+    3: 'SUSPENSA',
+    4: 'INAPTA',
+    8: 'BAIXADA',
+}
+
+_base_receita_local = threading.local()
+
+def _conexao_base_receita_local():
+    """Conexão somente leitura (uma por thread) com a base local da Receita.
+    Reabre automaticamente quando o arquivo é substituído por uma nova importação."""
     try:
-        # Remove formatação do CNPJ
-        cnpj_limpo = re.sub(r'[^\d]', '', cnpj)
-        print(f"🔍 [ReceitaWS] Consultando CNPJ: {cnpj_limpo}")
-        
-        # Faz a requisição para a API usando timeout configurado
-        response = requests.get(f"{RECEITAWS_API_URL}{cnpj_limpo}", timeout=RECEITAWS_TIMEOUT)
-        print(f"📡 [ReceitaWS] Status HTTP: {response.status_code}")
-        
-        if response.status_code == 200:
-            data = response.json()
-            print(f"📋 [ReceitaWS] Dados brutos recebidos:")
-            print(f"   Status API: {data.get('status', 'N/A')}")
-            print(f"   Nome: {data.get('nome', 'N/A')}")
-            print(f"   Fantasia: {data.get('fantasia', 'N/A')}")
-            print(f"   Situação: {data.get('situacao', 'N/A')}")
-            print(f"   Município: {data.get('municipio', 'N/A')}")
-            print(f"   UF: {data.get('uf', 'N/A')}")
-            
-            # Verifica se houve erro na consulta
-            if data.get('status') == 'ERROR':
-                print(f"❌ [ReceitaWS] API retornou erro: {data.get('message', 'Erro não especificado')}")
-                return None
-            
-            resultado = {
-                'razao_social': data.get('nome', ''),
-                'nome_fantasia': data.get('fantasia', ''),
-                'cnpj': cnpj_limpo,
-                'situacao': data.get('situacao', ''),
-                'atividade_principal': data.get('atividade_principal', [{}])[0].get('text', '') if data.get('atividade_principal') else '',
-                'endereco': {
-                    'logradouro': data.get('logradouro', ''),
-                    'numero': data.get('numero', ''),
-                    'complemento': data.get('complemento', ''),
-                    'bairro': data.get('bairro', ''),
-                    'municipio': data.get('municipio', ''),
-                    'uf': data.get('uf', ''),
-                    'cep': data.get('cep', '')
-                },
-                'telefone': data.get('telefone', ''),
-                'email': data.get('email', ''),
-                'data_abertura': data.get('abertura', '')
-            }
-            
-            print(f"✅ [ReceitaWS] Dados processados:")
-            print(f"   Razão Social: '{resultado.get('razao_social')}'")
-            print(f"   Situação: '{resultado.get('situacao')}'")
-            print(f"   Tem razão social: {bool(resultado.get('razao_social'))}")
-            
-            return resultado
-        else:
-            print(f"❌ [ReceitaWS] Erro HTTP {response.status_code}: {response.text[:200]}")
+        modificado_em = os.stat(CNPJ_OFFLINE_DB_PATH).st_mtime
+    except OSError:
+        return None
+    
+    if getattr(_base_receita_local, 'modificado_em', None) != modificado_em:
+        conn_antiga = getattr(_base_receita_local, 'conn', None)
+        if conn_antiga is not None:
+            conn_antiga.close()
+        _base_receita_local.conn = sqlite3.connect(f'file:{CNPJ_OFFLINE_DB_PATH}?mode=ro', uri=True)
+        _base_receita_local.modificado_em = modificado_em
+    return _base_receita_local.conn
+
+def consultar_base_receita_local(cnpj):
+    """Consulta CNPJ na base local importada do dump da Receita Federal
+    
+    Retorna o mesmo formato dos provedores (DadosEmpresa.para_dict()), ou
+    None se a base não estiver configurada ou não tiver o CNPJ.
+    """
+    if not CNPJ_OFFLINE_DB_PATH:
+        return None
+    
+    cnpj_limpo = limpar_cnpj(cnpj)
+    try:
+        conn = _conexao_base_receita_local()
+        if conn is None:
             return None
-            
-    except requests.exceptions.RequestException as e:
-        print(f"❌ [ReceitaWS] Erro de requisição: {e}")
+        row = conn.execute("""
+            SELECT emp.razao_social, est.nome_fantasia, est.situacao, cn.descricao,
+                   est.tipo_logradouro, est.logradouro, est.numero, est.complemento,
+                   est.bairro, mun.nome, est.uf, est.cep, est.telefone, est.email, est.data_inicio
+            FROM rf_estabelecimentos est
+            LEFT JOIN rf_empresas emp ON emp.cnpj_basico = est.cnpj_basico
+            LEFT JOIN rf_municipios mun ON mun.codigo = est.municipio
+            LEFT JOIN rf_cnaes cn ON cn.codigo = est.cnae_principal
+            WHERE est.cnpj = ?
+        """, (cnpj_limpo,)).fetchone()
+    except sqlite3.Error as e:
+        print(f"⚠️ [BASE LOCAL] Erro ao consultar CNPJ {cnpj_limpo}: {e}")
         return None
-    except Exception:
+    
+    if not row or not row[0]:
         return None
+    
+    (razao_social, nome_fantasia, situacao, atividade, tipo_logradouro, logradouro,
+     numero, complemento, bairro, municipio, uf, cep, telefone, email, data_inicio) = row
+    try:
+        situacao = SITUACOES_CADASTRAIS_RF.get(int(situacao), situacao)
+    except (TypeError, ValueError):
+        pass
+    
+    return DadosEmpresa(
+        razao_social=razao_social,
+        nome_fantasia=nome_fantasia or '',
+        cnpj=cnpj_limpo,
+        situacao=situacao or '',
+        atividade_principal=atividade or '',
+        endereco=Endereco(
+            logradouro=' '.join(parte for parte in (tipo_logradouro, logradouro) if parte),
+            numero=numero or '',
+            complemento=complemento or '',
+            bairro=bairro or '',
+            municipio=municipio or '',
+            uf=uf or '',
+            cep=cep or ''
+        ),
+        telefone=telefone or '',
+        email=email or '',
+        data_abertura=data_inicio or ''
+    ).para_dict()
+
+_sessoes_http = {}
+_sessoes_http_lock = threading.Lock()
+
+# Conexão HTTP em uso -> thread que a pegou do pool (ver TentativaProvedor.cancelar)
+_conexoes_em_uso = weakref.WeakKeyDictionary()
+_conexoes_em_uso_lock = threading.Lock()
+
+class _RastreioConexoes:
+    """Anota a thread que está usando cada conexão do pool, para que a
+    consulta perdedora de uma disputa tenha a conexão derrubada de outra thread"""
 
-def consultar_brasilapi(cnpj):
-    """Consulta CNPJ na BrasilAPI com tratamento adequado"""
+    def _get_conn(self, timeout=None):
+        conexao = super()._get_conn(timeout)
+        with _conexoes_em_uso_lock:
+            _conexoes_em_uso[conexao] = threading.get_ident()
+        return conexao
+
+    def _put_conn(self, conexao):
+        if conexao is not None:
+            with _conexoes_em_uso_lock:
+                _conexoes_em_uso.pop(conexao, None)
+        super()._put_conn(conexao)
+
+class _PoolHTTPRastreado(_RastreioConexoes, HTTPConnectionPool):
+    pass
+
+class _PoolHTTPSRastreado(_RastreioConexoes, HTTPSConnectionPool):
+    pass
+
+def _derrubar_conexoes_da_thread(thread):
+    """Fecha o socket das conexões em uso pela thread; a leitura bloqueada nela
+    termina na hora com erro de conexão"""
+    with _conexoes_em_uso_lock:
+        conexoes = [conexao for conexao, dona in _conexoes_em_uso.items() if dona == thread]
+    for conexao in conexoes:
+        sock = getattr(conexao, 'sock', None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+def obter_sessao_http(url):
+    """Retorna a sessão HTTP compartilhada do host da URL
+    
+    Cada host (BrasilAPI, ReceitaWS, ViaCEP...) tem sua própria sessão com pool
+    de conexões keep-alive. O retry fica em requisitar_com_prazo, que conhece
+    o tempo restante da consulta.
+    """
+    host = urlparse(url).netloc
+    with _sessoes_http_lock:
+        sessao = _sessoes_http.get(host)
+        if sessao is None:
+            adapter = HTTPAdapter(
+                pool_connections=HTTP_POOL_CONNECTIONS,
+                pool_maxsize=HTTP_POOL_MAXSIZE,
+                max_retries=0
+            )
+            adapter.poolmanager.pool_classes_by_scheme = {'http': _PoolHTTPRastreado, 'https': _PoolHTTPSRastreado}
+            sessao = requests.Session()
+            sessao.mount('https://', adapter)
+            sessao.mount('http://', adapter)
+            _sessoes_http[host] = sessao
+            print(f"🔌 [HTTP] Sessão com pool criada para {host}")
+        return sessao
+
+def tempo_restante(prazo):
+    """Segundos até o prazo (instante de time.monotonic()); None = sem prazo"""
+    if prazo is None:
+        return None
+    return max(0.0, prazo - time.monotonic())
+
+class ConsultaCancelada(requests.exceptions.RequestException):
+    """A consulta perdeu a disputa entre provedores e foi interrompida"""
+
+# 429 fica de fora: a cota acabou, e repetir a chamada só gastaria outro 429.
+# A resposta volta na hora, registrar_saude_provedor esgota o balde do
+# limitador e a consulta segue para o próximo provedor.
+STATUS_RETRY = (500, 502, 503, 504)
+
+def _espera_backoff(tentativa):
+    """Backoff exponencial com jitter total antes da tentativa seguinte"""
+    return random.uniform(0, HTTP_RETRY_BACKOFF * (2 ** tentativa))
+
+def _espera_retry_after(headers):
+    retry_after = headers.get('Retry-After', '')
+    return float(retry_after) if retry_after.isdigit() else 0.0
+
+def requisitar_com_prazo(provedor, url, timeout, prazo=None, sessao=None, **kwargs):
+    """GET com retry para erros de conexão e respostas 5xx, limitado ao prazo
+    
+    Cada tentativa recebe no máximo o tempo que resta até `prazo`, e entre as
+    tentativas há backoff exponencial com jitter (HTTP_RETRY_BACKOFF * 2^n,
+    sorteado entre 0 e esse valor). Um Retry-After do provedor é respeitado
+    se couber no prazo. A saúde do provedor é registrada uma vez por chamada,
+    com o resultado final depois dos retries.
+    
+    `sessao` substitui a sessão do host (ex.: TentativaProvedor, na disputa);
+    uma consulta cancelada não conta como falha do provedor.
+    """
+    restante = tempo_restante(prazo)
+    if restante is not None and restante <= 0:
+        raise requests.exceptions.Timeout(f"Prazo da consulta esgotado antes de chamar {provedor}")
+    
+    inicio = time.time()
     try:
-        # Remove caracteres especiais do CNPJ
-        cnpj_limpo = ''.join(filter(str.isdigit, cnpj))
+        response = _requisitar_com_retry(provedor, url, timeout, prazo, sessao, **kwargs)
+    except ConsultaCancelada:
+        raise
+    except requests.exceptions.RequestException:
+        registrar_saude_provedor(provedor, None, inicio)
+        raise
+    registrar_saude_provedor(provedor, response.status_code, inicio)
+    return response
+
+def _requisitar_com_retry(provedor, url, timeout, prazo=None, sessao=None, **kwargs):
+    sessao = sessao or obter_sessao_http(url)
+    tentativa = 0
+    response = None
+    while True:
+        restante = tempo_restante(prazo)
+        if restante is not None and restante <= 0:
+            raise requests.exceptions.Timeout(f"Prazo da consulta esgotado em {provedor}")
         
-        url = f"https://brasilapi.com.br/api/cnpj/v1/{cnpj_limpo}"
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+        try:
+            response = sessao.get(url, timeout=timeout if restante is None else min(timeout, restante), **kwargs)
+        except requests.exceptions.ConnectionError:
+            if tentativa >= HTTP_RETRY_TOTAL:
+                raise
+            response = None
+            espera_minima = 0.0
+        else:
+            if response.status_code not in STATUS_RETRY or tentativa >= HTTP_RETRY_TOTAL:
+                return response
+            espera_minima = _espera_retry_after(response.headers)
+        
+        espera = max(espera_minima, _espera_backoff(tentativa))
+        restante = tempo_restante(prazo)
+        if restante is not None and espera >= restante:
+            print(f"⏱️ [HTTP] {provedor}: sem tempo para nova tentativa (espera {espera:.1f}s, restam {restante:.1f}s)")
+            if response is not None:
+                return response
+            raise requests.exceptions.Timeout(f"Prazo da consulta esgotado em {provedor}")
+        
+        tentativa += 1
+        print(f"🔁 [HTTP] {provedor}: tentativa {tentativa + 1} em {espera:.2f}s")
+        time.sleep(espera)
+
+class SaudeProvedor:
+    """Estatísticas móveis (sucesso e latência) e circuit breaker de um provedor
+    
+    Após CNPJ_BREAKER_FAILURES consultas consecutivas com falha (erro de
+    rede, timeout, 429 ou 5xx depois de esgotados os retries de
+    requisitar_com_prazo) o provedor fica fora da fila por CNPJ_BREAKER_COOLDOWN
+    segundos. Passado esse tempo, uma única consulta de teste é liberada; se
+    ela falhar o circuito reabre, se funcionar ele fecha.
+    
+    As estatísticas consideram só as últimas `janela` chamadas feitas nos
+    últimos `janela_segundos`, para que um provedor rebaixado volte ao topo da
+    fila depois de um tempo sem ser consultado.
+    """
+
+    def __init__(self, nome, janela, janela_segundos, limite_falhas, cooldown):
+        self.nome = nome
+        self.janela_segundos = janela_segundos
+        self.limite_falhas = limite_falhas
+        self.cooldown = cooldown
+        self.historico = deque(maxlen=janela)
+        self.falhas_consecutivas = 0
+        self.aberto_ate = 0.0
+        self._lock = threading.Lock()
+
+    def registrar(self, sucesso, latencia):
+        with self._lock:
+            self.historico.append((time.time(), sucesso, latencia))
+            if sucesso:
+                if self.falhas_consecutivas >= self.limite_falhas:
+                    print(f"🔌 [BREAKER] {self.nome} fechado - provedor respondendo novamente")
+                self.falhas_consecutivas = 0
+                self.aberto_ate = 0.0
+                return
+            self.falhas_consecutivas += 1
+            if self.falhas_consecutivas >= self.limite_falhas:
+                self.aberto_ate = time.time() + self.cooldown
+                print(f"🔌 [BREAKER] {self.nome} aberto por {self.cooldown}s após {self.falhas_consecutivas} falhas consecutivas")
+
+    def permitir(self):
+        """Indica se o provedor pode ser consultado agora (não reserva nada)"""
+        with self._lock:
+            return time.time() >= self.aberto_ate
+
+    def reservar(self):
+        """Reserva a chamada que vai ser feita agora; no estado meio-aberto só
+        a primeira reserva é aceita (a consulta de teste)"""
+        with self._lock:
+            agora = time.time()
+            if agora < self.aberto_ate:
+                return False
+            if self.falhas_consecutivas >= self.limite_falhas:
+                # Meio-aberto: libera só esta consulta de teste
+                self.aberto_ate = agora + self.cooldown
+            return True
+
+    def _recentes(self):
+        limite = time.time() - self.janela_segundos
+        with self._lock:
+            return [(sucesso, latencia) for momento, sucesso, latencia in self.historico if momento >= limite]
+
+    def taxa_sucesso(self):
+        recentes = self._recentes()
+        if not recentes:
+            return 1.0
+        return sum(1 for sucesso, _ in recentes if sucesso) / len(recentes)
+
+    def latencia_media(self):
+        latencias = [latencia for sucesso, latencia in self._recentes() if sucesso]
+        return sum(latencias) / len(latencias) if latencias else 0.0
+
+    def resumo(self):
+        return {
+            'taxa_sucesso': round(self.taxa_sucesso(), 3),
+            'latencia_media': round(self.latencia_media(), 3),
+            'amostras': len(self._recentes()),
+            'falhas_consecutivas': self.falhas_consecutivas,
+            'circuito_aberto': time.time() < self.aberto_ate,
         }
+
+# Saúde e limitador de taxa de cada provedor registrado (ver registrar_provedor_cnpj)
+saude_provedores = {}
+
+def registrar_saude_provedor(nome, status_code, inicio):
+    """Registra o resultado de uma chamada HTTP (status_code None = erro de rede/timeout)"""
+    if nome not in saude_provedores:
+        return
+    sucesso = status_code is not None and status_code != 429 and status_code < 500
+    saude_provedores[nome].registrar(sucesso, time.time() - inicio)
+    if status_code == 429:
+        # O provedor já avisou que a cota acabou: zera o balde local também
+        limitadores_provedores[nome].esgotar()
+
+class LimitadorTaxa:
+    """Token bucket de um provedor, compartilhado entre threads e workers
+    
+    O estado (tokens disponíveis e momento da última recarga) fica em uma
+    tabela SQLite atualizada dentro de uma transação exclusiva, de modo que
+    todos os workers da máquina dividem a mesma cota. Se o SQLite falhar, a
+    chamada é liberada - o limitador nunca bloqueia consultas por erro próprio.
+    """
+
+    def __init__(self, nome, por_minuto, capacidade, caminho):
+        self.nome = nome
+        self.taxa = por_minuto / 60.0
+        self.capacidade = max(capacidade, 1)
+        self.caminho = caminho
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _conexao(self):
+        if self._conn is None:
+            pasta = os.path.dirname(self.caminho)
+            if pasta:
+                os.makedirs(pasta, exist_ok=True)
+            conn = sqlite3.connect(self.caminho, timeout=5, check_same_thread=False, isolation_level=None)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS limites_provedores (
+                    provedor TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    atualizado_em REAL NOT NULL
+                )
+            """)
+            self._conn = conn
+        return self._conn
+
+    def _atualizar(self, consumir=False, devolver=False):
+        """Recarrega o balde e, se `consumir`, tenta retirar um token (ou, se
+        `devolver`, repõe um). Retorna (tokens restantes, segundos até o próximo token)."""
+        agora = time.time()
+        with self._lock:
+            conn = self._conexao()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute(
+                    'SELECT tokens, atualizado_em FROM limites_provedores WHERE provedor = ?', (self.nome,)
+                ).fetchone()
+                tokens = float(self.capacidade) if row is None else row[0]
+                if row is not None:
+                    tokens = min(self.capacidade, tokens + max(0.0, agora - row[1]) * self.taxa)
+                
+                espera = 0.0
+                if devolver:
+                    tokens = min(self.capacidade, tokens + 1)
+                if consumir:
+                    if tokens >= 1:
+                        tokens -= 1
+                    else:
+                        espera = (1 - tokens) / self.taxa
+                
+                conn.execute(
+                    'INSERT OR REPLACE INTO limites_provedores (provedor, tokens, atualizado_em) VALUES (?, ?, ?)',
+                    (self.nome, tokens, agora)
+                )
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        return tokens, espera
+
+    def adquirir(self, espera_maxima=0.0):
+        """Retira um token, aguardando até `espera_maxima` segundos por ele"""
+        if not CNPJ_RATE_LIMIT_ENABLED or self.taxa <= 0:
+            return True
         
-        response = requests.get(url, headers=headers, timeout=15)
-        
-        if response.status_code == 200:
-            data = response.json()
-            
-            # Verifica se tem dados essenciais
-            if not data.get('legal_name'):
-                return None
-            
-            # Converte para formato compatível com ReceitaWS
-            return {
-                'razao_social': data.get('legal_name', ''),
-                'nome_fantasia': data.get('trade_name', ''),
-                'cnpj': cnpj_limpo,
-                'situacao': data.get('registration_status', ''),
-                'atividade_principal': '',  # BrasilAPI tem estrutura diferente
-                'endereco': {
-                    'logradouro': data.get('address', {}).get('street', ''),
-                    'numero': data.get('address', {}).get('number', ''),
-                    'complemento': data.get('address', {}).get('details', ''),
-                    'bairro': data.get('address', {}).get('district', ''),
-                    'municipio': data.get('address', {}).get('city', ''),
-                    'uf': data.get('address', {}).get('state', ''),
-                    'cep': data.get('address', {}).get('zip_code', '')
-                },
-                'telefone': data.get('phone', ''),
-                'email': data.get('email', ''),
-                'data_abertura': data.get('founded', '')
-            }
-            
+        limite = time.time() + espera_maxima
+        while True:
+            try:
+                _, espera = self._atualizar(consumir=True)
+            except sqlite3.Error as e:
+                print(f"⚠️ [RATE-LIMIT] Erro no limitador de {self.nome}: {e}")
+                return True
+            if espera == 0:
+                return True
+            if time.time() + espera > limite:
+                print(f"⏭️ [RATE-LIMIT] {self.nome} sem cota (próximo token em {espera:.1f}s)")
+                return False
+            print(f"⏳ [RATE-LIMIT] Aguardando {espera:.1f}s por cota de {self.nome}")
+            time.sleep(espera)
+
+    def devolver(self):
+        """Repõe o token de uma chamada que acabou não sendo feita"""
+        if not CNPJ_RATE_LIMIT_ENABLED or self.taxa <= 0:
+            return
+        try:
+            self._atualizar(devolver=True)
+        except sqlite3.Error as e:
+            print(f"⚠️ [RATE-LIMIT] Erro ao devolver token de {self.nome}: {e}")
+
+    def esgotar(self):
+        """Zera os tokens disponíveis (ex.: após um HTTP 429)"""
+        if not CNPJ_RATE_LIMIT_ENABLED or self.taxa <= 0:
+            return
+        try:
+            with self._lock:
+                conn = self._conexao()
+                conn.execute(
+                    'INSERT OR REPLACE INTO limites_provedores (provedor, tokens, atualizado_em) VALUES (?, 0, ?)',
+                    (self.nome, time.time())
+                )
+        except sqlite3.Error as e:
+            print(f"⚠️ [RATE-LIMIT] Erro ao esgotar cota de {self.nome}: {e}")
+
+    def estado(self):
+        """Resumo para monitoramento"""
+        resumo = {
+            'ativo': CNPJ_RATE_LIMIT_ENABLED and self.taxa > 0,
+            'por_minuto': round(self.taxa * 60, 3),
+            'capacidade': self.capacidade,
+        }
+        if resumo['ativo']:
+            try:
+                tokens, _ = self._atualizar(consumir=False)
+                resumo['tokens_disponiveis'] = round(tokens, 3)
+            except sqlite3.Error as e:
+                resumo['erro'] = str(e)
+        return resumo
+
+limitadores_provedores = {}
+
+def registrar_provedor_cnpj(provedor):
+    """Registra um provedor de CNPJ com seu circuit breaker e seu limitador de taxa"""
+    registrar_provedor(provedor)
+    saude_provedores[provedor.nome] = SaudeProvedor(
+        provedor.nome, CNPJ_PROVIDER_WINDOW, CNPJ_PROVIDER_WINDOW_SECONDS, CNPJ_BREAKER_FAILURES, CNPJ_BREAKER_COOLDOWN
+    )
+    limitadores_provedores[provedor.nome] = LimitadorTaxa(provedor.nome, provedor.por_minuto, provedor.rajada, CNPJ_RATE_LIMIT_PATH)
+    return provedor
+
+def _config_opcional(chave, cast):
+    valor = config(chave, default='')
+    return cast(valor) if valor != '' else None
+
+for _nome_provedor in CNPJ_PROVIDERS:
+    if _nome_provedor not in PROVEDORES_DISPONIVEIS:
+        print(f"⚠️ [PROVEDORES] Provedor de CNPJ desconhecido ignorado: {_nome_provedor}")
+        continue
+    _prefixo = _nome_provedor.upper()
+    registrar_provedor_cnpj(PROVEDORES_DISPONIVEIS[_nome_provedor](
+        url_base=config(f'{_prefixo}_API_URL', default='') or None,
+        timeout=config(f'{_prefixo}_TIMEOUT', default=15, cast=int),
+        por_minuto=_config_opcional(f'{_prefixo}_RATE_LIMIT_PER_MINUTE', float),
+        rajada=_config_opcional(f'{_prefixo}_RATE_LIMIT_BURST', int)
+    ))
+
+def _normalizar_viacep(data):
+    """Converte a resposta da ViaCEP para o formato de endereco; None se o CEP não existir"""
+    if not data or data.get('erro'):
+        return None
+    
+    return {
+        'logradouro': data.get('logradouro', ''),
+        'complemento': data.get('complemento', ''),
+        'bairro': data.get('bairro', ''),
+        'municipio': data.get('localidade', ''),
+        'uf': data.get('uf', ''),
+        'cep': data.get('cep', ''),
+        'codigo_ibge': data.get('ibge', '')
+    }
+
+def _interpretar_resposta_provedor(provedor, cnpj_limpo, status_code, corpo, nao_encontrado=None):
+    """Converte a resposta de um provedor (síncrona ou assíncrona) em dados_empresa
+    
+    Se o provedor afirmar, de forma definitiva, que o CNPJ não existe
+    (diferente de timeout ou erro, que não devem ir para o cache negativo),
+    seu nome é adicionado ao conjunto `nao_encontrado` da consulta.
+    """
+    print(f"📡 [{provedor.nome}] Status HTTP: {status_code}")
+    try:
+        data = json.loads(corpo) if corpo else None
+    except ValueError:
+        data = None
+    
+    dados, inexistente = provedor.interpretar(status_code, data, cnpj_limpo)
+    if inexistente and nao_encontrado is not None:
+        nao_encontrado.add(provedor.nome)
+    if dados is None:
+        if status_code != 200:
+            print(f"❌ [{provedor.nome}] Erro HTTP {status_code}: {(corpo or '')[:200]}")
+        return None
+    
+    print(f"✅ [{provedor.nome}] Razão Social: '{dados.razao_social}' - Situação: '{dados.situacao}'")
+    return dados.para_dict()
+
+def consultar_provedor_cnpj(provedor, cnpj, prazo=None, nao_encontrado=None, sessao=None):
+    """Consulta um CNPJ em um provedor registrado (ver provedores_cnpj.py)"""
+    cnpj_limpo = limpar_cnpj(cnpj)
+    print(f"🔍 [{provedor.nome}] Consultando CNPJ: {cnpj_limpo}")
+    try:
+        response = requisitar_com_prazo(provedor.nome, provedor.url(cnpj_limpo), provedor.timeout, prazo, sessao,
+                                        headers=provedor.headers)
+        return _interpretar_resposta_provedor(provedor, cnpj_limpo, response.status_code, response.text, nao_encontrado)
+    except ConsultaCancelada:
+        print(f"🛑 [{provedor.nome}] Consulta cancelada - outro provedor venceu a disputa")
+        return None
+    except requests.exceptions.RequestException as e:
+        print(f"❌ [{provedor.nome}] Erro de requisição: {e}")
         return None
-            
     except Exception as e:
-        print(f"Erro na BrasilAPI: {e}")
+        print(f"❌ [{provedor.nome}] Erro geral: {e}")
         return None
 
-def consultar_cnpj_com_fallback(cnpj):
+class ConsultasEmAndamento:
+    """Coalescência de chamadas concorrentes ("single-flight")
+    
+    A primeira thread que pede uma chave executa a função; as que chegam
+    enquanto ela está em andamento esperam e recebem o mesmo resultado.
     """
-    Consulta CNPJ usando múltiplas APIs como fallback
-    1. Tenta BrasilAPI primeiro (mais rápida e sem limite rigoroso)
-    2. Se falhar, usa ReceitaWS
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._chamadas = {}
+
+    def executar(self, chave, funcao, timeout=None):
+        """Executa `funcao` ou aguarda a execução em andamento da mesma chave.
+        Quem aguarda desiste após `timeout` segundos e recebe None."""
+        with self._lock:
+            chamada = self._chamadas.get(chave)
+            lider = chamada is None
+            if lider:
+                chamada = {'evento': threading.Event(), 'resultado': None, 'erro': None}
+                self._chamadas[chave] = chamada
+        
+        if not lider:
+            print(f"🔗 [SINGLE-FLIGHT] Aguardando consulta em andamento: {chave}")
+            if not chamada['evento'].wait(timeout):
+                print(f"⏱️ [SINGLE-FLIGHT] Prazo esgotado aguardando consulta de {chave}")
+                return None
+            if chamada['erro'] is not None:
+                raise chamada['erro']
+            return chamada['resultado']
+        
+        try:
+            chamada['resultado'] = funcao()
+            return chamada['resultado']
+        except Exception as e:
+            chamada['erro'] = e
+            raise
+        finally:
+            with self._lock:
+                self._chamadas.pop(chave, None)
+            chamada['evento'].set()
+
+consultas_cnpj_em_andamento = ConsultasEmAndamento()
+
+@contextmanager
+def _trava_entre_processos(chave, prazo=None):
+    """Trava exclusiva por chave compartilhada entre os workers (fcntl.flock).
+    Entrega False (sem a trava) se o prazo acabar antes de consegui-la.
+    
+    A chave é distribuída por hash entre CNPJ_SINGLEFLIGHT_LOCK_FILES arquivos,
+    para que a pasta não cresça com um arquivo por CNPJ consultado.
     """
-    print(f"🔍 [FALLBACK] Consultando CNPJ: {cnpj}")
+    os.makedirs(CNPJ_SINGLEFLIGHT_LOCK_DIR, exist_ok=True)
+    balde = int(hashlib.sha1(chave.encode('utf-8')).hexdigest(), 16) % max(CNPJ_SINGLEFLIGHT_LOCK_FILES, 1)
+    with open(os.path.join(CNPJ_SINGLEFLIGHT_LOCK_DIR, f'{balde:03d}.lock'), 'a') as arquivo:
+        while True:
+            try:
+                fcntl.flock(arquivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                restante = tempo_restante(prazo)
+                if restante is not None and restante <= 0:
+                    yield False
+                    return
+                time.sleep(0.05 if restante is None else min(0.05, restante))
+        try:
+            yield True
+        finally:
+            fcntl.flock(arquivo, fcntl.LOCK_UN)
+
+def consultar_cnpj_com_fallback(cnpj, prazo=None):
+    """
+    Consulta CNPJ na base local da Receita (se configurada), nos caches
+    persistentes (positivo e negativo) e, na falta deles, em múltiplas APIs
+    como fallback (ver _consultar_provedores_cnpj)
     
-    # Primeira tentativa: BrasilAPI
-    print("📡 [FALLBACK] Tentativa 1: BrasilAPI...")
-    resultado = consultar_brasilapi(cnpj)
+    Consultas simultâneas do mesmo CNPJ são coalescidas: só uma chega às APIs
+    e as demais recebem o mesmo resultado.
     
-    if resultado and resultado.get('razao_social'):
-        print(f"✅ [FALLBACK] Sucesso com BrasilAPI!")
-        print(f"   Razão Social encontrada: '{resultado.get('razao_social')}'")
-        return resultado
+    `prazo` é o instante (time.monotonic()) em que a consulta deve desistir;
+    por padrão, CNPJ_LOOKUP_DEADLINE segundos a partir de agora. Esgotado o
+    prazo, retorna None como se os dados não estivessem disponíveis.
+    """
+    cnpj_limpo = limpar_cnpj(cnpj)
+    if prazo is None:
+        prazo = time.monotonic() + CNPJ_LOOKUP_DEADLINE
+    
+    dados_locais = consultar_base_receita_local(cnpj_limpo)
+    if dados_locais:
+        print(f"⚡ [BASE LOCAL] CNPJ {cnpj_limpo} encontrado na base da Receita")
+        return dados_locais
+    
+    encontrado, dados_cache = _consultar_caches_cnpj(cnpj_limpo)
+    if encontrado:
+        return dados_cache
+    
+    return consultas_cnpj_em_andamento.executar(
+        cnpj_limpo, lambda: _consultar_e_armazenar_cnpj(cnpj, prazo), timeout=tempo_restante(prazo)
+    )
+
+def _consultar_caches_cnpj(cnpj_limpo, aceitar_vencido=True):
+    """Procura o CNPJ no cache positivo e no negativo.
+    Retorna (encontrado, dados) - dados é None para CNPJ sabidamente inexistente.
+    
+    Registros do cache positivo mais velhos que CNPJ_CACHE_SOFT_TTL são
+    devolvidos na hora e revalidados em segundo plano; com
+    aceitar_vencido=False eles contam como ausentes.
+    """
+    if CNPJ_CACHE_ENABLED:
+        dados_cache, idade = cache_cnpj.obter_com_idade(cnpj_limpo)
+        if dados_cache:
+            vencido = CNPJ_CACHE_SOFT_TTL > 0 and idade > CNPJ_CACHE_SOFT_TTL
+            if not vencido:
+                print(f"⚡ [CACHE] CNPJ {cnpj_limpo} encontrado no cache")
+                return True, dados_cache
+            if aceitar_vencido:
+                print(f"⚡ [CACHE] CNPJ {cnpj_limpo} servido do cache ({idade:.0f}s) - revalidando em segundo plano")
+                _agendar_revalidacao_cnpj(cnpj_limpo)
+                return True, dados_cache
+    
+    if CNPJ_NEGATIVE_CACHE_ENABLED:
+        negativo = cache_cnpj_negativo.obter(cnpj_limpo)
+        if negativo:
+            print(f"⚡ [CACHE NEGATIVO] CNPJ {cnpj_limpo}: {negativo.get('motivo')} {negativo.get('situacao', '')}".rstrip())
+            return True, negativo.get('dados')
+    
+    return False, None
+
+_executor_revalidacao = ThreadPoolExecutor(max_workers=2, thread_name_prefix='cnpj-revalidacao')
+
+# CNPJs com revalidação já agendada ou em andamento neste processo
+_revalidacoes_pendentes = set()
+_revalidacoes_pendentes_lock = threading.Lock()
+
+def _agendar_revalidacao_cnpj(cnpj_limpo):
+    """Agenda a revalidação do CNPJ, a menos que já exista uma pendente"""
+    with _revalidacoes_pendentes_lock:
+        if cnpj_limpo in _revalidacoes_pendentes:
+            return
+        _revalidacoes_pendentes.add(cnpj_limpo)
+    _executor_revalidacao.submit(_revalidar_cnpj, cnpj_limpo)
+
+def _revalidar_cnpj(cnpj_limpo):
+    """Atualiza em segundo plano um registro vencido do cache (stale-while-revalidate)"""
+    prazo = time.monotonic() + CNPJ_LOOKUP_DEADLINE
+    try:
+        # Outra consulta (ou outro worker) pode ter atualizado o registro desde o agendamento
+        encontrado, _ = _consultar_caches_cnpj(cnpj_limpo, aceitar_vencido=False)
+        if encontrado:
+            return
+        consultas_cnpj_em_andamento.executar(cnpj_limpo, lambda: _consultar_e_armazenar_cnpj(cnpj_limpo, prazo))
+    except Exception as e:
+        print(f"⚠️ [CACHE] Erro ao revalidar CNPJ {cnpj_limpo}: {e}")
+    finally:
+        with _revalidacoes_pendentes_lock:
+            _revalidacoes_pendentes.discard(cnpj_limpo)
+
+def _consultar_e_armazenar_cnpj(cnpj, prazo=None):
+    """Consulta as APIs externas e grava o resultado no cache"""
+    cnpj_limpo = limpar_cnpj(cnpj)
+    
+    if CNPJ_SINGLEFLIGHT_CROSS_PROCESS and CNPJ_CACHE_ENABLED and fcntl is not None:
+        with _trava_entre_processos(cnpj_limpo, prazo) as travado:
+            if not travado:
+                print(f"⏱️ [SINGLE-FLIGHT] Prazo esgotado aguardando outro worker consultar {cnpj_limpo}")
+                return None
+            # Outro worker pode ter concluído a consulta enquanto esperávamos
+            encontrado, dados_cache = _consultar_caches_cnpj(cnpj_limpo, aceitar_vencido=False)
+            if encontrado:
+                return dados_cache
+            return _consultar_e_armazenar_cnpj_sem_trava(cnpj, prazo)
+    
+    return _consultar_e_armazenar_cnpj_sem_trava(cnpj, prazo)
+
+def _consultar_e_armazenar_cnpj_sem_trava(cnpj, prazo=None):
+    cnpj_limpo = limpar_cnpj(cnpj)
+    # Provedores que afirmaram que o CNPJ não existe, só nesta consulta
+    nao_encontrado = set()
+    
+    if CNPJ_HEDGE_ENABLED:
+        resultado = _consultar_provedores_cnpj_hedge(cnpj, prazo, nao_encontrado)
     else:
-        print("⚠️ [FALLBACK] BrasilAPI não retornou dados completos")
+        resultado = _consultar_provedores_cnpj(cnpj, prazo, nao_encontrado)
+    
+    _armazenar_resultado_cnpj(cnpj_limpo, resultado, set(nao_encontrado))
+    return resultado
+
+def _armazenar_resultado_cnpj(cnpj_limpo, resultado, provedores_sem_cnpj):
+    """Grava o resultado de uma consulta às APIs no cache positivo ou negativo"""
+    if resultado:
+        situacao = (resultado.get('situacao') or '').upper()
+        if situacao and situacao != 'ATIVA':
+            if CNPJ_CACHE_ENABLED:
+                cache_cnpj.remover(cnpj_limpo)
+            if CNPJ_NEGATIVE_CACHE_ENABLED:
+                cache_cnpj_negativo.salvar(cnpj_limpo, {'motivo': 'inativa', 'situacao': situacao, 'dados': resultado})
+        elif CNPJ_CACHE_ENABLED:
+            cache_cnpj.salvar(cnpj_limpo, resultado)
+    elif provedores_sem_cnpj and CNPJ_NEGATIVE_CACHE_ENABLED:
+        # Só vai para o cache negativo quando algum provedor afirmou que o CNPJ
+        # não existe; timeouts e erros continuam sendo consultados de novo
+        print(f"🚫 [CACHE NEGATIVO] CNPJ {cnpj_limpo} não encontrado em: {', '.join(sorted(provedores_sem_cnpj))}")
+        if CNPJ_CACHE_ENABLED:
+            cache_cnpj.remover(cnpj_limpo)
+        cache_cnpj_negativo.salvar(cnpj_limpo, {'motivo': 'nao_encontrado'})
+
+def _provedores_cnpj_ordenados():
+    """
+    Provedores de CNPJ registrados, do mais para o menos confiável: maior
+    taxa de sucesso recente e, no empate, menor latência. Antes de chamar
+    cada um, confira saude_provedores[provedor.nome].permitir() e, logo
+    antes da chamada (depois do limitador de taxa), reserve-a com reservar();
+    se a reserva falhar, devolva o token com limitadores_provedores[nome].devolver().
+    """
+    return sorted(
+        provedores_registrados(),
+        key=lambda p: (-saude_provedores[p.nome].taxa_sucesso(), saude_provedores[p.nome].latencia_media())
+    )
+
+def _provedores_cnpj():
+    """Lista (nome, função de consulta) na ordem de _provedores_cnpj_ordenados"""
+    return [
+        (provedor.nome, lambda cnpj, prazo=None, nao_encontrado=None, sessao=None, provedor=provedor:
+            consultar_provedor_cnpj(provedor, cnpj, prazo, nao_encontrado, sessao))
+        for provedor in _provedores_cnpj_ordenados()
+    ]
+
+def _consultar_provedores_cnpj(cnpj, prazo=None, nao_encontrado=None):
+    """
+    Consulta CNPJ nas APIs externas, uma após a outra, na ordem adaptativa de
+    _provedores_cnpj (por padrão BrasilAPI e depois ReceitaWS), dando a cada
+    uma apenas o tempo que resta até o prazo
+    """
+    print(f"🔍 [FALLBACK] Consultando CNPJ: {cnpj}")
+    
+    for tentativa, (nome, funcao) in enumerate(_provedores_cnpj(), start=1):
+        restante = tempo_restante(prazo)
+        if restante is not None and restante <= 0:
+            print(f"⏱️ [FALLBACK] Prazo esgotado antes de {nome}")
+            break
+        if not saude_provedores[nome].permitir():
+            print(f"⏭️ [FALLBACK] {nome} ignorado - circuito aberto")
+            continue
+        espera_maxima = CNPJ_RATE_LIMIT_MAX_WAIT if restante is None else min(CNPJ_RATE_LIMIT_MAX_WAIT, restante)
+        if not limitadores_provedores[nome].adquirir(espera_maxima):
+            continue
+        if not saude_provedores[nome].reservar():
+            print(f"⏭️ [FALLBACK] {nome} ignorado - consulta de teste já em andamento")
+            limitadores_provedores[nome].devolver()
+            continue
+        
+        print(f"📡 [FALLBACK] Tentativa {tentativa}: {nome}...")
+        resultado = funcao(cnpj, prazo=prazo, nao_encontrado=nao_encontrado)
+        
+        if resultado and resultado.get('razao_social'):
+            print(f"✅ [FALLBACK] Sucesso com {nome}!")
+            print(f"   Razão Social encontrada: '{resultado.get('razao_social')}'")
+            return resultado
+        
+        print(f"⚠️ [FALLBACK] {nome} não retornou dados completos")
         if resultado:
-            print(f"   Dados BrasilAPI: razao_social='{resultado.get('razao_social')}', situacao='{resultado.get('situacao')}'")
+            print(f"   Dados {nome}: razao_social='{resultado.get('razao_social')}', situacao='{resultado.get('situacao')}'")
     
-    # Segunda tentativa: ReceitaWS
-    print("📡 [FALLBACK] Tentativa 2: ReceitaWS...")
-    resultado = consultar_cnpj_receita_ws(cnpj)
+    print("❌ [FALLBACK] Nenhuma API retornou dados válidos")
+    return None
+
+_executor_provedores = ThreadPoolExecutor(max_workers=CNPJ_HEDGE_MAX_WORKERS, thread_name_prefix='cnpj-hedge')
+# Vagas do pool de disputa; sem vaga, o provedor seguinte espera a sua vez
+_vagas_hedge = threading.BoundedSemaphore(CNPJ_HEDGE_MAX_WORKERS)
+
+class TentativaProvedor:
+    """Chamada a um provedor dentro de uma disputa, cancelável de outra thread
+    
+    Faz o papel da sessão HTTP (get) para requisitar_com_prazo: usa a sessão
+    keep-alive do host e, ao ser cancelada, derruba a conexão em uso pela
+    thread da chamada, que termina na hora com ConsultaCancelada em vez de
+    esperar o timeout (ou fazer novas tentativas).
+    """
+
+    def __init__(self, nome, funcao):
+        self.nome = nome
+        self.funcao = funcao
+        self.cancelada = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def executar(self, cnpj, prazo=None, nao_encontrado=None):
+        with self._lock:
+            self._thread = threading.get_ident()
+        try:
+            return self.funcao(cnpj, prazo=prazo, nao_encontrado=nao_encontrado, sessao=self)
+        finally:
+            with self._lock:
+                self._thread = None
+
+    def cancelar(self):
+        with self._lock:
+            self.cancelada.set()
+            if self._thread is not None:
+                _derrubar_conexoes_da_thread(self._thread)
+
+    def get(self, url, **kwargs):
+        if self.cancelada.is_set():
+            raise ConsultaCancelada(f"{self.nome}: consulta cancelada")
+        try:
+            return obter_sessao_http(url).get(url, **kwargs)
+        except requests.exceptions.RequestException:
+            if self.cancelada.is_set():
+                raise ConsultaCancelada(f"{self.nome}: consulta cancelada") from None
+            raise
+
+class DisputaProvedores:
+    """
+    Consulta CNPJ disputando as APIs externas em paralelo ("hedged request")
+    
+    O primeiro provedor roda na thread da requisição. Se ele passar de
+    CNPJ_HEDGE_DELAY segundos sem responder, o seguinte é disparado no pool
+    _executor_provedores (se houver vaga); se ele falhar, o seguinte roda
+    logo em seguida. Vence a primeira resposta com razao_social, e as
+    consultas perdedoras são canceladas (TentativaProvedor.cancelar).
+    """
+
+    def __init__(self, cnpj, prazo=None, nao_encontrado=None):
+        self.cnpj = cnpj
+        self.prazo = prazo
+        self.nao_encontrado = nao_encontrado
+        self.provedores = _provedores_cnpj()
+        self.proximo = 0
+        self.vencedor = None
+        self.tentativas = set()
+        self.em_hedge = 0
+        self._lock = threading.Lock()
+        self._hedge_concluido = threading.Condition(self._lock)
+        self._timer = None
+
+    def executar(self):
+        print(f"🔍 [HEDGE] Consultando CNPJ: {self.cnpj} (delay: {CNPJ_HEDGE_DELAY}s)")
+        try:
+            while True:
+                tentativa = self._iniciar_proxima()
+                if tentativa is not None:
+                    self._agendar_hedge()
+                    if self._executar_tentativa(tentativa):
+                        return self.vencedor
+                    continue
+                
+                # Nada mais a disparar daqui: aguarda as consultas do pool
+                with self._lock:
+                    if self.vencedor is not None or not self.em_hedge:
+                        break
+                    restante = tempo_restante(self.prazo)
+                    if restante is not None and restante <= 0:
+                        print("⏱️ [HEDGE] Prazo esgotado")
+                        break
+                    self._hedge_concluido.wait(restante)
+        finally:
+            self._encerrar()
+        
+        if self.vencedor is None:
+            print("❌ [HEDGE] Nenhuma API retornou dados válidos")
+        return self.vencedor
+
+    def _iniciar_proxima(self):
+        """Próximo provedor liberado pelo breaker e pelo limitador, ou None"""
+        with self._lock:
+            while self.vencedor is None and self.proximo < len(self.provedores):
+                nome, funcao = self.provedores[self.proximo]
+                self.proximo += 1
+                if tempo_restante(self.prazo) == 0:
+                    print(f"⏱️ [HEDGE] Prazo esgotado antes de {nome}")
+                    return None
+                if not saude_provedores[nome].permitir():
+                    print(f"⏭️ [HEDGE] {nome} ignorado - circuito aberto")
+                    continue
+                # Na disputa não vale esperar por cota: sem token, passa ao próximo
+                if not limitadores_provedores[nome].adquirir():
+                    continue
+                if not saude_provedores[nome].reservar():
+                    print(f"⏭️ [HEDGE] {nome} ignorado - consulta de teste já em andamento")
+                    limitadores_provedores[nome].devolver()
+                    continue
+                tentativa = TentativaProvedor(nome, funcao)
+                self.tentativas.add(tentativa)
+                return tentativa
+            return None
+
+    def _agendar_hedge(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = None
+            if self.vencedor is None and self.proximo < len(self.provedores):
+                self._timer = threading.Timer(CNPJ_HEDGE_DELAY, self._disparar_hedge)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _disparar_hedge(self):
+        """Dispara o próximo provedor no pool, se houver vaga"""
+        if not _vagas_hedge.acquire(blocking=False):
+            print("⏭️ [HEDGE] Pool de disputa ocupado - seguindo sem disputa")
+            return
+        tentativa = self._iniciar_proxima()
+        if tentativa is None:
+            _vagas_hedge.release()
+            return
+        with self._lock:
+            self.em_hedge += 1
+        try:
+            _executor_provedores.submit(self._executar_hedge, tentativa)
+        except RuntimeError:
+            # Pool encerrado (desligamento do processo)
+            self._hedge_terminou(tentativa)
+            return
+        self._agendar_hedge()
+
+    def _executar_hedge(self, tentativa):
+        try:
+            venceu = self._executar_tentativa(tentativa)
+        finally:
+            self._hedge_terminou(tentativa)
+        if not venceu:
+            self._disparar_hedge()
+
+    def _hedge_terminou(self, tentativa):
+        _vagas_hedge.release()
+        with self._lock:
+            self.tentativas.discard(tentativa)
+            self.em_hedge -= 1
+            self._hedge_concluido.notify_all()
+
+    def _executar_tentativa(self, tentativa):
+        """Executa a chamada; retorna True se ela venceu a disputa"""
+        print(f"📡 [HEDGE] Disparando {tentativa.nome}...")
+        try:
+            resultado = tentativa.executar(self.cnpj, prazo=self.prazo, nao_encontrado=self.nao_encontrado)
+        except Exception as e:
+            print(f"❌ [HEDGE] Erro em {tentativa.nome}: {e}")
+            resultado = None
+        
+        with self._lock:
+            self.tentativas.discard(tentativa)
+            if self.vencedor is not None or not (resultado and resultado.get('razao_social')):
+                if self.vencedor is None:
+                    print(f"⚠️ [HEDGE] {tentativa.nome} não retornou dados completos")
+                return False
+            self.vencedor = resultado
+            perdedores = list(self.tentativas)
+            self._hedge_concluido.notify_all()
+        
+        print(f"✅ [HEDGE] {tentativa.nome} venceu a disputa: '{resultado.get('razao_social')}'")
+        for perdedor in perdedores:
+            perdedor.cancelar()
+        return True
+
+    def _encerrar(self):
+        """Cancela o disparo agendado e as consultas ainda em andamento"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self.proximo = len(self.provedores)
+            pendentes = list(self.tentativas)
+        for tentativa in pendentes:
+            tentativa.cancelar()
+
+def _consultar_provedores_cnpj_hedge(cnpj, prazo=None, nao_encontrado=None):
+    """Consulta CNPJ disputando as APIs externas em paralelo (ver DisputaProvedores)"""
+    return DisputaProvedores(cnpj, prazo, nao_encontrado).executar()
+
+# ============================================================================
+# Enriquecimento de endereço pelo CEP (ViaCEP)
+# ============================================================================
+
+# Mesmo arquivo SQLite do cache de CNPJ, em tabela própria (chave = CEP)
+cache_cep = CacheCNPJ(CNPJ_CACHE_PATH, CEP_CACHE_TTL, CEP_CACHE_MAX_ENTRIES, tabela='ceps_cache')
+consultas_cep_em_andamento = ConsultasEmAndamento()
+
+def limpar_cep(cep):
+    """Retorna apenas os dígitos do CEP"""
+    return re.sub(r'\D', '', str(cep or ''))
+
+def _obter_cep_do_cache(cep_limpo):
+    """Retorna (encontrado, endereco) - endereco é None para CEP inexistente"""
+    em_cache = cache_cep.obter(cep_limpo)
+    if em_cache is None:
+        return False, None
+    return True, (None if em_cache.get('erro') else em_cache)
+
+def _armazenar_cep(cep_limpo, endereco):
+    cache_cep.salvar(cep_limpo, endereco or {'erro': True})
+
+def consultar_cep(cep, prazo=None):
+    """Consulta um CEP na ViaCEP, com cache persistente e coalescência de
+    chamadas simultâneas. Retorna o endereço normalizado ou None."""
+    cep_limpo = limpar_cep(cep)
+    if len(cep_limpo) != 8:
+        return None
+    
+    encontrado, endereco = _obter_cep_do_cache(cep_limpo)
+    if encontrado:
+        return endereco
+    
+    return consultas_cep_em_andamento.executar(
+        cep_limpo, lambda: _consultar_e_armazenar_cep(cep_limpo, prazo), timeout=tempo_restante(prazo)
+    )
+
+def _consultar_e_armazenar_cep(cep_limpo, prazo=None):
+    try:
+        url = f"{VIACEP_API_URL}{cep_limpo}/json/"
+        response = requisitar_com_prazo('ViaCEP', url, VIACEP_TIMEOUT, prazo)
+        if response.status_code != 200:
+            print(f"❌ [ViaCEP] Erro HTTP {response.status_code} para o CEP {cep_limpo}")
+            return None
+        endereco = _normalizar_viacep(response.json())
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"❌ [ViaCEP] Erro ao consultar CEP {cep_limpo}: {e}")
+        return None
+    
+    # CEP inexistente também vai para o cache, para não ser consultado de novo
+    _armazenar_cep(cep_limpo, endereco)
+    return endereco
+
+def _padronizar_endereco(endereco):
+    """Remove espaços, padroniza UF em maiúsculas e CEP no formato 00000-000"""
+    endereco = {campo: (valor.strip() if isinstance(valor, str) else valor) for campo, valor in (endereco or {}).items()}
+    if endereco.get('uf'):
+        endereco['uf'] = endereco['uf'].upper()
+    cep_limpo = limpar_cep(endereco.get('cep'))
+    if len(cep_limpo) == 8:
+        endereco['cep'] = f"{cep_limpo[:5]}-{cep_limpo[5:]}"
+    return endereco
+
+def enriquecer_endereco(endereco, prazo=None):
+    """Completa e padroniza um endereço (formato de dados_empresa) pelo CEP
+    
+    Município, UF e código IBGE vêm da ViaCEP; logradouro e bairro só são
+    preenchidos se o provedor de CNPJ não os informou.
+    """
+    endereco = _padronizar_endereco(endereco)
+    endereco_cep = consultar_cep(endereco.get('cep'), prazo)
+    if not endereco_cep:
+        return endereco
+    
+    for campo in ('logradouro', 'bairro'):
+        if not endereco.get(campo):
+            endereco[campo] = endereco_cep.get(campo, '')
+    for campo in ('municipio', 'uf', 'cep', 'codigo_ibge'):
+        if endereco_cep.get(campo):
+            endereco[campo] = endereco_cep[campo]
+    return endereco
+
+_executor_enriquecimento = ThreadPoolExecutor(max_workers=2, thread_name_prefix='enriquecimento-cep')
+
+def _endereco_da_empresa(dados_empresa):
+    """Endereço informado pelo provedor de CNPJ: o de dados_receita (enviado
+    pelo formulário) ou, na falta dele, o do registro no cache de CNPJ"""
+    dados_receita = dados_empresa.get('dados_receita')
+    endereco = dados_receita.get('endereco') if isinstance(dados_receita, dict) else None
+    if not isinstance(endereco, dict) and CNPJ_CACHE_ENABLED:
+        dados_cache = cache_cnpj.obter(limpar_cnpj(dados_empresa.get('cnpj')))
+        endereco = dados_cache.get('endereco') if isinstance(dados_cache, dict) else None
+    return endereco if isinstance(endereco, dict) else None
+
+def agendar_enriquecimento_endereco(empresa_id, dados_empresa):
+    """Agenda, fora da requisição, o enriquecimento do endereço da empresa salva
+    
+    Nunca levanta exceção: é chamada depois de o salvamento já ter sido feito.
+    """
+    if not CEP_ENRICHMENT_ENABLED or not supabase or not empresa_id:
+        return
+    try:
+        endereco = _endereco_da_empresa(dados_empresa) if isinstance(dados_empresa, dict) else None
+        if not endereco or len(limpar_cep(endereco.get('cep'))) != 8:
+            return
+        _executor_enriquecimento.submit(_enriquecer_endereco_empresa, empresa_id, endereco)
+    except Exception as e:
+        print(f"⚠️ [CEP] Erro ao agendar enriquecimento do endereço da empresa {empresa_id}: {e}")
+
+def _enriquecer_endereco_empresa(empresa_id, endereco):
+    try:
+        novo_endereco = enriquecer_endereco(endereco, prazo=time.monotonic() + CNPJ_LOOKUP_DEADLINE)
+        supabase.table('empresas').update({'endereco': novo_endereco}).eq('id', empresa_id).execute()
+        print(f"🏠 [CEP] Endereço da empresa {empresa_id} enriquecido (CEP {novo_endereco.get('cep')})")
+    except Exception as e:
+        print(f"⚠️ [CEP] Erro ao enriquecer endereço da empresa {empresa_id}: {e}")
+
+# ============================================================================
+# Consulta assíncrona (asyncio + httpx)
+#
+# Mesma cadeia de consultar_cnpj_com_fallback - base local, caches, provedores
+# na ordem adaptativa com circuit breaker, limite de taxa e prazo - mas sem
+# ocupar uma thread por consulta pendente: num servidor ASGI um único processo
+# mantém centenas de consultas em andamento.
+#
+# As rotas usam loop_consultas_cnpj: um event loop de fundo, único no
+# processo, com um httpx.AsyncClient de vida longa (keep-alive) - o Flask
+# cria um event loop novo para cada view async, então coalescência e pool de
+# conexões precisam morar fora dele. Em produção ASGI, sirva asgi_app
+# (ex.: uvicorn main:asgi_app), que atende /validar_cnpj_async sem ocupar
+# uma thread por requisição.
+# ============================================================================
+
+# Consultas assíncronas em andamento por event loop: {loop: {cnpj: Task}}
+_consultas_async_em_andamento = weakref.WeakKeyDictionary()
+
+def criar_cliente_http_async():
+    """Cliente httpx com os mesmos limites de pool das sessões síncronas"""
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=HTTP_POOL_CONNECTIONS * HTTP_POOL_MAXSIZE,
+            max_keepalive_connections=HTTP_POOL_MAXSIZE
+        )
+    )
+
+async def requisitar_com_prazo_async(cliente, provedor, url, timeout, prazo=None, **kwargs):
+    """Versão assíncrona de requisitar_com_prazo (mesmo retry, backoff e prazo)"""
+    restante = tempo_restante(prazo)
+    if restante is not None and restante <= 0:
+        raise httpx.TimeoutException(f"Prazo da consulta esgotado antes de chamar {provedor}")
+    
+    inicio = time.time()
+    try:
+        response = await _requisitar_com_retry_async(cliente, provedor, url, timeout, prazo, **kwargs)
+    except httpx.HTTPError:
+        registrar_saude_provedor(provedor, None, inicio)
+        raise
+    registrar_saude_provedor(provedor, response.status_code, inicio)
+    return response
+
+async def _requisitar_com_retry_async(cliente, provedor, url, timeout, prazo=None, **kwargs):
+    tentativa = 0
+    response = None
+    while True:
+        restante = tempo_restante(prazo)
+        if restante is not None and restante <= 0:
+            raise httpx.TimeoutException(f"Prazo da consulta esgotado em {provedor}")
+        
+        try:
+            response = await cliente.get(url, timeout=timeout if restante is None else min(timeout, restante), **kwargs)
+        except (httpx.ConnectError, httpx.ConnectTimeout):
+            if tentativa >= HTTP_RETRY_TOTAL:
+                raise
+            response = None
+            espera_minima = 0.0
+        else:
+            if response.status_code not in STATUS_RETRY or tentativa >= HTTP_RETRY_TOTAL:
+                return response
+            espera_minima = _espera_retry_after(response.headers)
+        
+        espera = max(espera_minima, _espera_backoff(tentativa))
+        restante = tempo_restante(prazo)
+        if restante is not None and espera >= restante:
+            print(f"⏱️ [HTTP ASYNC] {provedor}: sem tempo para nova tentativa (espera {espera:.1f}s, restam {restante:.1f}s)")
+            if response is not None:
+                return response
+            raise httpx.TimeoutException(f"Prazo da consulta esgotado em {provedor}")
+        
+        tentativa += 1
+        print(f"🔁 [HTTP ASYNC] {provedor}: tentativa {tentativa + 1} em {espera:.2f}s")
+        await asyncio.sleep(espera)
+
+async def consultar_provedor_cnpj_async(cliente, provedor, cnpj, prazo=None, nao_encontrado=None):
+    """Versão assíncrona de consultar_provedor_cnpj"""
+    cnpj_limpo = limpar_cnpj(cnpj)
+    try:
+        response = await requisitar_com_prazo_async(
+            cliente, provedor.nome, provedor.url(cnpj_limpo), provedor.timeout, prazo, headers=provedor.headers
+        )
+        return _interpretar_resposta_provedor(provedor, cnpj_limpo, response.status_code, response.text, nao_encontrado)
+    except Exception as e:
+        print(f"❌ [{provedor.nome} ASYNC] Erro: {e}")
+        return None
+
+async def consultar_cep_async(cliente, cep, prazo=None):
+    """Versão assíncrona de consultar_cep (mesmo cache persistente)"""
+    cep_limpo = limpar_cep(cep)
+    if len(cep_limpo) != 8:
+        return None
     
-    if resultado and resultado.get('razao_social'):
-        print(f"✅ [FALLBACK] Sucesso com ReceitaWS!")
-        print(f"   Razão Social encontrada: '{resultado.get('razao_social')}'")
-        return resultado
-    else:
-        print("⚠️ [FALLBACK] ReceitaWS não retornou dados completos")
-        if resultado:
-            print(f"   Dados ReceitaWS: razao_social='{resultado.get('razao_social')}', situacao='{resultado.get('situacao')}'")
+    encontrado, endereco = await asyncio.to_thread(_obter_cep_do_cache, cep_limpo)
+    if encontrado:
+        return endereco
     
-    # Se ambas falharam
-    print("❌ [FALLBACK] Nenhuma API retornou dados válidos")
-    print(f"   BrasilAPI resultado: {type(resultado)}")
-    print(f"   ReceitaWS resultado: {type(resultado)}")
-    return None
+    try:
+        url = f"{VIACEP_API_URL}{cep_limpo}/json/"
+        response = await requisitar_com_prazo_async(cliente, 'ViaCEP', url, VIACEP_TIMEOUT, prazo)
+        if response.status_code != 200:
+            return None
+        endereco = _normalizar_viacep(response.json())
+    except Exception as e:
+        print(f"❌ [ViaCEP ASYNC] Erro: {e}")
+        return None
     
-    # Segunda tentativa: ReceitaWS
-    print("📡 Tentativa 2: ReceitaWS...")
-    resultado = consultar_cnpj_receita_ws(cnpj)
+    await asyncio.to_thread(_armazenar_cep, cep_limpo, endereco)
+    return endereco
+
+async def consultar_cnpj_com_fallback_async(cnpj, prazo=None, cliente=None):
+    """Versão assíncrona de consultar_cnpj_com_fallback
     
-    if resultado and resultado.get('razao_social'):
-        print("✅ Sucesso com ReceitaWS!")
-        return resultado
+    Consultas simultâneas do mesmo CNPJ no mesmo event loop são coalescidas.
+    Se `cliente` (httpx.AsyncClient) não for informado, um é criado para a
+    consulta. Sem httpx instalado, a consulta síncrona roda em uma thread.
+    """
+    cnpj_limpo = limpar_cnpj(cnpj)
+    if prazo is None:
+        prazo = time.monotonic() + CNPJ_LOOKUP_DEADLINE
+    
+    if not HTTPX_AVAILABLE:
+        return await asyncio.to_thread(consultar_cnpj_com_fallback, cnpj, prazo)
+    
+    # Base local e caches são SQLite: ficam fora do event loop
+    dados_locais = await asyncio.to_thread(consultar_base_receita_local, cnpj_limpo)
+    if dados_locais:
+        print(f"⚡ [BASE LOCAL] CNPJ {cnpj_limpo} encontrado na base da Receita")
+        return dados_locais
+    
+    encontrado, dados_cache = await asyncio.to_thread(_consultar_caches_cnpj, cnpj_limpo)
+    if encontrado:
+        return dados_cache
+    
+    em_andamento = _consultas_async_em_andamento.setdefault(asyncio.get_running_loop(), {})
+    tarefa = em_andamento.get(cnpj_limpo)
+    if tarefa is None:
+        tarefa = asyncio.ensure_future(_consultar_e_armazenar_cnpj_async(cnpj_limpo, prazo, cliente))
+        em_andamento[cnpj_limpo] = tarefa
+        tarefa.add_done_callback(lambda _: em_andamento.pop(cnpj_limpo, None))
     else:
-        print("⚠️ ReceitaWS não retornou dados completos")
+        print(f"🔗 [SINGLE-FLIGHT ASYNC] Aguardando consulta em andamento: {cnpj_limpo}")
+    
+    try:
+        # shield: quem desiste pelo prazo não cancela a consulta dos demais
+        return await asyncio.wait_for(asyncio.shield(tarefa), tempo_restante(prazo))
+    except asyncio.TimeoutError:
+        print(f"⏱️ [FALLBACK ASYNC] Prazo esgotado consultando {cnpj_limpo}")
+        return None
+
+async def _consultar_e_armazenar_cnpj_async(cnpj_limpo, prazo, cliente=None):
+    if cliente is None:
+        async with criar_cliente_http_async() as cliente_consulta:
+            return await _consultar_e_armazenar_cnpj_async(cnpj_limpo, prazo, cliente_consulta)
+    
+    nao_encontrado = set()
+    resultado = await _consultar_provedores_cnpj_async(cliente, cnpj_limpo, prazo, nao_encontrado)
+    await asyncio.to_thread(_armazenar_resultado_cnpj, cnpj_limpo, resultado, nao_encontrado)
+    return resultado
+
+class LoopConsultasCNPJ:
+    """Event loop de fundo, único no processo, para as consultas assíncronas
+    
+    Concentra as consultas de todas as requisições em um só loop, de modo
+    que consultas simultâneas do mesmo CNPJ sejam coalescidas e todas usem o
+    mesmo httpx.AsyncClient (keep-alive). A consulta pode ser aguardada de
+    qualquer event loop (view async do Flask ou asgi_app).
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._cliente = None
+        self._lock = threading.Lock()
+
+    def _obter_loop(self):
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='cnpj-async', daemon=True).start()
+                self._loop = loop
+                print("🔌 [ASYNC] Event loop de consultas iniciado")
+            return self._loop
+
+    async def consultar(self, cnpj, prazo=None):
+        """Consulta o CNPJ no loop de fundo (ver consultar_cnpj_com_fallback_async)"""
+        futuro = asyncio.run_coroutine_threadsafe(self._consultar(cnpj, prazo), self._obter_loop())
+        return await asyncio.wrap_future(futuro)
+
+    async def _consultar(self, cnpj, prazo):
+        if not HTTPX_AVAILABLE:
+            return await consultar_cnpj_com_fallback_async(cnpj, prazo)
+        if self._cliente is None:
+            # Criado dentro do loop de fundo, onde vai ser usado
+            self._cliente = criar_cliente_http_async()
+        return await consultar_cnpj_com_fallback_async(cnpj, prazo, self._cliente)
+
+loop_consultas_cnpj = LoopConsultasCNPJ()
+
+async def _consultar_provedores_cnpj_async(cliente, cnpj, prazo=None, nao_encontrado=None):
+    """Versão assíncrona de _consultar_provedores_cnpj (mesma ordem e regras)"""
+    print(f"🔍 [FALLBACK ASYNC] Consultando CNPJ: {cnpj}")
+    
+    for provedor in _provedores_cnpj_ordenados():
+        nome = provedor.nome
+        restante = tempo_restante(prazo)
+        if restante is not None and restante <= 0:
+            print(f"⏱️ [FALLBACK ASYNC] Prazo esgotado antes de {nome}")
+            break
+        if not saude_provedores[nome].permitir():
+            print(f"⏭️ [FALLBACK ASYNC] {nome} ignorado - circuito aberto")
+            continue
+        espera_maxima = CNPJ_RATE_LIMIT_MAX_WAIT if restante is None else min(CNPJ_RATE_LIMIT_MAX_WAIT, restante)
+        # O limitador usa SQLite e pode esperar: fica fora do event loop
+        if not await asyncio.to_thread(limitadores_provedores[nome].adquirir, espera_maxima):
+            continue
+        if not saude_provedores[nome].reservar():
+            print(f"⏭️ [FALLBACK ASYNC] {nome} ignorado - consulta de teste já em andamento")
+            await asyncio.to_thread(limitadores_provedores[nome].devolver)
+            continue
+        
+        resultado = await consultar_provedor_cnpj_async(cliente, provedor, cnpj, prazo=prazo, nao_encontrado=nao_encontrado)
+        if resultado and resultado.get('razao_social'):
+            print(f"✅ [FALLBACK ASYNC] Sucesso com {nome}")
+            return resultado
     
-    # Se ambas falharam
-    print("❌ Nenhuma API retornou dados válidos")
+    print(f"❌ [FALLBACK ASYNC] Nenhuma API retornou dados válidos")
     return None
 
 def converter_faixa_colaboradores(faixa_str):
@@ -355,14 +1805,97 @@ def converter_faixa_colaboradores(faixa_str):
     print(f"⚠️ Não foi possível converter '{faixa_str}', usando 50 como padrão")
     return 50
 
-def salvar_empresa_diagnostico(dados_empresa, respostas, analise):
-    """Salva empresa e diagnóstico no Supabase"""
+# A função RPC salvar_empresa_diagnostico (database_structure.sql, seção 11)
+# grava empresa e diagnóstico em uma transação. Enquanto ela não existir no
+# banco, o salvamento usa as chamadas separadas de _salvar_empresa_diagnostico_separado.
+_rpc_salvar_disponivel = True
+
+def _dados_empresa_para_banco(dados_empresa):
+    """Colunas da tabela empresas a partir dos dados do formulário/CNPJ"""
+    return {
+        'razao_social': dados_empresa.get('razao_social', ''),
+        'nome_fantasia': dados_empresa.get('nome_fantasia', ''),
+        'cnpj': dados_empresa.get('cnpj', ''),
+        'email': dados_empresa.get('email', ''),
+        'telefone': dados_empresa.get('telefone', ''),
+        'whatsapp': dados_empresa.get('whatsapp', ''),
+        'endereco': dados_empresa.get('endereco', {}),
+        'num_colaboradores': converter_faixa_colaboradores(dados_empresa.get('num_colaboradores', 0)),
+        'setor_atividade': dados_empresa.get('setor', dados_empresa.get('atividade_principal', '')),
+        'rh_responsavel': dados_empresa.get('rh_responsavel', ''),
+        'cargo_rh': dados_empresa.get('cargo', '')
+    }
+
+def _dados_diagnostico_para_banco(respostas, analise, diagnostico_id=None):
+    """Colunas da tabela diagnosticos (sem empresa_id). Com diagnostico_id,
+    reenviar o mesmo diagnóstico não cria uma segunda linha."""
+    dados = {
+        'respostas': respostas,
+        'analise': analise,
+        'nivel_risco': analise.get('nivel_risco', ''),
+        'questoes_criticas': analise.get('questoes_criticas', 0),
+        'areas_foco': analise.get('areas_foco', []),
+        'acoes_recomendadas': analise.get('acoes_recomendadas', []),
+        'status': 'concluido'
+    }
+    if diagnostico_id:
+        dados['id'] = diagnostico_id
+    return dados
+
+def salvar_empresa_diagnostico(dados_empresa, respostas, analise, diagnostico_id=None):
+    """Salva empresa (upsert pelo CNPJ) e diagnóstico no Supabase em uma única chamada"""
+    empresa_id, diagnostico_id = _salvar_empresa_diagnostico(dados_empresa, respostas, analise, diagnostico_id)
+    if empresa_id and diagnostico_id:
+        # Endereço completado pelo CEP em segundo plano (não atrasa a resposta).
+        # Fica fora do salvamento: nada aqui pode transformar em erro um salvamento feito.
+        agendar_enriquecimento_endereco(empresa_id, dados_empresa)
+    return empresa_id, diagnostico_id
+
+def _salvar_empresa_diagnostico(dados_empresa, respostas, analise, diagnostico_id=None):
+    global _rpc_salvar_disponivel
     print("🔍 Iniciando salvamento no Supabase...")
     
     if not supabase:
         print("❌ ERRO: Cliente Supabase não inicializado")
         return None, None
     
+    if not _rpc_salvar_disponivel:
+        return _salvar_empresa_diagnostico_separado(dados_empresa, respostas, analise, diagnostico_id)
+    
+    try:
+        print(f"📝 Salvando empresa {dados_empresa.get('cnpj', '')} e diagnóstico via RPC...")
+        resultado = supabase.rpc('salvar_empresa_diagnostico', {
+            'p_empresa': _dados_empresa_para_banco(dados_empresa),
+            'p_diagnostico': _dados_diagnostico_para_banco(respostas, analise, diagnostico_id)
+        }).execute()
+        
+        ids = resultado.data
+        if isinstance(ids, list):
+            ids = ids[0] if ids else {}
+        empresa_id = (ids or {}).get('empresa_id')
+        diagnostico_id = (ids or {}).get('diagnostico_id')
+        
+        if not empresa_id or not diagnostico_id:
+            print(f"❌ ERRO: RPC não retornou os IDs. Resposta: {resultado}")
+            return None, None
+        
+        print(f"✅ Empresa {empresa_id} e diagnóstico {diagnostico_id} salvos")
+        return empresa_id, diagnostico_id
+        
+    except Exception as e:
+        if 'PGRST202' in str(e) or 'Could not find the function' in str(e):
+            print("⚠️ Função salvar_empresa_diagnostico não existe no banco (ver database_structure.sql) - usando chamadas separadas")
+            _rpc_salvar_disponivel = False
+            return _salvar_empresa_diagnostico_separado(dados_empresa, respostas, analise, diagnostico_id)
+        
+        print(f"❌ ERRO CRÍTICO ao salvar no banco: {str(e)}")
+        print(f"❌ Tipo do erro: {type(e).__name__}")
+        import traceback
+        traceback.print_exc()
+        return None, None
+
+def _salvar_empresa_diagnostico_separado(dados_empresa, respostas, analise, diagnostico_id=None):
+    """Salva empresa e diagnóstico com chamadas separadas (banco sem a função RPC)"""
     try:
         cnpj = dados_empresa.get('cnpj', '')
         print(f"📋 Verificando empresa existente com CNPJ: {cnpj}")
@@ -397,19 +1930,7 @@ def salvar_empresa_diagnostico(dados_empresa, respostas, analise):
         else:
             # Criar nova empresa
             print("🆕 Criando nova empresa...")
-            dados_nova_empresa = {
-                'razao_social': dados_empresa.get('razao_social', ''),
-                'nome_fantasia': dados_empresa.get('nome_fantasia', ''),
-                'cnpj': cnpj,
-                'email': dados_empresa.get('email', ''),
-                'telefone': dados_empresa.get('telefone', ''),
-                'whatsapp': dados_empresa.get('whatsapp', ''),
-                'endereco': dados_empresa.get('endereco', {}),
-                'num_colaboradores': converter_faixa_colaboradores(dados_empresa.get('num_colaboradores', 0)),
-                'setor_atividade': dados_empresa.get('setor', dados_empresa.get('atividade_principal', '')),
-                'rh_responsavel': dados_empresa.get('rh_responsavel', ''),
-                'cargo_rh': dados_empresa.get('cargo', '')
-            }
+            dados_nova_empresa = _dados_empresa_para_banco(dados_empresa)
             
             print(f"📝 Inserindo nova empresa: {dados_nova_empresa}")
             nova_empresa = supabase.table('empresas').insert(dados_nova_empresa).execute()
@@ -424,19 +1945,17 @@ def salvar_empresa_diagnostico(dados_empresa, respostas, analise):
         # Salvar diagnóstico
         print(f"📊 Salvando diagnóstico para empresa ID: {empresa_id}")
         
-        dados_diagnostico = {
-            'empresa_id': empresa_id,
-            'respostas': respostas,
-            'analise': analise,
-            'nivel_risco': analise.get('nivel_risco', ''),
-            'questoes_criticas': analise.get('questoes_criticas', 0),
-            'areas_foco': analise.get('areas_foco', []),
-            'acoes_recomendadas': analise.get('acoes_recomendadas', []),
-            'status': 'concluido'
-        }
+        dados_diagnostico = {'empresa_id': empresa_id, **_dados_diagnostico_para_banco(respostas, analise, diagnostico_id)}
         
         print(f"📝 Inserindo diagnóstico: {dados_diagnostico}")
-        novo_diagnostico = supabase.table('diagnosticos').insert(dados_diagnostico).execute()
+        try:
+            novo_diagnostico = supabase.table('diagnosticos').insert(dados_diagnostico).execute()
+        except Exception as e:
+            if diagnostico_id and '23505' in str(e):
+                # Mesmo diagnóstico já gravado por um envio anterior
+                print(f"🔁 Diagnóstico {diagnostico_id} já estava salvo")
+                return empresa_id, diagnostico_id
+            raise
         
         if novo_diagnostico.data:
             diagnostico_id = novo_diagnostico.data[0]['id']
@@ -453,6 +1972,607 @@ def salvar_empresa_diagnostico(dados_empresa, respostas, analise):
         traceback.print_exc()
         return None, None
 
+# ============================================================================
+# Gravação assíncrona dos questionários (write-behind)
+#
+# Com QUESTIONARIO_WRITE_BEHIND, /processar_questionario grava o envio em um
+# journal local durável e responde na hora; uma thread grava no Supabase em
+# lotes, com retry. Os IDs dos diagnósticos são gerados aqui, então reenviar
+# um registro (após queda ou timeout) não duplica o diagnóstico no banco.
+# Em ambiente serverless (Vercel) o processo pode ser congelado após a
+# resposta: mantenha desligado lá.
+# ============================================================================
+
+class JournalQuestionarios:
+    """Journal local (SQLite em modo WAL) dos questionários ainda não gravados no Supabase
+    
+    Cada envio é gravado com synchronous=FULL antes de a resposta voltar ao
+    usuário, então sobrevive a uma queda do processo. A thread de drenagem
+    reserva lotes de registros vencidos, grava no banco e os remove; em caso
+    de erro, o registro volta para a fila com backoff exponencial.
+    """
+
+    RESERVA_SEGUNDOS = 60
+
+    def __init__(self, caminho, max_tentativas):
+        self.caminho = caminho
+        self.max_tentativas = max_tentativas
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _conexao(self):
+        if self._conn is None:
+            pasta = os.path.dirname(self.caminho)
+            if pasta:
+                os.makedirs(pasta, exist_ok=True)
+            conn = sqlite3.connect(self.caminho, timeout=10, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=FULL')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS questionarios_pendentes (
+                    diagnostico_id TEXT PRIMARY KEY,
+                    dados TEXT NOT NULL,
+                    criado_em REAL NOT NULL,
+                    tentativas INTEGER NOT NULL DEFAULT 0,
+                    proxima_tentativa REAL NOT NULL,
+                    ultimo_erro TEXT,
+                    status TEXT NOT NULL DEFAULT 'pendente'
+                )
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_questionarios_pendentes_fila ON questionarios_pendentes(status, proxima_tentativa)')
+            self._conn = conn
+        return self._conn
+
+    def adicionar(self, diagnostico_id, dados):
+        """Registra um envio; levanta sqlite3.Error se não for possível (o chamador grava direto)"""
+        agora = time.time()
+        with self._lock:
+            self._conexao().execute(
+                'INSERT OR IGNORE INTO questionarios_pendentes (diagnostico_id, dados, criado_em, proxima_tentativa) VALUES (?, ?, ?, ?)',
+                (diagnostico_id, json.dumps(dados, ensure_ascii=False, default=str), agora, agora)
+            )
+
+    def reservar(self, limite):
+        """Reserva até `limite` registros vencidos (outros workers não os pegam por RESERVA_SEGUNDOS)"""
+        agora = time.time()
+        with self._lock:
+            conn = self._conexao()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                rows = conn.execute(
+                    "SELECT diagnostico_id, dados, tentativas FROM questionarios_pendentes "
+                    "WHERE status = 'pendente' AND proxima_tentativa <= ? ORDER BY criado_em LIMIT ?",
+                    (agora, limite)
+                ).fetchall()
+                conn.executemany(
+                    'UPDATE questionarios_pendentes SET proxima_tentativa = ? WHERE diagnostico_id = ?',
+                    [(agora + self.RESERVA_SEGUNDOS, row[0]) for row in rows]
+                )
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        return [(diagnostico_id, json.loads(dados), tentativas) for diagnostico_id, dados, tentativas in rows]
+
+    def concluir(self, diagnostico_id):
+        with self._lock:
+            self._conexao().execute('DELETE FROM questionarios_pendentes WHERE diagnostico_id = ?', (diagnostico_id,))
+
+    def adiar(self, diagnostico_id, tentativas, erro):
+        """Devolve o registro à fila com backoff; após max_tentativas ele fica como 'falhou'"""
+        tentativas += 1
+        espera = min(3600, QUESTIONARIO_JOURNAL_INTERVAL * (2 ** tentativas)) * random.uniform(0.5, 1.0)
+        status = 'falhou' if tentativas >= self.max_tentativas else 'pendente'
+        with self._lock:
+            self._conexao().execute(
+                'UPDATE questionarios_pendentes SET tentativas = ?, proxima_tentativa = ?, ultimo_erro = ?, status = ? WHERE diagnostico_id = ?',
+                (tentativas, time.time() + espera, str(erro)[:500], status, diagnostico_id)
+            )
+        if status == 'falhou':
+            print(f"❌ [JOURNAL] Diagnóstico {diagnostico_id} desistido após {tentativas} tentativas: {erro}")
+
+    def resumo(self):
+        with self._lock:
+            rows = self._conexao().execute(
+                'SELECT status, COUNT(*), MIN(criado_em) FROM questionarios_pendentes GROUP BY status'
+            ).fetchall()
+        return {status: {'quantidade': quantidade, 'mais_antigo': datetime.fromtimestamp(mais_antigo).isoformat()}
+                for status, quantidade, mais_antigo in rows}
+
+_rpc_lote_disponivel = True
+journal_questionarios = JournalQuestionarios(QUESTIONARIO_JOURNAL_PATH, QUESTIONARIO_JOURNAL_MAX_ATTEMPTS)
+_drenagem_journal = {'thread': None, 'evento': threading.Event()}
+_drenagem_journal_lock = threading.Lock()
+
+def registrar_questionario_pendente(diagnostico_id, dados_empresa, respostas, analise):
+    """Grava o envio no journal e acorda a thread de drenagem"""
+    journal_questionarios.adicionar(diagnostico_id, {
+        'dados_empresa': dados_empresa,
+        'respostas': respostas,
+        'analise': analise
+    })
+    iniciar_drenagem_journal()
+    _drenagem_journal['evento'].set()
+
+def iniciar_drenagem_journal():
+    """Inicia (uma vez por processo) a thread que grava o journal no Supabase"""
+    with _drenagem_journal_lock:
+        thread = _drenagem_journal['thread']
+        if thread is not None and thread.is_alive():
+            return
+        thread = threading.Thread(target=_drenar_journal_continuamente, name='journal-questionarios', daemon=True)
+        _drenagem_journal['thread'] = thread
+        thread.start()
+
+def _drenar_journal_continuamente():
+    while True:
+        try:
+            while drenar_journal_questionarios():
+                pass
+        except Exception as e:
+            print(f"⚠️ [JOURNAL] Erro na drenagem: {e}")
+        _drenagem_journal['evento'].wait(QUESTIONARIO_JOURNAL_INTERVAL)
+        _drenagem_journal['evento'].clear()
+
+def drenar_journal_questionarios():
+    """Grava no Supabase um lote de questionários pendentes; retorna quantos foram gravados"""
+    if not supabase:
+        return 0
+    
+    lote = journal_questionarios.reservar(QUESTIONARIO_JOURNAL_BATCH)
+    if not lote:
+        return 0
+    
+    print(f"📤 [JOURNAL] Gravando {len(lote)} questionário(s) pendente(s)...")
+    global _rpc_lote_disponivel
+    if len(lote) > 1 and _rpc_salvar_disponivel and _rpc_lote_disponivel:
+        try:
+            resultado = supabase.rpc('salvar_empresas_diagnosticos_lote', {'p_itens': [
+                {
+                    'empresa': _dados_empresa_para_banco(dados['dados_empresa']),
+                    'diagnostico': _dados_diagnostico_para_banco(dados['respostas'], dados['analise'], diagnostico_id)
+                }
+                for diagnostico_id, dados, _ in lote
+            ]}).execute()
+            ids = resultado.data if isinstance(resultado.data, list) else []
+            for diagnostico_id, _, _ in lote:
+                journal_questionarios.concluir(diagnostico_id)
+        except Exception as e:
+            if 'PGRST202' in str(e) or 'Could not find the function' in str(e):
+                print("⚠️ [JOURNAL] Função salvar_empresas_diagnosticos_lote não existe no banco - gravando um a um")
+                _rpc_lote_disponivel = False
+            else:
+                # Algum item problemático derruba o lote inteiro: um a um
+                print(f"⚠️ [JOURNAL] Lote falhou ({e}) - gravando um a um")
+        else:
+            print(f"✅ [JOURNAL] Lote de {len(lote)} gravado em uma chamada")
+            for (_, dados, _), ids_item in zip(lote, ids):
+                agendar_enriquecimento_endereco((ids_item or {}).get('empresa_id'), dados['dados_empresa'])
+            return len(lote)
+    
+    gravados = 0
+    for diagnostico_id, dados, tentativas in lote:
+        empresa_id, salvo_id = salvar_empresa_diagnostico(
+            dados['dados_empresa'], dados['respostas'], dados['analise'], diagnostico_id
+        )
+        if empresa_id and salvo_id:
+            journal_questionarios.concluir(diagnostico_id)
+            gravados += 1
+        else:
+            journal_questionarios.adiar(diagnostico_id, tentativas, 'falha ao salvar no Supabase')
+    return gravados
+
+# Envios que ficaram no journal quando o processo anterior terminou
+if QUESTIONARIO_WRITE_BEHIND and supabase:
+    iniciar_drenagem_journal()
+
+# ============================================================================
+# Idempotência do envio do questionário
+#
+# questionario.html manda uma chave (Idempotency-Key) por tentativa; duplo
+# clique e retries do cliente reenviam a mesma chave. O primeiro envio grava
+# e guarda os IDs em cache local; os seguintes recebem a mesma resposta sem
+# tocar no banco. O ID do diagnóstico é derivado da chave, então mesmo entre
+# workers (ou após o TTL) o banco não duplica o diagnóstico.
+# ============================================================================
+
+CHAVE_IDEMPOTENCIA_RE = re.compile(r'[A-Za-z0-9_-]{8,128}')
+NAMESPACE_IDEMPOTENCIA = uuid.UUID('5d1c6f55-8f0e-4a3c-9a43-6b8f0f4f2a11')
+
+# Mesmo arquivo SQLite do cache de CNPJ, em tabela própria (chave = CNPJ:chave do envio)
+cache_idempotencia = CacheCNPJ(CNPJ_CACHE_PATH, QUESTIONARIO_IDEMPOTENCY_TTL, QUESTIONARIO_IDEMPOTENCY_MAX_ENTRIES,
+                               tabela='questionarios_idempotencia')
+envios_em_andamento = ConsultasEmAndamento()
+
+def _processar_envio_questionario(dados_empresa, respostas, diagnostico_id=None):
+    """Gera a análise e grava (ou enfileira) o diagnóstico.
+    Retorna os dados para a página de resultado, ou None se não foi possível gravar."""
+    # Gerar análise
+    print("🧮 Gerando análise...")
+    analise = gerar_analise(respostas)
+    print("✅ Análise gerada")
+    
+    empresa_id = None
+    na_fila = False
+    if QUESTIONARIO_WRITE_BEHIND:
+        # Grava no journal local e responde sem esperar o Supabase
+        # (a empresa só terá ID quando a thread de drenagem gravar)
+        try:
+            diagnostico_id = diagnostico_id or str(uuid.uuid4())
+            registrar_questionario_pendente(diagnostico_id, dados_empresa, respostas, analise)
+            na_fila = True
+            print(f"📥 [JOURNAL] Diagnóstico {diagnostico_id} na fila de gravação")
+        except Exception as journal_error:
+            print(f"⚠️ [JOURNAL] Erro ao gravar no journal ({journal_error}) - salvando direto no banco")
+    
+    if not na_fila:
+        # Salvar no banco de dados (Supabase)
+        print("💾 Salvando no banco de dados...")
+        empresa_id, diagnostico_id = salvar_empresa_diagnostico(dados_empresa, respostas, analise, diagnostico_id)
+        
+        if not empresa_id or not diagnostico_id:
+            print("❌ ERRO: Falha ao salvar no banco de dados")
+            return None
+        
+        print(f"✅ Dados salvos - Empresa ID: {empresa_id}, Diagnóstico ID: {diagnostico_id}")
+    
+    return {
+        'dados_empresa': dados_empresa,
+        'respostas': respostas,
+        'analise': analise,
+        'empresa_id': empresa_id,
+        'diagnostico_id': diagnostico_id
+    }
+
+def processar_envio_idempotente(chave, dados_empresa, respostas):
+    """Processa o envio uma única vez por chave; reenvios recebem o resultado original.
+    Levanta ValueError se a chave já foi usada com outro conteúdo."""
+    chave_cache = f"{limpar_cnpj(dados_empresa.get('cnpj'))}:{chave}"
+    impressao = hashlib.sha256(json.dumps(
+        {'dados_empresa': dados_empresa, 'respostas': respostas}, sort_keys=True, ensure_ascii=False, default=str
+    ).encode('utf-8')).hexdigest()
+    processado_aqui = []
+    
+    def processar():
+        registro = cache_idempotencia.obter(chave_cache)
+        if registro is not None:
+            return registro
+        processado_aqui.append(True)
+        dados_completos = _processar_envio_questionario(
+            dados_empresa, respostas, str(uuid.uuid5(NAMESPACE_IDEMPOTENCIA, chave_cache))
+        )
+        if dados_completos is None:
+            return None
+        registro = {'impressao': impressao, 'dados': dados_completos}
+        cache_idempotencia.salvar(chave_cache, registro)
+        return registro
+    
+    # Envios simultâneos da mesma chave (duplo clique) esperam o primeiro;
+    # 30s é o timeout do envio em questionario.html
+    registro = envios_em_andamento.executar(chave_cache, processar, timeout=30)
+    if registro is None:
+        return None
+    if registro['impressao'] != impressao:
+        raise ValueError(f"Chave {chave} reutilizada com conteúdo diferente")
+    if not processado_aqui:
+        print(f"🔁 [IDEMPOTENCIA] Envio repetido - diagnóstico {registro['dados']['diagnostico_id']}")
+    return registro['dados']
+
+# ============================================================================
+# Resultados dos diagnósticos (servidor)
+#
+# /processar_questionario guarda o resultado aqui; /resultado e /gerar_pdf o
+# buscam pelo diagnostico_id da URL (ou da sessão). Substitui o antigo
+# temp_diagnostico.json, que era único para todos os usuários.
+# ============================================================================
+
+class ArmazemResultados:
+    """LRU em memória, com TTL, na frente de um cache persistente opcional (CacheCNPJ)"""
+
+    def __init__(self, max_entradas, ttl, compartilhado=None):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.compartilhado = compartilhado
+        self._lock = threading.Lock()
+        self._itens = OrderedDict()
+
+    def _guardar_em_memoria(self, chave, dados):
+        with self._lock:
+            self._itens[chave] = (time.time(), dados)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_entradas:
+                self._itens.popitem(last=False)
+
+    def salvar(self, chave, dados):
+        self._guardar_em_memoria(chave, dados)
+        if self.compartilhado is not None:
+            self.compartilhado.salvar(chave, dados)
+
+    def obter(self, chave):
+        """Retorna o resultado ou None se ausente/expirado"""
+        if not chave:
+            return None
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is not None:
+                if time.time() - item[0] <= self.ttl:
+                    self._itens.move_to_end(chave)
+                    return item[1]
+                del self._itens[chave]
+        if self.compartilhado is None:
+            return None
+        dados = self.compartilhado.obter(chave)
+        if dados is not None:
+            self._guardar_em_memoria(chave, dados)
+        return dados
+
+    def remover(self, chave):
+        with self._lock:
+            self._itens.pop(chave, None)
+        if self.compartilhado is not None:
+            self.compartilhado.remover(chave)
+
+armazem_resultados = ArmazemResultados(
+    RESULT_STORE_MAX_ENTRIES, RESULT_STORE_TTL,
+    CacheCNPJ(CNPJ_CACHE_PATH, RESULT_STORE_TTL, RESULT_STORE_MAX_ENTRIES * 10, tabela='resultados_cache') if RESULT_STORE_SHARED else None
+)
+
+def obter_resultado_diagnostico(diagnostico_id):
+    """Resultado do diagnóstico: armazém local, ou o banco (e então guarda no armazém)"""
+    dados = armazem_resultados.obter(diagnostico_id)
+    if dados is not None:
+        print(f"📊 Resultado {diagnostico_id} encontrado no armazém")
+        return dados
+    if not diagnostico_id or not supabase:
+        return None
+    
+    print(f"🔍 Buscando diagnóstico no banco: {diagnostico_id}")
+    try:
+        resultado_query = supabase.table('diagnosticos').select('*, empresas(*)').eq('id', diagnostico_id).execute()
+    except Exception as db_error:
+        print(f"❌ Erro ao buscar no banco: {db_error}")
+        return None
+    if not resultado_query.data:
+        return None
+    
+    diagnostico = resultado_query.data[0]
+    dados = {
+        'dados_empresa': diagnostico['empresas'],
+        'respostas': diagnostico['respostas'],
+        'analise': diagnostico['analise'],
+        'empresa_id': diagnostico['empresa_id'],
+        'diagnostico_id': diagnostico['id'],
+        'status': diagnostico.get('status'),
+        'pdf_url': diagnostico.get('pdf_url')
+    }
+    print("✅ Dados recuperados do banco de dados")
+    armazem_resultados.salvar(diagnostico_id, dados)
+    return dados
+
+# Páginas renderizadas por diagnostico_id: {'etag', 'html', 'versao' (hash do conteúdo), 'verificado_em'}
+paginas_resultado = ArmazemResultados(
+    RESULT_STORE_MAX_ENTRIES, RESULT_STORE_TTL,
+    CacheCNPJ(CNPJ_CACHE_PATH, RESULT_STORE_TTL, RESULT_STORE_MAX_ENTRIES * 10, tabela='paginas_resultado_cache') if RESULT_STORE_SHARED else None
+)
+_VERSAO_DESCONHECIDA = object()
+# Só o que a página exibe: gravar o pdf_url (que dispara o trigger do
+# updated_at) não invalida a página nem o ETag
+COLUNAS_VERSAO_DIAGNOSTICO = 'status, respostas, analise, empresas(*)'
+
+def _hash_conteudo_resultado(dados_empresa, respostas, analise, status):
+    conteudo = {
+        'dados_empresa': dados_empresa, 'respostas': respostas,
+        'analise': analise, 'status': status or 'concluido'
+    }
+    return hashlib.sha256(json.dumps(conteudo, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+def _versao_diagnostico(diagnostico_id):
+    """Hash do conteúdo exibido do diagnóstico no banco (None se ainda não gravado)"""
+    if not supabase:
+        return _VERSAO_DESCONHECIDA
+    try:
+        consulta = supabase.table('diagnosticos').select(COLUNAS_VERSAO_DIAGNOSTICO).eq('id', diagnostico_id).execute()
+    except Exception as e:
+        print(f"⚠️ [RESULTADO] Erro ao conferir versão do diagnóstico {diagnostico_id}: {e}")
+        return _VERSAO_DESCONHECIDA
+    if not consulta.data:
+        return None
+    linha = consulta.data[0]
+    return _hash_conteudo_resultado(linha.get('empresas'), linha.get('respostas'), linha.get('analise'), linha.get('status'))
+
+def obter_pagina_resultado(diagnostico_id):
+    """Página de resultado renderizada, reaproveitada enquanto o diagnóstico não mudar"""
+    pagina = paginas_resultado.obter(diagnostico_id)
+    if pagina is not None:
+        if time.time() - pagina['verificado_em'] < RESULT_PAGE_REVALIDATE:
+            return pagina
+        versao = _versao_diagnostico(diagnostico_id)
+        if versao is _VERSAO_DESCONHECIDA or versao == pagina['versao']:
+            pagina['verificado_em'] = time.time()
+            paginas_resultado.salvar(diagnostico_id, pagina)
+            return pagina
+        print(f"♻️ [RESULTADO] Diagnóstico {diagnostico_id} alterado no banco - renderizando de novo")
+        armazem_resultados.remover(diagnostico_id)
+    
+    dados = obter_resultado_diagnostico(diagnostico_id)
+    if not dados:
+        return None
+    html = render_template('resultado.html', dados=dados)
+    pagina = {
+        'etag': hashlib.sha256(html.encode('utf-8')).hexdigest(),
+        'html': html,
+        'versao': _hash_conteudo_resultado(dados.get('dados_empresa'), dados.get('respostas'),
+                                           dados.get('analise'), dados.get('status')),
+        'verificado_em': time.time()
+    }
+    # Só diagnósticos concluídos são imutáveis
+    if (dados.get('status') or 'concluido') == 'concluido':
+        paginas_resultado.salvar(diagnostico_id, pagina)
+    return pagina
+
+# ============================================================================
+# Cache dos relatórios PDF
+#
+# O PDF é gerado uma vez por conteúdo: a chave é o hash dos dados usados por
+# criar_pdf_relatorio. Downloads repetidos são a leitura de um arquivo, com
+# ETag (a própria chave) e suporte a Range. O local do PDF é gravado em
+# diagnosticos.pdf_url. A pasta local tem tamanho máximo (LRU pela data de
+# modificação, renovada a cada uso) e descarta PDFs sem uso há muito tempo.
+# ============================================================================
+
+# Aumente ao alterar o layout de criar_pdf_relatorio (invalida os PDFs em cache)
+VERSAO_LAYOUT_PDF = 1
+CHAVE_PDF_RE = re.compile(r'[0-9a-f]{64}')
+
+class ArmazemPDFs:
+    """PDFs em disco por chave, com limite de tamanho e idade; com bucket, replicados no Supabase Storage"""
+
+    def __init__(self, pasta, bucket='', max_bytes=None, ttl=None):
+        self.pasta = pasta
+        self.bucket = bucket
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+    def caminho(self, chave):
+        return os.path.join(self.pasta, chave[:2], f'{chave}.pdf')
+
+    def _objeto(self, chave):
+        return f'relatorios/{chave}.pdf'
+
+    def _gravar_local(self, chave, conteudo):
+        caminho = self.caminho(chave)
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        # Gravação atômica: quem está lendo nunca vê um PDF pela metade
+        temporario = f'{caminho}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temporario, 'wb') as arquivo:
+            arquivo.write(conteudo)
+        os.replace(temporario, caminho)
+        self.limpar(manter=caminho)
+        return caminho
+
+    def limpar(self, manter=None):
+        """Remove os PDFs vencidos e, acima do tamanho máximo, os usados há mais tempo"""
+        if not self.max_bytes and not self.ttl:
+            return
+        with self._lock:
+            arquivos = []
+            for raiz, _, nomes in os.walk(self.pasta):
+                for nome in nomes:
+                    if not nome.endswith('.pdf'):
+                        continue
+                    caminho = os.path.join(raiz, nome)
+                    try:
+                        info = os.stat(caminho)
+                    except OSError:
+                        continue
+                    arquivos.append((info.st_mtime, info.st_size, caminho))
+            arquivos.sort()
+            total = sum(tamanho for _, tamanho, _ in arquivos)
+            limite_idade = time.time() - self.ttl if self.ttl else None
+            for modificado_em, tamanho, caminho in arquivos:
+                vencido = limite_idade is not None and modificado_em < limite_idade
+                if caminho == manter or not (vencido or (self.max_bytes and total > self.max_bytes)):
+                    continue
+                try:
+                    os.remove(caminho)
+                    total -= tamanho
+                except OSError:
+                    pass
+
+    def obter(self, chave):
+        """Caminho local do PDF, ou None se ainda não foi gerado"""
+        caminho = self.caminho(chave)
+        try:
+            # Marca o uso (ordem do LRU da pasta)
+            os.utime(caminho)
+            return caminho
+        except OSError:
+            pass
+        if self.bucket and supabase:
+            try:
+                conteudo = supabase.storage.from_(self.bucket).download(self._objeto(chave))
+                print(f"☁️ [PDF] Relatório {chave[:12]} baixado do bucket {self.bucket}")
+                return self._gravar_local(chave, conteudo)
+            except Exception:
+                return None
+        return None
+
+    def salvar(self, chave, conteudo):
+        caminho = self._gravar_local(chave, conteudo)
+        if self.bucket and supabase:
+            try:
+                supabase.storage.from_(self.bucket).upload(
+                    self._objeto(chave), conteudo, {'content-type': 'application/pdf', 'upsert': 'true'}
+                )
+            except Exception as e:
+                print(f"⚠️ [PDF] Erro ao enviar relatório para o bucket {self.bucket}: {e}")
+        return caminho
+
+    def url(self, chave):
+        """Local do PDF gravado em diagnosticos.pdf_url"""
+        if self.bucket and supabase:
+            try:
+                return supabase.storage.from_(self.bucket).get_public_url(self._objeto(chave))
+            except Exception as e:
+                print(f"⚠️ [PDF] Erro ao obter URL pública do relatório: {e}")
+        return url_for('baixar_relatorio_pdf', chave=chave)
+
+armazem_pdfs = ArmazemPDFs(PDF_CACHE_DIR, PDF_STORAGE_BUCKET, PDF_CACHE_MAX_MB * 1024 * 1024, PDF_CACHE_TTL)
+pdfs_em_andamento = ConsultasEmAndamento()
+_pdf_urls_registradas = {}
+
+def chave_pdf_relatorio(dados):
+    """Hash das entradas de criar_pdf_relatorio (e da versão do layout)"""
+    entradas = {
+        'layout': VERSAO_LAYOUT_PDF,
+        'dados_empresa': dados.get('dados_empresa', {}),
+        'analise': dados.get('analise', {})
+    }
+    if not entradas['analise'].get('data_diagnostico'):
+        # Sem data no diagnóstico o relatório mostra a data de geração
+        entradas['gerado_em'] = datetime.now().strftime('%d/%m/%Y')
+    return hashlib.sha256(json.dumps(entradas, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+def _registrar_pdf_url(diagnostico_id, url, url_atual=None):
+    """Grava o pdf_url do diagnóstico só quando ele muda"""
+    if not diagnostico_id or not supabase or url == url_atual or _pdf_urls_registradas.get(diagnostico_id) == url:
+        return
+    try:
+        supabase.table('diagnosticos').update({'pdf_url': url}).eq('id', diagnostico_id).execute()
+        if len(_pdf_urls_registradas) >= 10000:
+            _pdf_urls_registradas.clear()
+        _pdf_urls_registradas[diagnostico_id] = url
+        print(f"🔗 [PDF] pdf_url do diagnóstico {diagnostico_id}: {url}")
+    except Exception as e:
+        print(f"⚠️ [PDF] Erro ao gravar pdf_url do diagnóstico {diagnostico_id}: {e}")
+
+def obter_pdf_relatorio(dados, diagnostico_id=None):
+    """Retorna (chave, caminho local) do relatório, gerando o PDF só na primeira vez"""
+    chave = chave_pdf_relatorio(dados)
+    caminho = armazem_pdfs.obter(chave)
+    if caminho is None:
+        def gerar():
+            existente = armazem_pdfs.obter(chave)
+            if existente is not None:
+                return existente
+            print(f"📄 [PDF] Gerando relatório {chave[:12]}...")
+            return armazem_pdfs.salvar(chave, criar_pdf_relatorio(dados))
+        caminho = pdfs_em_andamento.executar(chave, gerar)
+    else:
+        print(f"⚡ [PDF] Relatório {chave[:12]} servido do cache")
+    _registrar_pdf_url(diagnostico_id, armazem_pdfs.url(chave), dados.get('pdf_url'))
+    return chave, caminho
+
+def enviar_pdf_relatorio(dados, nome_arquivo, diagnostico_id=None):
+    """Resposta de download do relatório (do cache, com ETag e Range)"""
+    if not PDF_CACHE_ENABLED:
+        return send_file(io.BytesIO(criar_pdf_relatorio(dados)), mimetype='application/pdf',
+                         as_attachment=True, download_name=nome_arquivo)
+    chave, caminho = obter_pdf_relatorio(dados, diagnostico_id)
+    return send_file(caminho, mimetype='application/pdf', as_attachment=True, download_name=nome_arquivo,
+                     conditional=True, etag=chave)
+
 # Dados das perguntas do questionário
 PERGUNTAS = [
     {
@@ -567,18 +2687,24 @@ PERGUNTAS = [
     }
 ]
 
-@app.route('/validar_cnpj', methods=['POST'])
-def validar_cnpj_route():
-    """Endpoint para validar CNPJ e buscar dados da empresa"""
-    data = request.get_json()
+# Regras de análise compiladas uma única vez (colunas = perguntas do questionário)
+motor_analise = MotorAnalise(carregar_regras(QUESTIONARIO_SCORING_RULES), PERGUNTAS)
+
+def _validar_cnpj_requisicao():
+    """Lê e valida localmente o CNPJ do corpo da requisição.
+    Retorna (cnpj, None) ou (None, resposta de erro)."""
+    return _validar_cnpj_informado(request.path, request.get_json())
+
+def _validar_cnpj_informado(caminho, data):
+    """Valida localmente o CNPJ do corpo JSON já lido (ver _validar_cnpj_requisicao)"""
     cnpj = data.get('cnpj', '').strip()
     
-    print(f"\n🔍 [ROUTE] /validar_cnpj chamada")
+    print(f"\n🔍 [ROUTE] {caminho} chamada")
     print(f"   CNPJ recebido: '{cnpj}'")
     
     if not cnpj:
         print(f"❌ [ROUTE] CNPJ vazio")
-        return jsonify({'valid': False, 'message': 'CNPJ é obrigatório'})
+        return None, {'valid': False, 'message': 'CNPJ é obrigatório'}
     
     # Validar formato do CNPJ
     formato_valido = validar_cnpj(cnpj)
@@ -586,12 +2712,12 @@ def validar_cnpj_route():
     
     if not formato_valido:
         print(f"❌ [ROUTE] CNPJ com formato inválido")
-        return jsonify({'valid': False, 'message': 'CNPJ inválido'})
-    
-    # Consultar dados usando múltiplas APIs
-    print(f"🔍 [ROUTE] Iniciando consulta de dados...")
-    dados_empresa = consultar_cnpj_com_fallback(cnpj)
+        return None, {'valid': False, 'message': 'CNPJ inválido'}
     
+    return cnpj, None
+
+def _resposta_validacao_cnpj(dados_empresa):
+    """Monta a resposta de /validar_cnpj a partir dos dados obtidos (ou None)"""
     print(f"📊 [ROUTE] Resultado da consulta:")
     print(f"   Dados encontrados: {dados_empresa is not None}")
     
@@ -607,10 +2733,10 @@ def validar_cnpj_route():
         
         if situacao and situacao != 'ATIVA':
             print(f"⚠️ [ROUTE] Empresa não ativa: {situacao}")
-            return jsonify({
+            return {
                 'valid': False, 
                 'message': f'Empresa com situação: {dados_empresa.get("situacao", "INATIVA")}. Apenas empresas ativas podem realizar o diagnóstico.'
-            })
+            }
     
     # CNPJ válido no formato - permitir prosseguir mesmo sem dados completos
     resposta = {
@@ -635,7 +2761,177 @@ def validar_cnpj_route():
     else:
         print(f"   dados_empresa: não disponível")
     
-    return jsonify(resposta)
+    return resposta
+
+@app.route('/validar_cnpj', methods=['POST'])
+def validar_cnpj_route():
+    """Endpoint para validar CNPJ e buscar dados da empresa"""
+    cnpj, erro = _validar_cnpj_requisicao()
+    if erro:
+        return jsonify(erro)
+    
+    # Consultar dados usando múltiplas APIs, dentro do prazo da requisição
+    print(f"🔍 [ROUTE] Iniciando consulta de dados (prazo: {CNPJ_LOOKUP_DEADLINE}s)...")
+    prazo = time.monotonic() + CNPJ_LOOKUP_DEADLINE
+    dados_empresa = consultar_cnpj_com_fallback(cnpj, prazo=prazo)
+    
+    return jsonify(_resposta_validacao_cnpj(dados_empresa))
+
+if ASYNC_VIEWS_AVAILABLE:
+    @app.route('/validar_cnpj_async', methods=['POST'])
+    async def validar_cnpj_async_route():
+        """Mesmo contrato de /validar_cnpj, com a consulta feita em asyncio
+        (requer flask[async]; sem httpx, delega para a consulta síncrona)"""
+        cnpj, erro = _validar_cnpj_requisicao()
+        if erro:
+            return jsonify(erro)
+        
+        print(f"🔍 [ROUTE] Iniciando consulta assíncrona (prazo: {CNPJ_LOOKUP_DEADLINE}s)...")
+        prazo = time.monotonic() + CNPJ_LOOKUP_DEADLINE
+        dados_empresa = await loop_consultas_cnpj.consultar(cnpj, prazo=prazo)
+
+        return jsonify(_resposta_validacao_cnpj(dados_empresa))
+
+    from asgiref.wsgi import WsgiToAsgi
+    _app_flask_asgi = WsgiToAsgi(app)
+
+    async def _responder_json_asgi(send, status, corpo):
+        conteudo = json.dumps(corpo, ensure_ascii=False).encode('utf-8')
+        await send({'type': 'http.response.start', 'status': status, 'headers': [
+            (b'content-type', b'application/json'), (b'content-length', str(len(conteudo)).encode()),
+        ]})
+        await send({'type': 'http.response.body', 'body': conteudo})
+
+    async def asgi_app(scope, receive, send):
+        """Entrada ASGI do app (ex.: uvicorn main:asgi_app)
+
+        POST /validar_cnpj_async é atendida direto no event loop do servidor,
+        sem ocupar uma thread enquanto a consulta está pendente; as demais
+        rotas seguem para o Flask (WsgiToAsgi, em threads).
+        """
+        if scope['type'] != 'http' or scope['path'] != '/validar_cnpj_async' or scope['method'] != 'POST':
+            await _app_flask_asgi(scope, receive, send)
+            return
+
+        corpo = b''
+        while True:
+            mensagem = await receive()
+            corpo += mensagem.get('body', b'')
+            if not mensagem.get('more_body'):
+                break
+        try:
+            data = json.loads(corpo)
+            if not isinstance(data, dict):
+                raise ValueError('corpo não é um objeto JSON')
+        except ValueError:
+            await _responder_json_asgi(send, 400, {'valid': False, 'message': 'JSON inválido'})
+            return
+
+        cnpj, erro = _validar_cnpj_informado(scope['path'], data)
+        if erro:
+            await _responder_json_asgi(send, 200, erro)
+            return
+
+        print(f"🔍 [ASGI] Iniciando consulta assíncrona (prazo: {CNPJ_LOOKUP_DEADLINE}s)...")
+        prazo = time.monotonic() + CNPJ_LOOKUP_DEADLINE
+        dados_empresa = await loop_consultas_cnpj.consultar(cnpj, prazo=prazo)
+        await _responder_json_asgi(send, 200, _resposta_validacao_cnpj(dados_empresa))
+
+def _extrair_cnpjs_lote():
+    """Lê a lista de CNPJs do corpo JSON ({"cnpjs": [...]}) ou de um arquivo enviado.
+    Retorna None se o JSON não trouxer uma lista de textos ou números."""
+    arquivo = request.files.get('arquivo')
+    if arquivo:
+        texto = arquivo.read().decode('utf-8', errors='ignore')
+        # Aceita TXT (um por linha) ou CSV com outras colunas
+        return re.findall(r'\d{2}\.?\d{3}\.?\d{3}/?\d{4}-?\d{2}', texto)
+    
+    dados = request.get_json(silent=True) or {}
+    cnpjs = dados.get('cnpjs', []) if isinstance(dados, dict) else dados
+    if not isinstance(cnpjs, list):
+        return None
+    
+    lote = []
+    for cnpj in cnpjs:
+        if isinstance(cnpj, bool) or not isinstance(cnpj, (str, int)):
+            return None
+        # Números (ex.: vindos de planilhas) perdem os zeros à esquerda
+        cnpj = f"{cnpj:014d}" if isinstance(cnpj, int) else cnpj.strip()
+        if cnpj:
+            lote.append(cnpj)
+    return lote
+
+def _validar_cnpjs_localmente(cnpjs):
+    """Confere o dígito verificador de todos os CNPJs do lote de uma vez
+    (vetorizado com NumPy, se disponível; mesmo resultado de validar_cnpj)"""
+    if BULK_VALIDATION_AVAILABLE and VALIDATION_AVAILABLE:
+        validos, _ = validar_cnpjs_em_lote(cnpjs)
+        return validos.tolist()
+    return [validar_cnpj(cnpj) for cnpj in cnpjs]
+
+def _validar_cnpj_lote_item(cnpj):
+    """Consulta um CNPJ (já validado localmente) e monta a linha de resultado do lote"""
+    try:
+        dados_empresa = consultar_cnpj_com_fallback(cnpj)
+    except Exception as e:
+        print(f"❌ [LOTE] Erro ao consultar {cnpj}: {e}")
+        dados_empresa = None
+    
+    resultado = {'cnpj': cnpj, 'cnpj_limpo': limpar_cnpj(cnpj), 'valid': True, 'cnpj_validado': True}
+    if not dados_empresa:
+        resultado['message'] = 'CNPJ válido, mas dados da empresa não puderam ser obtidos'
+        return resultado
+    
+    situacao = dados_empresa.get('situacao', '').upper()
+    if situacao and situacao != 'ATIVA':
+        resultado['valid'] = False
+        resultado['message'] = f'Empresa com situação: {dados_empresa.get("situacao", "INATIVA")}'
+    else:
+        resultado['message'] = 'CNPJ válido e dados da empresa obtidos'
+    resultado['dados_empresa'] = dados_empresa
+    return resultado
+
+@app.route('/admin/validar_cnpjs_lote', methods=['POST'])
+@requires_admin
+def validar_cnpjs_lote():
+    """Valida uma lista de CNPJs e devolve os resultados em NDJSON conforme ficam prontos
+    
+    O dígito verificador é conferido localmente; as consultas às APIs rodam em
+    paralelo (até CNPJ_BATCH_CONCURRENCY por vez) e cada linha é enviada assim
+    que sua consulta termina, portanto fora da ordem de entrada.
+    """
+    cnpjs = _extrair_cnpjs_lote()
+    if cnpjs is None:
+        return jsonify({'error': 'Envie "cnpjs" como uma lista de CNPJs (texto ou número)'}), 400
+    print(f"📦 [LOTE] {len(cnpjs)} CNPJs recebidos")
+    
+    if not cnpjs:
+        return jsonify({'error': 'Nenhum CNPJ informado'}), 400
+    if len(cnpjs) > CNPJ_BATCH_MAX_ITEMS:
+        return jsonify({'error': f'Máximo de {CNPJ_BATCH_MAX_ITEMS} CNPJs por lote'}), 400
+    
+    def gerar():
+        executor = ThreadPoolExecutor(max_workers=CNPJ_BATCH_CONCURRENCY, thread_name_prefix='cnpj-lote')
+        try:
+            futuros = []
+            invalidos = []
+            for cnpj, valido in zip(cnpjs, _validar_cnpjs_localmente(cnpjs)):
+                if valido:
+                    futuros.append(executor.submit(_validar_cnpj_lote_item, cnpj))
+                else:
+                    invalidos.append(cnpj)
+            
+            for cnpj in invalidos:
+                yield json.dumps({'cnpj': cnpj, 'valid': False, 'message': 'CNPJ inválido'}, ensure_ascii=False) + '\n'
+            
+            for futuro in as_completed(futuros):
+                yield json.dumps(futuro.result(), ensure_ascii=False) + '\n'
+            print(f"✅ [LOTE] {len(cnpjs)} CNPJs processados")
+        finally:
+            # Cliente desconectado ou fim do lote: descarta o que ainda não começou
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    return Response(stream_with_context(gerar()), mimetype='application/x-ndjson')
 
 @app.route('/admin/empresa_detalhes/<path:cnpj>')
 @requires_admin
@@ -695,23 +2991,12 @@ def exportar_empresa_pdf(cnpj):
             'data_diagnostico': empresa.get('data_diagnostico', '')
         }
         
-        # Gerar PDF
-        pdf_bytes = criar_pdf_relatorio(dados_para_pdf)
-        
-        # Criar buffer para send_file
-        pdf_buffer = io.BytesIO(pdf_bytes)
-        pdf_buffer.seek(0)
-        
         # Nome do arquivo
         nome_empresa = empresa.get('razao_social', 'Empresa').replace('/', '_').replace('\\', '_')
         filename = f"Diagnostico_{nome_empresa}_{cnpj_decoded.replace('.', '').replace('/', '').replace('-', '')}.pdf"
         
-        return send_file(
-            pdf_buffer,
-            as_attachment=True,
-            download_name=filename,
-            mimetype='application/pdf'
-        )
+        # Gerar PDF (ou reaproveitar o já gerado para os mesmos dados)
+        return enviar_pdf_relatorio(dados_para_pdf, filename, empresa.get('id'))
         
     except Exception as e:
         print(f"Erro ao gerar PDF: {e}")
@@ -815,48 +3100,38 @@ def processar_questionario():
         
         print("✅ Dados validados com sucesso")
         
-        # Gerar análise
-        print("🧮 Gerando análise...")
-        analise = gerar_analise(respostas)
-        print("✅ Análise gerada")
-        
-        # Salvar no banco de dados (Supabase)
-        print("💾 Salvando no banco de dados...")
-        empresa_id, diagnostico_id = salvar_empresa_diagnostico(dados_empresa, respostas, analise)
+        chave_idempotencia = request.headers.get('Idempotency-Key') or dados.get('idempotency_key')
+        if chave_idempotencia:
+            if not CHAVE_IDEMPOTENCIA_RE.fullmatch(str(chave_idempotencia)):
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Chave de idempotência inválida'
+                }), 400
+            try:
+                dados_completos = processar_envio_idempotente(chave_idempotencia, dados_empresa, respostas)
+            except ValueError as conflito:
+                print(f"❌ [IDEMPOTENCIA] {conflito}")
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Esta chave de envio já foi usada com outras respostas'
+                }), 422
+        else:
+            dados_completos = _processar_envio_questionario(dados_empresa, respostas)
         
-        if not empresa_id or not diagnostico_id:
-            print("❌ ERRO: Falha ao salvar no banco de dados")
+        if not dados_completos:
             return jsonify({
                 'status': 'error',
                 'message': 'Erro ao salvar dados no banco. Tente novamente.'
             }), 500
         
-        print(f"✅ Dados salvos - Empresa ID: {empresa_id}, Diagnóstico ID: {diagnostico_id}")
-        
-        # Salvar dados para a página de resultado
-        dados_completos = {
-            'dados_empresa': dados_empresa,
-            'respostas': respostas,
-            'analise': analise,
-            'empresa_id': empresa_id,
-            'diagnostico_id': diagnostico_id
-        }
-        
-        # Método 1: Salvar na sessão (mais confiável para serverless)
-        try:
-            session['diagnostico_data'] = dados_completos
-            print("✅ Dados salvos na sessão")
-        except Exception as session_error:
-            print(f"⚠️ Erro ao salvar na sessão: {session_error}")
+        analise = dados_completos['analise']
+        empresa_id = dados_completos['empresa_id']
+        diagnostico_id = dados_completos['diagnostico_id']
         
-        # Método 2: Arquivo temporário (fallback)
-        try:
-            with open('temp_diagnostico.json', 'w', encoding='utf-8') as f:
-                json.dump(dados_completos, f, ensure_ascii=False, indent=2, default=str)
-            print("✅ Arquivo temporário criado")
-        except Exception as temp_error:
-            print(f"⚠️ Aviso: Erro ao criar arquivo temporário: {temp_error}")
-            # Não bloquear o processo por causa do arquivo temporário
+        # Salvar dados para a página de resultado (a sessão guarda só o ID)
+        armazem_resultados.salvar(diagnostico_id, dados_completos)
+        session['diagnostico_id'] = diagnostico_id
+        print("✅ Resultado guardado para a página de resultado")
         
         print("🎉 PROCESSAMENTO CONCLUÍDO COM SUCESSO")
         
@@ -915,58 +3190,16 @@ def processar_questionario():
 def resultado():
     """Página de resultados do diagnóstico"""
     try:
-        # Tentar diferentes formas de obter os dados
-        dados = None
-        
-        # Método 1: Verificar se há dados na sessão
-        if 'diagnostico_data' in session:
-            print("📊 Dados encontrados na sessão")
-            dados = session['diagnostico_data']
-            # Limpar da sessão após usar
-            session.pop('diagnostico_data', None)
-        
-        # Método 2: Tentar ler arquivo temporário (fallback)
-        elif os.path.exists('temp_diagnostico.json'):
-            print("📄 Lendo dados do arquivo temporário")
-            with open('temp_diagnostico.json', 'r', encoding='utf-8') as f:
-                dados = json.load(f)
-            
-            # Remover arquivo após usar
-            try:
-                os.remove('temp_diagnostico.json')
-                print("🗑️ Arquivo temporário removido")
-            except:
-                pass
-        
-        # Método 3: Tentar buscar no banco pelo ID (se disponível)
-        elif request.args.get('diagnostico_id') and supabase:
-            diagnostico_id = request.args.get('diagnostico_id')
-            print(f"🔍 Buscando diagnóstico no banco: {diagnostico_id}")
-            
-            try:
-                # Buscar diagnóstico no Supabase
-                resultado_query = supabase.table('diagnosticos').select('*, empresas(*)').eq('id', diagnostico_id).execute()
-                
-                if resultado_query.data:
-                    diagnostico = resultado_query.data[0]
-                    dados = {
-                        'dados_empresa': diagnostico['empresas'],
-                        'respostas': diagnostico['respostas'],
-                        'analise': diagnostico['analise'],
-                        'empresa_id': diagnostico['empresa_id'],
-                        'diagnostico_id': diagnostico['id']
-                    }
-                    print("✅ Dados recuperados do banco de dados")
-            except Exception as db_error:
-                print(f"❌ Erro ao buscar no banco: {db_error}")
-        
-        if dados:
-            print("✅ Renderizando página de resultado com dados")
-            print(f"🔍 DEBUG - Estrutura dos dados: {list(dados.keys()) if isinstance(dados, dict) else 'Não é dict'}")
-            if isinstance(dados, dict) and 'analise' in dados:
-                print(f"🔍 DEBUG - Analise existe: {type(dados['analise'])}")
-                print(f"🔍 DEBUG - Analise keys: {list(dados['analise'].keys()) if isinstance(dados['analise'], dict) else 'Não é dict'}")
-            return render_template('resultado.html', dados=dados)
+        # ID da URL (links compartilhados) ou do último envio desta sessão
+        diagnostico_id = request.args.get('diagnostico_id') or session.get('diagnostico_id')
+        pagina = obter_pagina_resultado(diagnostico_id) if diagnostico_id else None
+        
+        if pagina:
+            # ETag forte: reabrir o link responde 304 sem reenviar a página
+            resposta = Response(pagina['html'], mimetype='text/html')
+            resposta.set_etag(pagina['etag'])
+            resposta.headers['Cache-Control'] = 'private, no-cache'
+            return resposta.make_conditional(request)
         else:
             print("❌ Nenhum dado encontrado para resultado")
             flash('Dados do diagnóstico não encontrados. Por favor, refaça o questionário.', 'error')
@@ -996,6 +3229,8 @@ def admin_login():
                 
                 print(f"✅ [ADMIN] Login bem-sucedido (fallback) - usuário: {username}")
                 
+                # Novo ID de sessão no login (evita fixação de sessão)
+                rotacionar_id_sessao(session)
                 session['admin_user'] = {
                     'id': 'admin-local',
                     'username': username,
@@ -1028,6 +3263,7 @@ def admin_login():
                 
                 # Para simplificar, vamos aceitar a senha 'admin123' para o usuário admin
                 if username == 'admin' and password == 'admin123':
+                    rotacionar_id_sessao(session)
                     session['admin_user'] = {
                         'id': user['id'],
                         'username': user['username'],
@@ -1111,6 +3347,28 @@ def debug_stats():
     except Exception as e:
         return jsonify({'error': str(e)})
 
+# Rota de debug para acompanhar os provedores de CNPJ
+@app.route('/debug/provedores')
+def debug_provedores():
+    """Debug route com a saúde, o circuit breaker e a cota de cada provedor de CNPJ"""
+    return jsonify({
+        'ordem': [provedor.nome for provedor in _provedores_cnpj_ordenados()],
+        'provedores': {nome: saude.resumo() for nome, saude in saude_provedores.items()},
+        'limites': {nome: limitador.estado() for nome, limitador in limitadores_provedores.items()}
+    })
+
+# Rota de debug para acompanhar a fila de questionários (write-behind)
+@app.route('/debug/journal')
+def debug_journal():
+    """Debug route com os questionários ainda não gravados no Supabase"""
+    thread = _drenagem_journal['thread']
+    return jsonify({
+        'write_behind': QUESTIONARIO_WRITE_BEHIND,
+        'caminho': QUESTIONARIO_JOURNAL_PATH,
+        'drenagem_ativa': bool(thread and thread.is_alive()),
+        'pendentes': journal_questionarios.resumo()
+    })
+
 # Rota de debug para verificar arquivos estáticos
 @app.route('/debug/static')
 def debug_static():
@@ -1324,80 +3582,37 @@ def admin_empresa_detalhes(empresa_id):
 @app.route('/gerar_pdf')
 def gerar_pdf():
     try:
-        # Verificar se o arquivo existe
-        if not os.path.exists('temp_diagnostico.json'):
+        diagnostico_id = request.args.get('diagnostico_id') or session.get('diagnostico_id')
+        dados = obter_resultado_diagnostico(diagnostico_id)
+        if not dados:
             return jsonify({'error': 'Dados do diagnóstico não encontrados. Refaça o questionário.'}), 404
         
-        with open('temp_diagnostico.json', 'r', encoding='utf-8') as f:
-            dados = json.load(f)
-        
-        print(f"Dados carregados: {dados}")  # Debug
+        print(f"Dados carregados: {diagnostico_id}")  # Debug
         
-        pdf_buffer = criar_pdf_relatorio(dados)
-        print("PDF criado com sucesso")  # Debug
-        
-        return send_file(
-            io.BytesIO(pdf_buffer),
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=f'diagnostico_programa_equilibrio_{datetime.now().strftime("%Y%m%d")}.pdf'
+        return enviar_pdf_relatorio(
+            dados,
+            f'diagnostico_programa_equilibrio_{datetime.now().strftime("%Y%m%d")}.pdf',
+            dados.get('diagnostico_id')
         )
     except Exception as e:
         print(f"Erro na geração de PDF: {str(e)}")  # Debug
         return jsonify({'error': f'Erro ao gerar PDF: {str(e)}'}), 500
 
+@app.route('/relatorios/<chave>.pdf')
+def baixar_relatorio_pdf(chave):
+    """PDF em cache pela chave de conteúdo (local gravado em diagnosticos.pdf_url)"""
+    caminho = armazem_pdfs.obter(chave) if CHAVE_PDF_RE.fullmatch(chave) else None
+    if caminho is None:
+        return jsonify({'error': 'Relatório não encontrado'}), 404
+    # Conteúdo imutável: a chave muda se o relatório mudar
+    return send_file(caminho, mimetype='application/pdf', download_name=f'diagnostico_{chave[:12]}.pdf',
+                     conditional=True, etag=chave, max_age=31536000)
+
 def gerar_analise(respostas):
-    """Gera análise baseada nas respostas do questionário"""
-    
-    # Análise de saúde mental
-    questoes_criticas = 0
-    acoes_recomendadas = []
-    areas_foco = []
-    
-    # Análise questão por questão
-    if respostas.get('1') == 'alta_carga':
-        questoes_criticas += 1
-        acoes_recomendadas.append("Programa: Comunicação Não Violenta e Segurança Psicológica")
-        areas_foco.append("Saúde Mental")
-    
-    if respostas.get('2') in ['frequencia_alta', 'frequencia_moderada']:
-        questoes_criticas += 2
-        acoes_recomendadas.append("Programa: Prevenção e Manejo do Estresse Ocupacional")
-        areas_foco.append("Saúde Mental")
-    
-    if respostas.get('3') in ['critico', 'moderado']:
-        questoes_criticas += 1
-        areas_foco.append("Saúde Mental")
-    
-    if respostas.get('6') in ['frequentes', 'ocasionais']:
-        questoes_criticas += 1
-        acoes_recomendadas.append("Programa: Avaliação Ergonômica Completa")
-        areas_foco.append("Ergonomia")
-    
-    if respostas.get('7') in ['nunca', 'nao_recente']:
-        questoes_criticas += 1
-        acoes_recomendadas.append("Programa: Implementação de Ergonomia no Trabalho")
-        areas_foco.append("Ergonomia")
-    
-    # Se não há ações específicas, adicionar ações preventivas
-    if not acoes_recomendadas:
-        acoes_recomendadas.append("Programa: Promoção de Bem-estar no Trabalho")
-    
-    # Determinar nível de risco
-    if questoes_criticas >= 4:
-        nivel_risco = "Alto"
-    elif questoes_criticas >= 2:
-        nivel_risco = "Moderado" 
-    else:
-        nivel_risco = "Baixo"
-    
-    return {
-        'questoes_criticas': questoes_criticas,
-        'nivel_risco': nivel_risco,
-        'areas_foco': list(set(areas_foco)),
-        'acoes_recomendadas': list(set(acoes_recomendadas)),
-        'data_diagnostico': datetime.now().strftime("%d/%m/%Y")
-    }
+    """Gera análise baseada nas respostas do questionário (regras em analise_questionario.py)"""
+    analise = motor_analise.avaliar(respostas)
+    analise['data_diagnostico'] = datetime.now().strftime("%d/%m/%Y")
+    return analise
 
 def criar_pdf_relatorio(dados):
     """Cria um relatório PDF profissional com a logo da Belz Conecta Saúde"""
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Pontuação em lote de respostas do questionário - Programa Equilíbrio
+Execute: python pontuar_questionarios.py respostas.jsonl --saida analises.jsonl --processos 8
+
+Reavalia exportações históricas e respostas coletadas fora do formulário com
+as mesmas regras de gerar_analise() (analise_questionario.py). Entrada:
+
+    JSONL - um objeto por linha, com as respostas em "respostas" ou no próprio
+            objeto ({"1": "alta_carga", "2": "nao", ...})
+    CSV   - uma coluna por id de pergunta (cabeçalho "1", "2", ...)
+
+O arquivo é lido em blocos de --lote linhas, pontuados em paralelo por um
+pool de processos, e os resultados são gravados na ordem da entrada à medida
+que ficam prontos: o uso de memória não depende do tamanho do arquivo.
+"""
+
+import argparse
+import csv
+import io
+import itertools
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from analise_questionario import MotorAnalise, carregar_regras, np
+
+CAMPOS_ANALISE = ['questoes_criticas', 'nivel_risco', 'areas_foco', 'acoes_recomendadas']
+
+# Estado de cada processo do pool (montado uma vez por processo)
+_motor = None
+_opcoes = None
+
+
+def _iniciar_processo(regras, opcoes):
+    global _motor, _opcoes
+    _motor = MotorAnalise(regras)
+    _opcoes = opcoes
+
+
+def _avaliar(lista_respostas):
+    """Analisa as respostas do bloco; no lugar da análise de um registro com
+    problema fica a exceção, para que ele seja informado como linha com erro"""
+    try:
+        if np is not None and lista_respostas:
+            return list(_motor.resultados_lote(_motor.avaliar_lote(lista_respostas)))
+        return [_motor.avaliar(respostas) for respostas in lista_respostas]
+    except Exception:
+        # Um registro problemático derruba o bloco inteiro: avalia um a um
+        return [_avaliar_registro(respostas) for respostas in lista_respostas]
+
+
+def _avaliar_registro(respostas):
+    try:
+        return _motor.avaliar(respostas)
+    except Exception as e:
+        return e
+
+
+def _registros_jsonl(linhas, primeira_linha):
+    """Converte linhas JSONL em (número da linha, registro, respostas ou erro)"""
+    for numero, linha in enumerate(linhas, primeira_linha):
+        if not linha.strip():
+            continue
+        try:
+            registro = json.loads(linha)
+            respostas = registro.get('respostas', registro) if isinstance(registro, dict) else None
+            if not isinstance(respostas, dict):
+                raise ValueError('objeto de respostas não encontrado')
+            yield numero, registro, {str(chave): valor for chave, valor in respostas.items()}
+        except ValueError as e:
+            yield numero, None, f'linha inválida: {e}'
+
+
+def _registros_csv(linhas, primeira_linha, cabecalho):
+    for numero, campos in enumerate(linhas, primeira_linha):
+        registro = dict(zip(cabecalho, campos))
+        yield numero, registro, {chave: valor for chave, valor in registro.items() if valor != ''}
+
+
+def pontuar_bloco(bloco):
+    """Pontua um bloco de linhas da entrada (executado no pool)
+
+    Retorna (texto de saída, respostas pontuadas, [(linha, erro), ...]). Na
+    saída JSONL as linhas com erro também vão para o texto, como {"linha",
+    "erro"}; na saída CSV só aparecem na lista de erros.
+    """
+    primeira_linha, linhas, cabecalho = bloco
+    if cabecalho is None:
+        registros = list(_registros_jsonl(linhas, primeira_linha))
+    else:
+        registros = list(_registros_csv(linhas, primeira_linha, cabecalho))
+
+    validos = [(numero, registro, respostas) for numero, registro, respostas in registros if registro is not None]
+    analises = iter(_avaliar([respostas for _, _, respostas in validos]))
+
+    saida = io.StringIO()
+    escritor = csv.writer(saida) if _opcoes['formato_saida'] == 'csv' else None
+    pontuadas = 0
+    erros = []
+    for numero, registro, respostas in registros:
+        erro = respostas if registro is None else None
+        if registro is not None:
+            analise = next(analises)
+            if isinstance(analise, Exception):
+                erro = f'erro ao pontuar: {analise!r}'
+        if erro is not None:
+            erros.append((numero, erro))
+            if escritor is None:
+                saida.write(json.dumps({'linha': numero, 'erro': erro}, ensure_ascii=False) + '\n')
+            continue
+        pontuadas += 1
+        mantidos = {campo: registro.get(campo) for campo in _opcoes['manter']}
+        if escritor is None:
+            saida.write(json.dumps({**mantidos, **analise}, ensure_ascii=False) + '\n')
+        else:
+            escritor.writerow([mantidos[campo] for campo in _opcoes['manter']] + [
+                analise['questoes_criticas'], analise['nivel_risco'],
+                '; '.join(analise['areas_foco']), '; '.join(analise['acoes_recomendadas'])
+            ])
+    return saida.getvalue(), pontuadas, erros
+
+
+def _gravar_bloco(resultado, saida, opcoes):
+    """Grava o texto de um bloco pontuado; na saída CSV, as linhas com erro vão para a saída de erros"""
+    texto, quantidade, erros = resultado
+    saida.write(texto)
+    if opcoes['formato_saida'] == 'csv':
+        for numero, erro in erros:
+            print(f"⚠️ Linha {numero}: {erro}", file=sys.stderr)
+    return quantidade, len(erros)
+
+
+def _blocos(arquivo, formato, tamanho):
+    """Gera (número da primeira linha, linhas, cabeçalho CSV ou None) sem ler o arquivo inteiro"""
+    if formato == 'csv':
+        leitor = csv.reader(arquivo)
+        cabecalho = [coluna.strip() for coluna in next(leitor, [])]
+        primeira_linha = 2
+    else:
+        leitor = arquivo
+        cabecalho = None
+        primeira_linha = 1
+    while True:
+        linhas = list(itertools.islice(leitor, tamanho))
+        if not linhas:
+            return
+        yield primeira_linha, linhas, cabecalho
+        primeira_linha += len(linhas)
+
+
+def _formato(caminho, informado):
+    if informado:
+        return informado
+    return 'csv' if caminho.lower().endswith('.csv') else 'jsonl'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pontua respostas do questionário (JSONL ou CSV) em lote')
+    parser.add_argument('arquivo', help="Arquivo JSONL ou CSV com as respostas ('-' para a entrada padrão)")
+    parser.add_argument('--saida', default='-', help="Arquivo de saída JSONL ou CSV (padrão: saída padrão)")
+    parser.add_argument('--formato', choices=['jsonl', 'csv'], help='Formato da entrada (padrão: pela extensão)')
+    parser.add_argument('--formato-saida', choices=['jsonl', 'csv'], help='Formato da saída (padrão: pela extensão)')
+    parser.add_argument('--regras', default=os.environ.get('QUESTIONARIO_SCORING_RULES', ''),
+                        help='Arquivo JSON de regras (padrão: QUESTIONARIO_SCORING_RULES ou as regras embutidas)')
+    parser.add_argument('--manter', default='', help='Campos da entrada copiados para a saída, separados por vírgula (ex.: id,cnpj)')
+    parser.add_argument('--processos', type=int, default=os.cpu_count() or 1, help='Processos do pool (padrão: núcleos da CPU)')
+    parser.add_argument('--lote', type=int, default=5000, help='Linhas por bloco enviado a cada processo (padrão: 5000)')
+    args = parser.parse_args()
+
+    formato = _formato(args.arquivo, args.formato)
+    opcoes = {
+        'formato_saida': _formato(args.saida, args.formato_saida),
+        'manter': [campo.strip() for campo in args.manter.split(',') if campo.strip()],
+    }
+    regras = carregar_regras(args.regras)
+
+    entrada = sys.stdin if args.arquivo == '-' else open(args.arquivo, encoding='utf-8-sig', newline='')
+    saida = sys.stdout if args.saida == '-' else open(args.saida, 'w', encoding='utf-8', newline='')
+    if opcoes['formato_saida'] == 'csv':
+        csv.writer(saida).writerow(opcoes['manter'] + CAMPOS_ANALISE)
+
+    inicio = time.time()
+    total = 0
+    erros = 0
+    # No máximo 2 blocos por processo em andamento: a leitura acompanha o ritmo do pool
+    max_pendentes = max(1, args.processos) * 2
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, args.processos), initializer=_iniciar_processo,
+                                 initargs=(regras, opcoes)) as pool:
+            pendentes = deque()
+            for bloco in _blocos(entrada, formato, args.lote):
+                pendentes.append(pool.submit(pontuar_bloco, bloco))
+                while len(pendentes) >= max_pendentes:
+                    quantidade, com_erro = _gravar_bloco(pendentes.popleft().result(), saida, opcoes)
+                    total += quantidade
+                    erros += com_erro
+            while pendentes:
+                quantidade, com_erro = _gravar_bloco(pendentes.popleft().result(), saida, opcoes)
+                total += quantidade
+                erros += com_erro
+    finally:
+        if entrada is not sys.stdin:
+            entrada.close()
+        if saida is not sys.stdout:
+            saida.close()
+
+    duracao = time.time() - inicio
+    print(f"✅ {total:,} respostas pontuadas em {duracao:.1f}s ({total / max(duracao, 1e-9):,.0f}/s, "
+          f"{args.processos} processos)" + (f" - {erros:,} linhas com erro" if erros else ''), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+"""
+Registro de provedores de dados de CNPJ - Programa Equilíbrio
+
+Cada provedor (BrasilAPI, ReceitaWS...) sabe montar a URL de consulta e
+converter a resposta para DadosEmpresa, o registro normalizado usado pela
+aplicação. O transporte (sessões, retry, prazo, circuit breaker, limite de
+taxa) fica em main.py, que percorre os provedores registrados aqui.
+
+Para adicionar um provedor: crie uma subclasse de ProvedorCNPJ, inclua-a em
+PROVEDORES_DISPONIVEIS e coloque o nome em CNPJ_PROVIDERS. Nenhuma rota
+precisa ser alterada.
+
+Este módulo não importa main.py, para poder ser usado também por
+app_test.py e pelo servidor_mock_provedores.py.
+"""
+
+from dataclasses import asdict, dataclass, field
+
+import requests
+
+
+@dataclass
+class Endereco:
+    logradouro: str = ''
+    numero: str = ''
+    complemento: str = ''
+    bairro: str = ''
+    municipio: str = ''
+    uf: str = ''
+    cep: str = ''
+
+
+@dataclass
+class DadosEmpresa:
+    """Registro normalizado de uma empresa, independente do provedor"""
+    razao_social: str
+    cnpj: str
+    nome_fantasia: str = ''
+    situacao: str = ''
+    atividade_principal: str = ''
+    endereco: Endereco = field(default_factory=Endereco)
+    telefone: str = ''
+    email: str = ''
+    data_abertura: str = ''
+
+    def para_dict(self):
+        """Formato de dicionário usado nas rotas, nos caches e no Supabase"""
+        return asdict(self)
+
+
+class ProvedorCNPJ:
+    """Interface comum dos provedores de CNPJ"""
+
+    nome = ''
+    url_padrao = ''
+    headers = {}
+    # Cota padrão do provedor (usada pelo limitador de taxa de main.py)
+    por_minuto_padrao = 60
+    rajada_padrao = 5
+
+    def __init__(self, url_base=None, timeout=15, por_minuto=None, rajada=None):
+        self.url_base = url_base or self.url_padrao
+        self.timeout = timeout
+        self.por_minuto = por_minuto if por_minuto is not None else self.por_minuto_padrao
+        self.rajada = rajada if rajada is not None else self.rajada_padrao
+
+    def url(self, cnpj_limpo):
+        return f"{self.url_base}{cnpj_limpo}"
+
+    def normalizar(self, data, cnpj_limpo):
+        """Converte o JSON do provedor em DadosEmpresa, ou None se incompleto"""
+        raise NotImplementedError
+
+    def interpretar(self, status_code, data, cnpj_limpo):
+        """Interpreta uma resposta HTTP do provedor
+
+        Retorna (dados, inexistente): dados é DadosEmpresa ou None, e
+        inexistente indica que o provedor afirmou que o CNPJ não existe
+        (usado pelo cache negativo).
+        """
+        if status_code == 200 and isinstance(data, dict):
+            return self.normalizar(data, cnpj_limpo), False
+        return None, status_code == 404
+
+    def consultar(self, cnpj_limpo, sessao=None):
+        """Consulta simples, sem retry nem prazo (scripts e app_test.py)"""
+        response = (sessao or requests).get(self.url(cnpj_limpo), headers=self.headers, timeout=self.timeout)
+        try:
+            data = response.json()
+        except ValueError:
+            data = None
+        dados, _ = self.interpretar(response.status_code, data, cnpj_limpo)
+        return dados
+
+
+class BrasilAPI(ProvedorCNPJ):
+    nome = 'BrasilAPI'
+    url_padrao = 'https://brasilapi.com.br/api/cnpj/v1/'
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+    }
+    por_minuto_padrao = 120
+    rajada_padrao = 10
+
+    def normalizar(self, data, cnpj_limpo):
+        # Verifica se tem dados essenciais
+        if not data.get('legal_name'):
+            return None
+
+        endereco = data.get('address') or {}
+        return DadosEmpresa(
+            razao_social=data.get('legal_name', ''),
+            nome_fantasia=data.get('trade_name', ''),
+            cnpj=cnpj_limpo,
+            situacao=data.get('registration_status', ''),
+            atividade_principal='',  # BrasilAPI tem estrutura diferente
+            endereco=Endereco(
+                logradouro=endereco.get('street', ''),
+                numero=endereco.get('number', ''),
+                complemento=endereco.get('details', ''),
+                bairro=endereco.get('district', ''),
+                municipio=endereco.get('city', ''),
+                uf=endereco.get('state', ''),
+                cep=endereco.get('zip_code', '')
+            ),
+            telefone=data.get('phone', ''),
+            email=data.get('email', ''),
+            data_abertura=data.get('founded', '')
+        )
+
+
+class ReceitaWS(ProvedorCNPJ):
+    nome = 'ReceitaWS'
+    url_padrao = 'https://www.receitaws.com.br/v1/cnpj/'
+    # Plano gratuito: 3 consultas por minuto
+    por_minuto_padrao = 3
+    rajada_padrao = 3
+
+    def interpretar(self, status_code, data, cnpj_limpo):
+        # A ReceitaWS responde 200 com status ERROR para CNPJ inexistente
+        if status_code == 200 and isinstance(data, dict) and data.get('status') == 'ERROR':
+            print(f"❌ [ReceitaWS] API retornou erro: {data.get('message', 'Erro não especificado')}")
+            return None, True
+        return super().interpretar(status_code, data, cnpj_limpo)
+
+    def normalizar(self, data, cnpj_limpo):
+        atividades = data.get('atividade_principal') or [{}]
+        return DadosEmpresa(
+            razao_social=data.get('nome', ''),
+            nome_fantasia=data.get('fantasia', ''),
+            cnpj=cnpj_limpo,
+            situacao=data.get('situacao', ''),
+            atividade_principal=atividades[0].get('text', ''),
+            endereco=Endereco(
+                logradouro=data.get('logradouro', ''),
+                numero=data.get('numero', ''),
+                complemento=data.get('complemento', ''),
+                bairro=data.get('bairro', ''),
+                municipio=data.get('municipio', ''),
+                uf=data.get('uf', ''),
+                cep=data.get('cep', '')
+            ),
+            telefone=data.get('telefone', ''),
+            email=data.get('email', ''),
+            data_abertura=data.get('abertura', '')
+        )
+
+
+# Classes conhecidas, pelo nome usado em CNPJ_PROVIDERS
+PROVEDORES_DISPONIVEIS = {
+    BrasilAPI.nome: BrasilAPI,
+    ReceitaWS.nome: ReceitaWS,
+}
+
+# Provedores ativos, na ordem de preferência inicial
+_registro = {}
+
+def registrar_provedor(provedor):
+    """Registra (ou substitui) um provedor pelo nome"""
+    _registro[provedor.nome] = provedor
+    return provedor
+
+def remover_provedor(nome):
+    return _registro.pop(nome, None)
+
+def obter_provedor(nome):
+    return _registro.get(nome)
+
+def provedores_registrados():
+    """Provedores ativos, na ordem de registro"""
+    return list(_registro.values())
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Servidor local que imita os provedores de CNPJ e CEP - Programa Equilíbrio
+Execute: python servidor_mock_provedores.py --porta 8099 --latencia 300 --taxa-erro 0.05
+
+Serve as mesmas rotas da BrasilAPI, da ReceitaWS e da ViaCEP, para medir e
+testar a consulta de CNPJ sem depender das APIs reais. Para usar, aponte a
+aplicação para o servidor:
+
+    BRASILAPI_API_URL=http://localhost:8099/api/cnpj/v1/
+    RECEITAWS_API_URL=http://localhost:8099/v1/cnpj/
+    VIACEP_API_URL=http://localhost:8099/ws/
+
+As respostas vêm de gravações em --gravacoes (<pasta>/<provedor>/<chave>.json,
+com o corpo da resposta ou {"status_http": 404, "corpo": {...}}). Sem
+gravação, gera dados fictícios determinísticos para o CNPJ, ou, com --gravar,
+consulta a API real e salva a resposta para as próximas execuções.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+import requests
+from flask import Flask, jsonify
+
+from provedores_cnpj import BrasilAPI, ReceitaWS
+
+VIACEP_URL_REAL = 'https://viacep.com.br/ws/'
+
+app = Flask(__name__)
+opcoes = argparse.Namespace()
+estatisticas = {}
+_lock = threading.Lock()
+_baldes = {}
+
+
+def _fracao(chave):
+    """Número determinístico em [0, 1) derivado da chave"""
+    return int(hashlib.sha1(chave.encode()).hexdigest()[:8], 16) / 0x100000000
+
+
+def _contar(provedor, resultado):
+    with _lock:
+        contagem = estatisticas.setdefault(provedor, {})
+        contagem[resultado] = contagem.get(resultado, 0) + 1
+
+
+def _limite_excedido(provedor):
+    """Token bucket por provedor, como a cota das APIs reais"""
+    if not opcoes.limite_por_minuto:
+        return False
+    with _lock:
+        agora = time.time()
+        tokens, ultimo = _baldes.get(provedor, (opcoes.limite_por_minuto, agora))
+        tokens = min(opcoes.limite_por_minuto, tokens + (agora - ultimo) * opcoes.limite_por_minuto / 60.0)
+        if tokens < 1:
+            _baldes[provedor] = (tokens, agora)
+            return True
+        _baldes[provedor] = (tokens - 1, agora)
+        return False
+
+
+def _simular_rede(provedor):
+    """Aplica latência e falhas configuradas; retorna uma resposta de erro ou None"""
+    atraso = max(0.0, random.gauss(opcoes.latencia, opcoes.jitter)) / 1000.0
+    time.sleep(atraso)
+
+    if _limite_excedido(provedor) or random.random() < opcoes.taxa_429:
+        _contar(provedor, '429')
+        resposta = jsonify({'message': 'Too Many Requests'})
+        resposta.status_code = 429
+        resposta.headers['Retry-After'] = str(opcoes.retry_after)
+        return resposta
+    if random.random() < opcoes.taxa_erro:
+        _contar(provedor, '503')
+        resposta = jsonify({'message': 'Service Unavailable'})
+        resposta.status_code = 503
+        return resposta
+    return None
+
+
+def _caminho_gravacao(provedor, chave):
+    return os.path.join(opcoes.gravacoes, provedor, f'{chave}.json')
+
+
+def _ler_gravacao(provedor, chave):
+    caminho = _caminho_gravacao(provedor, chave)
+    if not opcoes.gravacoes or not os.path.exists(caminho):
+        return None
+    with open(caminho, encoding='utf-8') as arquivo:
+        gravacao = json.load(arquivo)
+    if isinstance(gravacao, dict) and 'status_http' in gravacao:
+        return gravacao['status_http'], gravacao.get('corpo')
+    return 200, gravacao
+
+
+def _gravar_da_api_real(provedor, chave, url):
+    response = requests.get(url, headers=BrasilAPI.headers, timeout=30)
+    try:
+        corpo = response.json()
+    except ValueError:
+        corpo = {'texto': response.text}
+    caminho = _caminho_gravacao(provedor, chave)
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    with open(caminho, 'w', encoding='utf-8') as arquivo:
+        json.dump({'status_http': response.status_code, 'corpo': corpo}, arquivo, ensure_ascii=False, indent=2)
+    print(f"💾 Gravado {provedor}/{chave} (HTTP {response.status_code})")
+    return response.status_code, corpo
+
+
+def _responder(provedor, chave, url_real, gerar):
+    erro = _simular_rede(provedor)
+    if erro is not None:
+        return erro
+
+    resposta = _ler_gravacao(provedor, chave)
+    if resposta is None and opcoes.gravar:
+        resposta = _gravar_da_api_real(provedor, chave, url_real)
+    if resposta is None:
+        resposta = gerar(chave)
+
+    status_http, corpo = resposta
+    _contar(provedor, str(status_http))
+    saida = jsonify(corpo)
+    saida.status_code = status_http
+    return saida
+
+
+def _empresa_ficticia(cnpj):
+    """Dados fictícios e determinísticos para um CNPJ"""
+    numero = int(cnpj[:8]) if cnpj[:8].isdigit() else 0
+    return {
+        'nome': f'EMPRESA FICTICIA {cnpj[:8]} LTDA',
+        'fantasia': f'FICTICIA {numero % 1000}',
+        'situacao': 'ATIVA' if _fracao('situacao' + cnpj) >= opcoes.taxa_inativa else 'BAIXADA',
+        'logradouro': f'RUA DE TESTE {numero % 500}',
+        'numero': str(numero % 2000),
+        'bairro': 'CENTRO',
+        'municipio': 'SAO PAULO',
+        'uf': 'SP',
+        'cep': '01001-000',
+        'telefone': '(11) 4000-0000',
+        'email': f'contato{cnpj[:8]}@exemplo.com.br',
+        'abertura': '2010-01-01',
+        'atividade': 'Atividades de consultoria em gestão empresarial',
+    }
+
+
+def _inexistente(cnpj):
+    return len(cnpj) != 14 or _fracao('inexistente' + cnpj) < opcoes.taxa_nao_encontrado
+
+
+def _gerar_brasilapi(cnpj):
+    if _inexistente(cnpj):
+        return 404, {'message': f'CNPJ {cnpj} não encontrado.', 'type': 'not_found'}
+    empresa = _empresa_ficticia(cnpj)
+    return 200, {
+        'cnpj': cnpj,
+        'legal_name': empresa['nome'],
+        'trade_name': empresa['fantasia'],
+        'registration_status': empresa['situacao'],
+        'address': {
+            'street': empresa['logradouro'],
+            'number': empresa['numero'],
+            'details': '',
+            'district': empresa['bairro'],
+            'city': empresa['municipio'],
+            'state': empresa['uf'],
+            'zip_code': empresa['cep'].replace('-', ''),
+        },
+        'phone': empresa['telefone'],
+        'email': empresa['email'],
+        'founded': empresa['abertura'],
+    }
+
+
+def _gerar_receita_ws(cnpj):
+    if _inexistente(cnpj):
+        return 200, {'status': 'ERROR', 'message': 'CNPJ inválido'}
+    empresa = _empresa_ficticia(cnpj)
+    return 200, {
+        'status': 'OK',
+        'cnpj': cnpj,
+        'nome': empresa['nome'],
+        'fantasia': empresa['fantasia'],
+        'situacao': empresa['situacao'],
+        'atividade_principal': [{'code': '70.20-4-00', 'text': empresa['atividade']}],
+        'logradouro': empresa['logradouro'],
+        'numero': empresa['numero'],
+        'complemento': '',
+        'bairro': empresa['bairro'],
+        'municipio': empresa['municipio'],
+        'uf': empresa['uf'],
+        'cep': empresa['cep'],
+        'telefone': empresa['telefone'],
+        'email': empresa['email'],
+        'abertura': '01/01/2010',
+    }
+
+
+def _gerar_viacep(cep):
+    if len(cep) != 8:
+        return 400, {'erro': True}
+    return 200, {
+        'cep': f'{cep[:5]}-{cep[5:]}',
+        'logradouro': 'Praça da Sé',
+        'complemento': 'lado ímpar',
+        'bairro': 'Sé',
+        'localidade': 'São Paulo',
+        'uf': 'SP',
+        'ibge': '3550308',
+    }
+
+
+@app.route('/api/cnpj/v1/<cnpj>')
+def brasilapi(cnpj):
+    return _responder('brasilapi', cnpj, f'{BrasilAPI.url_padrao}{cnpj}', _gerar_brasilapi)
+
+
+@app.route('/v1/cnpj/<cnpj>')
+def receita_ws(cnpj):
+    return _responder('receitaws', cnpj, f'{ReceitaWS.url_padrao}{cnpj}', _gerar_receita_ws)
+
+
+@app.route('/ws/<cep>/json/')
+def viacep(cep):
+    return _responder('viacep', cep, f'{VIACEP_URL_REAL}{cep}/json/', _gerar_viacep)
+
+
+@app.route('/_mock/estatisticas')
+def ver_estatisticas():
+    """Respostas servidas por provedor e status HTTP"""
+    with _lock:
+        return jsonify(estatisticas)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor local que imita BrasilAPI, ReceitaWS e ViaCEP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--porta', type=int, default=8099)
+    parser.add_argument('--gravacoes', default='', help='Pasta com respostas gravadas (<provedor>/<chave>.json)')
+    parser.add_argument('--gravar', action='store_true', help='Sem gravação, consulta a API real e grava a resposta')
+    parser.add_argument('--latencia', type=float, default=200.0, help='Latência média em ms (padrão: 200)')
+    parser.add_argument('--jitter', type=float, default=50.0, help='Desvio padrão da latência em ms (padrão: 50)')
+    parser.add_argument('--taxa-erro', type=float, default=0.0, help='Fração de respostas 503 (0 a 1)')
+    parser.add_argument('--taxa-429', type=float, default=0.0, help='Fração de respostas 429 aleatórias (0 a 1)')
+    parser.add_argument('--limite-por-minuto', type=float, default=0.0,
+                        help='Cota por provedor; acima dela responde 429 (0 = sem cota)')
+    parser.add_argument('--retry-after', type=int, default=1, help='Valor do cabeçalho Retry-After nos 429')
+    parser.add_argument('--taxa-nao-encontrado', type=float, default=0.0,
+                        help='Fração de CNPJs fictícios tratados como inexistentes (0 a 1)')
+    parser.add_argument('--taxa-inativa', type=float, default=0.0,
+                        help='Fração de empresas fictícias com situação BAIXADA (0 a 1)')
+    parser.parse_args(namespace=opcoes)
+
+    print(f"🧪 Servidor mock de provedores em http://{opcoes.host}:{opcoes.porta}")
+    print(f"   Latência: {opcoes.latencia:.0f}±{opcoes.jitter:.0f}ms | erro: {opcoes.taxa_erro:.0%} | "
+          f"429: {opcoes.taxa_429:.0%} | cota: {opcoes.limite_por_minuto or 'sem limite'}")
+    print(f"   BRASILAPI_API_URL=http://{opcoes.host}:{opcoes.porta}/api/cnpj/v1/")
+    print(f"   RECEITAWS_API_URL=http://{opcoes.host}:{opcoes.porta}/v1/cnpj/")
+    print(f"   VIACEP_API_URL=http://{opcoes.host}:{opcoes.porta}/ws/")
+    app.run(host=opcoes.host, port=opcoes.porta, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+
+"""
+Sessão do Flask guardada no servidor - Programa Equilíbrio
+
+Com a sessão padrão do Flask todo o conteúdo vai no cookie, assinado e
+reenviado a cada requisição. Aqui o cookie leva só um ID opaco e aleatório;
+os dados ficam em um armazenamento:
+
+    memoria - dicionário no processo (um worker; também usado nos testes)
+    sqlite  - arquivo SQLite compartilhado pelos workers do mesmo servidor
+    redis   - qualquer servidor compatível com Redis (vários servidores)
+
+A expiração no armazenamento (PERMANENT_SESSION_LIFETIME) é renovada a cada
+acesso, como faz o cookie do Flask com SESSION_REFRESH_EACH_REQUEST: só
+expira a sessão que ficou esse tempo sem uso.
+
+Uso em main.py: app.session_interface = criar_interface_sessao(...); após o
+login, rotacionar_id_sessao(session) troca o ID da sessão.
+"""
+
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+# Mesmo formato da sessão em cookie do Flask (preserva datetime, bytes, tuplas...)
+serializador = TaggedJSONSerializer()
+
+
+class SessaoServidor(CallbackDict, SessionMixin):
+    def __init__(self, dados=None, sid=None, nova=False):
+        def ao_alterar(sessao):
+            sessao.modified = True
+
+        super().__init__(dados, ao_alterar)
+        self.sid = sid
+        self.sid_anterior = None
+        self.new = nova
+        self.modified = False
+
+
+def rotacionar_id_sessao(sessao):
+    """Troca o ID da sessão mantendo os dados (ex.: após o login, contra
+    fixação de sessão); o ID antigo é removido do armazenamento ao salvar.
+    Na sessão em cookie do Flask não há ID e nada é feito."""
+    if isinstance(sessao, SessaoServidor):
+        if sessao.sid_anterior is None and not sessao.new:
+            sessao.sid_anterior = sessao.sid
+        sessao.sid = secrets.token_urlsafe(32)
+        sessao.modified = True
+
+
+class ArmazenamentoSessaoMemoria:
+    """Sessões em um dicionário do processo"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessoes = {}
+        self._proxima_limpeza = time.time() + 60
+
+    def obter(self, sid):
+        agora = time.time()
+        with self._lock:
+            item = self._sessoes.get(sid)
+            if item is None:
+                return None
+            expira_em, dados = item
+            if expira_em < agora:
+                del self._sessoes[sid]
+                return None
+            return serializador.loads(dados)
+
+    def salvar(self, sid, dados, ttl):
+        agora = time.time()
+        with self._lock:
+            self._sessoes[sid] = (agora + ttl, serializador.dumps(dados))
+            if agora >= self._proxima_limpeza:
+                self._sessoes = {chave: item for chave, item in self._sessoes.items() if item[0] >= agora}
+                self._proxima_limpeza = agora + 60
+
+    def renovar(self, sid, ttl):
+        with self._lock:
+            item = self._sessoes.get(sid)
+            if item is not None:
+                self._sessoes[sid] = (time.time() + ttl, item[1])
+
+    def remover(self, sid):
+        with self._lock:
+            self._sessoes.pop(sid, None)
+
+
+class ArmazenamentoSessaoSQLite:
+    """Sessões em um arquivo SQLite (modo WAL), compartilhado entre os workers"""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _conexao(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.caminho, timeout=5, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sessoes (
+                    sid TEXT PRIMARY KEY,
+                    dados TEXT NOT NULL,
+                    expira_em REAL NOT NULL
+                )
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_sessoes_expira ON sessoes(expira_em)')
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def obter(self, sid):
+        with self._lock:
+            row = self._conexao().execute(
+                'SELECT dados FROM sessoes WHERE sid = ? AND expira_em >= ?', (sid, time.time())
+            ).fetchone()
+        return serializador.loads(row[0]) if row else None
+
+    def salvar(self, sid, dados, ttl):
+        agora = time.time()
+        with self._lock:
+            conn = self._conexao()
+            conn.execute('INSERT OR REPLACE INTO sessoes (sid, dados, expira_em) VALUES (?, ?, ?)',
+                         (sid, serializador.dumps(dados), agora + ttl))
+            # Limpeza das expiradas em uma pequena fração das gravações
+            if secrets.randbelow(100) == 0:
+                conn.execute('DELETE FROM sessoes WHERE expira_em < ?', (agora,))
+            conn.commit()
+
+    def renovar(self, sid, ttl):
+        with self._lock:
+            conn = self._conexao()
+            conn.execute('UPDATE sessoes SET expira_em = ? WHERE sid = ?', (time.time() + ttl, sid))
+            conn.commit()
+
+    def remover(self, sid):
+        with self._lock:
+            conn = self._conexao()
+            conn.execute('DELETE FROM sessoes WHERE sid = ?', (sid,))
+            conn.commit()
+
+
+class ArmazenamentoSessaoRedis:
+    """Sessões em um servidor compatível com Redis (expiração pelo próprio Redis)"""
+
+    def __init__(self, url, prefixo='programaequilibrio:sessao:', cliente=None):
+        if cliente is None:
+            if not REDIS_AVAILABLE:
+                raise RuntimeError('SESSION_BACKEND=redis requer o pacote redis (pip install redis)')
+            cliente = redis.Redis.from_url(url)
+        self.cliente = cliente
+        self.prefixo = prefixo
+
+    def obter(self, sid):
+        dados = self.cliente.get(self.prefixo + sid)
+        if dados is None:
+            return None
+        return serializador.loads(dados.decode('utf-8') if isinstance(dados, bytes) else dados)
+
+    def salvar(self, sid, dados, ttl):
+        self.cliente.setex(self.prefixo + sid, max(1, int(ttl)), serializador.dumps(dados))
+
+    def renovar(self, sid, ttl):
+        self.cliente.expire(self.prefixo + sid, max(1, int(ttl)))
+
+    def remover(self, sid):
+        self.cliente.delete(self.prefixo + sid)
+
+
+class InterfaceSessaoServidor(SessionInterface):
+    """SessionInterface do Flask que guarda os dados no armazenamento e só o ID no cookie
+
+    Sessões não alteradas têm só a expiração renovada, no máximo uma vez a
+    cada décimo do tempo de vida (e a cada minuto) por worker. Falhas do
+    armazenamento são registradas e não derrubam a requisição.
+    """
+
+    # IDs renovados recentemente por este worker (limita as escritas)
+    max_renovacoes_lembradas = 10000
+
+    def __init__(self, armazenamento):
+        self.armazenamento = armazenamento
+        self._renovacoes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and len(sid) <= 128:
+            try:
+                dados = self.armazenamento.obter(sid)
+            except Exception as e:
+                print(f"⚠️ [SESSAO] Erro ao ler sessão: {e}")
+                dados = None
+            if dados is not None:
+                return SessaoServidor(dados, sid=sid)
+        # ID novo a cada sessão criada (nunca reaproveita um ID vindo do cliente)
+        return SessaoServidor(sid=secrets.token_urlsafe(32), nova=True)
+
+    def _executar(self, operacao, *args):
+        """Executa uma operação do armazenamento; False se ele falhar"""
+        try:
+            operacao(*args)
+            return True
+        except Exception as e:
+            print(f"⚠️ [SESSAO] Erro no armazenamento de sessões: {e}")
+            return False
+
+    def _renovar(self, sid, ttl):
+        """Renova a expiração de uma sessão sem alterações, com limite de frequência"""
+        agora = time.time()
+        intervalo = min(ttl / 10, 60)
+        with self._lock:
+            ultima = self._renovacoes.get(sid)
+            if ultima is not None and agora - ultima < intervalo:
+                return
+            self._renovacoes[sid] = agora
+            self._renovacoes.move_to_end(sid)
+            while len(self._renovacoes) > self.max_renovacoes_lembradas:
+                self._renovacoes.popitem(last=False)
+        self._executar(self.armazenamento.renovar, sid, ttl)
+
+    def save_session(self, app, session, response):
+        nome = self.get_cookie_name(app)
+        dominio = self.get_cookie_domain(app)
+        caminho = self.get_cookie_path(app)
+
+        if session.sid_anterior is not None:
+            self._executar(self.armazenamento.remover, session.sid_anterior)
+
+        if not session:
+            if session.modified:
+                self._executar(self.armazenamento.remover, session.sid)
+                response.delete_cookie(nome, domain=dominio, path=caminho)
+            return
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        ttl = app.permanent_session_lifetime.total_seconds()
+        if not self.should_set_cookie(app, session):
+            if app.config['SESSION_REFRESH_EACH_REQUEST']:
+                self._renovar(session.sid, ttl)
+            return
+
+        if not self._executar(self.armazenamento.salvar, session.sid, dict(session), ttl):
+            # Sem os dados gravados o cookie apontaria para uma sessão inexistente
+            return
+        with self._lock:
+            self._renovacoes[session.sid] = time.time()
+            self._renovacoes.move_to_end(session.sid)
+        response.set_cookie(
+            nome,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=dominio,
+            path=caminho,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+
+def criar_interface_sessao(backend, caminho_sqlite=None, url_redis=None):
+    """Interface de sessão para SESSION_BACKEND (memoria, sqlite ou redis)"""
+    if backend == 'memoria':
+        armazenamento = ArmazenamentoSessaoMemoria()
+    elif backend == 'sqlite':
+        armazenamento = ArmazenamentoSessaoSQLite(caminho_sqlite)
+    elif backend == 'redis':
+        armazenamento = ArmazenamentoSessaoRedis(url_redis)
+    else:
+        raise ValueError(f"SESSION_BACKEND desconhecido: {backend}")
+    return InterfaceSessaoServidor(armazenamento)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Validação de CNPJs em lote (NumPy) - Programa Equilíbrio
+Execute: python validacao_cnpj.py planilha.csv --coluna cnpj
+
+validar_cnpjs_em_lote() confere os dígitos verificadores de um vetor inteiro
+de CNPJs de uma vez, com o mesmo resultado de validar_cnpj() de main.py
+(formatação ignorada, 14 dígitos, dígitos repetidos recusados), para
+planilhas e para o dump da Receita Federal.
+"""
+
+import argparse
+import csv
+import sys
+import time
+
+import numpy as np
+
+PESOS_PRIMEIRO_DV = np.array([5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2], dtype=np.int64)
+PESOS_SEGUNDO_DV = np.array([6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2], dtype=np.int64)
+
+
+def _como_texto(cnpjs):
+    """Converte a entrada em um vetor de strings Unicode de largura fixa
+
+    Números (como vêm de planilhas, sem os zeros à esquerda) são completados
+    com zeros até 14 dígitos; None e NaN viram string vazia.
+    """
+    valores = np.asarray(cnpjs)
+    if valores.dtype.kind in 'iu':
+        return np.char.zfill(valores.astype('U'), 14)
+    if valores.dtype.kind == 'U':
+        return valores
+    if valores.dtype.kind == 'S':
+        return np.char.decode(valores, 'latin-1')
+
+    def converter(valor):
+        if valor is None or (isinstance(valor, float) and valor != valor):
+            return ''
+        if isinstance(valor, (int, np.integer)):
+            return str(valor).zfill(14)
+        return str(valor)
+
+    return np.array([converter(valor) for valor in valores.ravel()], dtype='U')
+
+
+def validar_cnpjs_em_lote(cnpjs):
+    """Valida um vetor de CNPJs (lista, array NumPy ou coluna do pandas)
+
+    Retorna (validos, chaves): validos é um array booleano e chaves é um array
+    com os 14 dígitos de cada CNPJ ('' quando a entrada não tem 14 dígitos).
+    """
+    texto = _como_texto(cnpjs)
+    quantidade = texto.shape[0]
+    if quantidade == 0:
+        return np.zeros(0, dtype=bool), np.zeros(0, dtype='U14')
+
+    # Cada caractere vira um código Unicode (uint32) em uma matriz n x largura
+    largura = max(texto.dtype.itemsize // 4, 1)
+    codigos = np.ascontiguousarray(texto, dtype=f'U{largura}').view(np.uint32).reshape(quantidade, largura)
+
+    eh_digito = (codigos >= 48) & (codigos <= 57)
+    tem_14_digitos = eh_digito.sum(axis=1) == 14
+
+    # Dígitos das linhas com exatamente 14 dígitos, na ordem em que aparecem
+    digitos = (codigos[eh_digito & tem_14_digitos[:, None]] - 48).astype(np.int64).reshape(-1, 14)
+
+    resto = (digitos[:, :12] @ PESOS_PRIMEIRO_DV) % 11
+    primeiro_dv = np.where(resto < 2, 0, 11 - resto)
+    resto = (digitos[:, :13] @ PESOS_SEGUNDO_DV) % 11
+    segundo_dv = np.where(resto < 2, 0, 11 - resto)
+
+    repetidos = (digitos == digitos[:, :1]).all(axis=1)
+    confere = (digitos[:, 12] == primeiro_dv) & (digitos[:, 13] == segundo_dv) & ~repetidos
+
+    validos = np.zeros(quantidade, dtype=bool)
+    validos[tem_14_digitos] = confere
+
+    chaves = np.zeros(quantidade, dtype='U14')
+    chaves[tem_14_digitos] = (digitos + 48).astype(np.uint32).view('U14').ravel()
+    return validos, chaves
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Valida os CNPJs de um CSV (ou de um arquivo com um CNPJ por linha)')
+    parser.add_argument('arquivo', help='CSV ou TXT com os CNPJs')
+    parser.add_argument('--coluna', help='Nome da coluna com o CNPJ (padrão: primeira coluna)')
+    parser.add_argument('--delimitador', default=None, help='Delimitador do CSV (padrão: detectado)')
+    parser.add_argument('--invalidos', help='Grava os CNPJs inválidos neste arquivo, um por linha')
+    args = parser.parse_args()
+
+    with open(args.arquivo, encoding='utf-8-sig', errors='replace', newline='') as arquivo:
+        amostra = arquivo.read(4096)
+        arquivo.seek(0)
+        delimitador = args.delimitador or (csv.Sniffer().sniff(amostra, delimiters=',;\t|').delimiter if amostra.strip() else ',')
+        leitor = csv.reader(arquivo, delimiter=delimitador)
+        if args.coluna:
+            cabecalho = next(leitor, [])
+            if args.coluna not in cabecalho:
+                print(f"❌ Coluna '{args.coluna}' não encontrada. Colunas: {cabecalho}")
+                sys.exit(1)
+            indice = cabecalho.index(args.coluna)
+        else:
+            indice = 0
+        cnpjs = [linha[indice] if len(linha) > indice else '' for linha in leitor]
+
+    inicio = time.time()
+    validos, chaves = validar_cnpjs_em_lote(cnpjs)
+    duracao = time.time() - inicio
+
+    total = len(cnpjs)
+    print(f"✅ {int(validos.sum()):,} válidos de {total:,} ({duracao:.2f}s, {total / max(duracao, 1e-9):,.0f} CNPJs/s)")
+    print(f"🔁 {len(np.unique(chaves[validos])):,} CNPJs válidos distintos")
+
+    if args.invalidos:
+        with open(args.invalidos, 'w', encoding='utf-8') as saida:
+            for indice_invalido in np.flatnonzero(~validos):
+                saida.write(f"{cnpjs[indice_invalido]}\n")
+        print(f"📝 Inválidos gravados em {args.invalidos}")
+
+
+if __name__ == "__main__":
+    main()